@@ -0,0 +1,72 @@
+"""
+Benchmark of the FJJAM.DB record decoders on synthetic databases.
+
+Compares the generic Construct decoder with the fast path, and checks they give the same objects
+and that truncated databases fail with the error of their parse.
+
+Usage: python benchmarks/bench_db_decoder.py [--records 1000 5000] [--repeat 3]
+   or: python -m benchmarks.bench_db_decoder [--records 1000 5000] [--repeat 3], from the repo root
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+# The repo root, so the benchmark also runs as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic_fjjam import build_fjjam_db
+from util.db import extract_jam_objects
+
+def to_plain(value):
+    # Construct containers and the fast path's named tuples compare as plain dictionaries
+    if hasattr(value, "_asdict"):
+        value = value._asdict()
+    if isinstance(value, dict):
+        return {key: to_plain(item) for key, item in value.items() if not key.startswith("_")}
+    return value
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the FJJAM.DB record decoders.')
+    parser.add_argument('--records', type=int, nargs='+', default=[1000, 5000], help='Number of records of each database.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs, the best one is reported.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        print(f"{'records':>8} {'generic':>10} {'fast':>10} {'speedup':>8}")
+        for num_records in args.records:
+            fjjam_path = os.path.join(temp_directory, f"FJJAM_{num_records}.DB")
+            build_fjjam_db(fjjam_path, num_records, seed=num_records, delta_depth=2)
+
+            generic = [to_plain(obj) for obj in extract_jam_objects(fjjam_path, fast=False)]
+            fast = [to_plain(obj) for obj in extract_jam_objects(fjjam_path, fast=True)]
+            if generic != fast:
+                raise AssertionError(f"Decoders disagree on the {num_records} records database.")
+
+            generic_time = min(timeit.repeat(lambda: extract_jam_objects(fjjam_path, fast=False), number=1, repeat=args.repeat))
+            fast_time = min(timeit.repeat(lambda: extract_jam_objects(fjjam_path, fast=True), number=1, repeat=args.repeat))
+            print(f"{num_records:>8} {generic_time:>9.3f}s {fast_time:>9.3f}s {generic_time / fast_time:>7.1f}x")
+
+        check_truncated_db(temp_directory)
+
+def check_truncated_db(temp_directory):
+    # A truncated database must fail with the error of the parse, not one of closing the store
+    fjjam_path = os.path.join(temp_directory, "FJJAM.DB")
+    build_fjjam_db(fjjam_path, 50, seed=1, delta_depth=2)
+    with open(fjjam_path, 'rb') as f:
+        content = f.read()
+    truncated_path = os.path.join(temp_directory, "FJJAM_truncated.DB")
+    for size in range(0, len(content), 53):
+        with open(truncated_path, 'wb') as f:
+            f.write(content[:size])
+        try:
+            extract_jam_objects(truncated_path, toc_cache=False)
+        except BufferError as e:
+            raise AssertionError(f"Closing the store hid the error of the {size} bytes truncated database.") from e
+        except Exception:
+            pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark of the extraction of a synthetic D/F dump, with one worker process and with several.
+
+Checks that the apps get the same names and contents whatever the order the game folders are listed in,
+including apps sharing the same name, and whatever the number of worker processes.
+
+Usage: python benchmarks/bench_extraction.py [--apps 200] [--jobs 4] [--shuffles 3]
+   or: python -m benchmarks.bench_extraction [--apps 200] [--jobs 4] [--shuffles 3], from the repo root
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+
+# The repo root, so the benchmark also runs as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from phonetypes.DFType import DFType
+from util.manifest import file_digest
+
+class ShuffledDFType(DFType):
+    """
+    D/F phone type listing its game folders in a random order, like os.listdir may on another file system.
+    """
+
+    def __init__(self, seed):
+        super().__init__()
+        self.rng = random.Random(seed)
+
+    def list_apps(self, top_folder_directory, verbose=False):
+        apps = super().list_apps(top_folder_directory, verbose=verbose)
+        self.rng.shuffle(apps)
+        return apps
+
+def build_df_dump(top_folder_directory, num_apps, seed=0):
+    rng = random.Random(seed)
+    for idx in range(num_apps):
+        folder = os.path.join(top_folder_directory, f"{idx:02}")
+        os.makedirs(folder)
+        # Every fourth app has the name of another one, so names get suffixes
+        name = f"game{idx // 4 * 4 if idx % 4 == 1 else idx}"
+        sp_sizes = [rng.choice([100, 200, 400]) for _ in range(rng.randint(1, 3))]
+        with open(os.path.join(folder, "jam"), 'w', encoding='cp932', newline='\r\n') as f:
+            f.write(f"AppName = App{idx}\nAppVer = 1.0\nPackageURL = http://example.jp/{idx}/{name}.jar\nAppClass = Main\n"
+                    f"SPsize = {','.join(map(str, sp_sizes))}\nLastModified = Mon, 01 Jan 2007 12:00:00\n")
+        with zipfile.ZipFile(os.path.join(folder, "jar"), 'w', zipfile.ZIP_DEFLATED) as jar:
+            jar.writestr("Main.class", bytes(rng.randrange(256) for _ in range(256)))
+        for sp_idx, sp_size in enumerate(sp_sizes):
+            with open(os.path.join(folder, f"sp{sp_idx}"), 'wb') as f:
+                f.write(bytes(rng.randrange(256) for _ in range(sp_size)))
+
+def extract(phone_type, top_folder_directory, target_directory, jobs):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        phone_type.extract(top_folder_directory, jobs=jobs, incremental=False, target_directory=target_directory, verify_outputs_mode=None)
+    seconds = time.perf_counter() - start
+    outputs = {name: file_digest(os.path.join(target_directory, name)) for name in os.listdir(target_directory) if not name.startswith(".")}
+    return outputs, seconds
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the extraction of a synthetic D/F dump.')
+    parser.add_argument('--apps', type=int, default=200, help='Number of apps of the dump.')
+    parser.add_argument('--jobs', type=int, default=4, help='Number of worker processes of the parallel extraction.')
+    parser.add_argument('--shuffles', type=int, default=3, help='Number of extractions with shuffled listings.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        top_folder_directory = os.path.join(temp_directory, "top")
+        build_df_dump(top_folder_directory, args.apps, seed=args.apps)
+
+        expected, sequential_time = extract(DFType(), top_folder_directory, os.path.join(temp_directory, "sequential"), 1)
+        outputs, parallel_time = extract(DFType(), top_folder_directory, os.path.join(temp_directory, "parallel"), args.jobs)
+        if outputs != expected:
+            raise AssertionError(f"Extraction with {args.jobs} jobs gives other outputs than with one.")
+
+        for seed in range(args.shuffles):
+            for jobs in (1, args.jobs):
+                outputs, _ = extract(ShuffledDFType(seed), top_folder_directory, os.path.join(temp_directory, f"shuffled_{seed}_{jobs}"), jobs)
+                if outputs != expected:
+                    raise AssertionError(f"Extraction of a listing shuffled with seed {seed} with {jobs} jobs gives other outputs.")
+
+        print(f"{'apps':>8} {'1 job':>10} {f'{args.jobs} jobs':>10} {'speedup':>8}")
+        print(f"{args.apps:>8} {sequential_time:>9.3f}s {parallel_time:>9.3f}s {sequential_time / parallel_time:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
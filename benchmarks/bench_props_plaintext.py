@@ -0,0 +1,79 @@
+"""
+Benchmark of the plaintext JAM parser on synthetic JAM files.
+
+Compares the parser it replaced with the current one, on first parses and on repeated ones,
+and checks they give the same properties.
+
+Usage: python benchmarks/bench_props_plaintext.py [--jams 1000] [--repeat 5]
+   or: python -m benchmarks.bench_props_plaintext [--jams 1000] [--repeat 5], from the repo root
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+# The repo root, so the benchmark also runs as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util.jam_utils import parse_props_plaintext, _parse_props_plaintext
+
+def parse_props_plaintext_previous(adf_content):
+    # The previous parser, searching every line for "=" before splitting it
+    keys = {}
+    for line in adf_content.splitlines():
+        if '=' in line:
+            name, value = line.split('=', 1)
+            if name.lower().find("spsize") != -1:
+                name = "SPsize"
+            name = name.strip()
+            if name.rfind("\x00") != -1:
+                name = name[name.rfind("\x00")+1:]
+            keys[name] = value.strip()
+    return keys
+
+def build_jam(rng, idx):
+    lines = [
+        f"AppName = アプリ{idx}",
+        "AppVer = 1.0",
+        f"PackageURL = http://example.jp/dl/app{idx}.jar?name=game{idx}",
+        f"AppSize = {rng.randint(1000, 100000)}",
+        f"SPsize = {rng.choice([1024, 2048, 4096])},{rng.choice([1024, 2048])}",
+        f"AppClass = jp.example.app{idx}.Main",
+        "ConfigurationVer = CLDC-1.1",
+        "ProfileVer = DoJa-5.0",
+        f"LastModified = Mon, 01 Jan 2007 {rng.randint(0, 23):02}:00:00",
+        "UseNetwork = http",
+        "TargetDevice = F905i",
+        "LaunchApp = yes",
+        "AppParam = -a 1 -b 2",
+    ]
+    rng.shuffle(lines)
+    return "\r\n".join(lines) + "\r\n"
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the plaintext JAM parser.')
+    parser.add_argument('--jams', type=int, default=1000, help='Number of JAM files to parse.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs, the best one is reported.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.jams)
+    jams = [build_jam(rng, idx) for idx in range(args.jams)]
+    for jam in jams:
+        if list(parse_props_plaintext_previous(jam).items()) != list(parse_props_plaintext(jam).items()):
+            raise AssertionError(f"Parsers disagree on {jam!r}.")
+
+    def parse_uncached():
+        _parse_props_plaintext.cache_clear()
+        for jam in jams:
+            parse_props_plaintext(jam)
+
+    previous_time = min(timeit.repeat(lambda: [parse_props_plaintext_previous(jam) for jam in jams], number=1, repeat=args.repeat))
+    current_time = min(timeit.repeat(parse_uncached, number=1, repeat=args.repeat))
+    cached_time = min(timeit.repeat(lambda: [parse_props_plaintext(jam) for jam in jams], number=1, repeat=args.repeat))
+    print(f"{'jams':>8} {'previous':>10} {'current':>10} {'cached':>10} {'speedup':>8}")
+    print(f"{args.jams:>8} {previous_time:>9.4f}s {current_time:>9.4f}s {cached_time:>9.4f}s {previous_time / current_time:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
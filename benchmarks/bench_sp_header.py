@@ -0,0 +1,77 @@
+"""
+Benchmark of the SP header encoding, decoding and byteswapping on random SP sizes.
+
+Compares the word by word functions they replaced with the current ones, and checks they give the same results.
+
+Usage: python benchmarks/bench_sp_header.py [--headers 10000] [--repeat 5]
+   or: python -m benchmarks.bench_sp_header [--headers 10000] [--repeat 5], from the repo root
+"""
+
+import argparse
+import os
+import random
+import struct
+import sys
+import timeit
+
+# The repo root, so the benchmark also runs as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util.jam_utils import fmt_spsize_header, read_spsize_00, swap_spsize_header_endian
+
+def fmt_spsize_header_previous(sp_size_list):
+    sp_size_header = b""
+    for sp_size in sp_size_list:
+        sp_size_header += struct.pack('<I', sp_size)
+    while len(sp_size_header) < 64:
+        sp_size_header += b"\xFF\xFF\xFF\xFF"
+    return sp_size_header
+
+def read_spsize_00_previous(adf_content, start_offset):
+    integers = []
+    extracted_bytes = adf_content[start_offset:start_offset + 64]
+    for i in range(0, len(extracted_bytes), 4):
+        integer = struct.unpack('<I', extracted_bytes[i:i + 4])[0]
+        if integer != 0xFFFFFFFF:
+            integers.append(integer)
+    return integers
+
+def swap_spsize_header_endian_previous(header_bytes):
+    swapped_header = b""
+    for i in range(0, len(header_bytes), 4):
+        chunk = header_bytes[i:i+4]
+        if chunk == b"\xFF\xFF\xFF\xFF":
+            swapped_header += chunk
+        else:
+            swapped_header += struct.pack(">I", struct.unpack("<I", chunk)[0])
+    return swapped_header
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the SP header functions.')
+    parser.add_argument('--headers', type=int, default=10000, help='Number of SP headers to process.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs, the best one is reported.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.headers)
+    sp_size_lists = [[rng.choice([1024, 2048, 4096, 10240, 102400]) for _ in range(rng.randint(1, 16))] for _ in range(args.headers)]
+    # Headers are read from the middle of ADF files, like the null delimited ones
+    adf_contents = [bytes(rng.randrange(256) for _ in range(16)) + fmt_spsize_header(sp_sizes) + b"AppName\x00" for sp_sizes in sp_size_lists]
+    headers = [fmt_spsize_header_previous(sp_sizes) for sp_sizes in sp_size_lists]
+
+    cases = [
+        ("encode", fmt_spsize_header_previous, fmt_spsize_header, sp_size_lists, ()),
+        ("decode", read_spsize_00_previous, read_spsize_00, adf_contents, (16,)),
+        ("byteswap", swap_spsize_header_endian_previous, swap_spsize_header_endian, headers, ()),
+    ]
+
+    print(f"{'function':>10} {'previous':>10} {'current':>10} {'speedup':>8}")
+    for name, previous, current, inputs, extra_args in cases:
+        for value in inputs:
+            if previous(value, *extra_args) != current(value, *extra_args):
+                raise AssertionError(f"{name} functions disagree on {value!r}.")
+        previous_time = min(timeit.repeat(lambda: [previous(value, *extra_args) for value in inputs], number=1, repeat=args.repeat))
+        current_time = min(timeit.repeat(lambda: [current(value, *extra_args) for value in inputs], number=1, repeat=args.repeat))
+        print(f"{name:>10} {previous_time:>9.4f}s {current_time:>9.4f}s {previous_time / current_time:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Synthetic FJJAM.DB builder for benchmarking the database reader.
+
+The database has a single table with the FJJAM columns and extra columns covering every supported
+column type. Records are split into clusters of 16, every 37th record is truncated, and the TOC can
+be written as a chain of delta TOCs.
+"""
+
+import random
+import struct
+import scsu
+
+def encode_cardinality(n):
+    if n < 0x80:
+        return bytes([n << 1])
+    if n < 0x4000:
+        n = (n << 2) | 0x1
+        return bytes([n & 0xFF, n >> 8])
+    n = (n << 3) | 0x3
+    return n.to_bytes(4, "little")
+
+def encode_db_name(name):
+    encoded = name.encode("SCSU")
+    return encode_cardinality(len(name) * 2) + encoded
+
+class RecordWriter:
+    def __init__(self):
+        self.out = bytearray()
+        self.bit_pos = None
+        self.bits_left = 0
+
+    def bit(self, value):
+        if self.bits_left == 0:
+            self.bit_pos = len(self.out)
+            self.out.append(0)
+            self.bits_left = 8
+        if value:
+            self.out[self.bit_pos] |= 1 << (8 - self.bits_left)
+        self.bits_left -= 1
+
+    def raw(self, data):
+        self.out += data
+
+# (name, type, attributes)
+FJJAM_COLUMNS = [
+    ("app_No", 4, 1),
+    ("appName", 11, 0),
+    ("appNameFull", 15, 0),
+    ("appVersion", 11, 0),
+    ("packageUrl", 14, 0),
+    ("profileVersion", 11, 0),
+    ("jar_Size", 6, 0),
+] + [(f"spSize{i}", 6, 0) for i in range(16)] + [
+    ("appClass", 14, 0),
+    ("appParam", 14, 0),
+    ("lastModifiedTime", 10, 0),
+    ("useNetwork", 0, 1),
+    ("targetDevice", 12, 0),
+    ("myConcierge", 0, 0),
+    ("drawAreaWidth", 4, 0),
+    ("drawAreaHeight", 4, 0),
+    ("trustedApid", 11, 0),
+    ("xInt8s", 1, 0),
+    ("xInt8u", 2, 1),
+    ("xInt16s", 3, 0),
+    ("xInt32s", 5, 0),
+    ("xInt64s", 7, 0),
+    ("xFloat32", 8, 0),
+    ("xFloat64", 9, 0),
+    ("launchApp", 14, 0),
+    ("xBinary", 13, 0),
+    ("xLongBinary", 16, 0),
+]
+
+def encode_value(w, col_type, value):
+    if col_type == 0:
+        w.bit(value)
+    elif col_type in (1, 2, 3, 4, 5, 6, 7, 10):
+        fmt = {1: "<b", 2: "<B", 3: "<h", 4: "<H", 5: "<i", 6: "<I", 7: "<q", 10: "<q"}[col_type]
+        w.raw(struct.pack(fmt, value))
+    elif col_type == 8:
+        w.raw(struct.pack("<f", value))
+    elif col_type == 9:
+        w.raw(struct.pack("<d", value))
+    elif col_type == 11:
+        data = value.encode("cp932")
+        w.raw(bytes([len(data)]) + data)
+    elif col_type == 12:
+        data = value.encode("SCSU")
+        w.raw(encode_cardinality(len(data)) + data)
+    elif col_type == 13:
+        w.raw(bytes([len(value)]) + value)
+    elif col_type in (14, 15, 16):
+        # value is None for out of line data
+        w.bit(value is not None)
+        if value is not None:
+            encode_value(w, {14: 11, 15: 12, 16: 13}[col_type], value)
+
+def random_value(rng, name, col_type, index):
+    if name == "app_No":
+        return index
+    if name == "appName":
+        return f"App{index}"
+    if name == "appNameFull":
+        return rng.choice([f"ゲーム{index}", f"Game Full {index}", None])
+    if name == "packageUrl":
+        return f"http://example.com/dl/game{index % 97}.jar"
+    if name == "appClass":
+        return "Main"
+    if name == "lastModifiedTime":
+        return 63_200_000_000_000_000 + rng.randrange(10**15)
+    if name == "spSize0":
+        return rng.choice([1024, 2048])
+    if name.startswith("spSize"):
+        return rng.choice([1024, 2048, 0])
+    if col_type == 0:
+        return rng.randrange(2)
+    if col_type == 1:
+        return rng.randrange(-128, 128)
+    if col_type in (2,):
+        return rng.randrange(256)
+    if col_type == 3:
+        return rng.randrange(-0x8000, 0x8000)
+    if col_type == 4:
+        return rng.randrange(240)
+    if col_type == 5:
+        return rng.randrange(-2**31, 2**31)
+    if col_type == 6:
+        return rng.randrange(2**20)
+    if col_type in (7, 10):
+        return rng.randrange(-2**40, 2**40)
+    if col_type == 8:
+        return 1.5
+    if col_type == 9:
+        return rng.random()
+    if col_type == 11:
+        return rng.choice(["DoJa-5.0", "Star-1.0", "F906i", "テスト"])
+    if col_type == 12:
+        return rng.choice(["F906i", "ｴﾌ", "unicode ☆"])
+    if col_type == 13:
+        return bytes(rng.randrange(256) for _ in range(rng.randrange(8)))
+    if col_type == 14:
+        return rng.choice(["param=1", None, "長い文字列"])
+    if col_type == 15:
+        return rng.choice(["text", None])
+    if col_type == 16:
+        return rng.choice([b"\x01\x02", None])
+
+def build_record(rng, index, columns=FJJAM_COLUMNS, truncate=False):
+    w = RecordWriter()
+    for name, col_type, attributes in columns:
+        value = random_value(rng, name, col_type, index)
+        if (attributes & 1) == 0:
+            exists = rng.random() > 0.1 or name in ("appName", "packageUrl", "spSize0")
+            w.bit(exists)
+            if not exists:
+                continue
+        encode_value(w, col_type, value)
+    body = bytes(w.out)
+    if truncate:
+        body = body[:len(body) // 2]
+    return encode_cardinality(len(body)) + body
+
+def build_schema(columns=FJJAM_COLUMNS, token_handle=2):
+    out = bytearray()
+    out += struct.pack("<IBI", 0x10000000, 1, 0)
+    out += encode_cardinality(1)  # tables
+    out += encode_db_name("jam")
+    out += encode_cardinality(len(columns))
+    for name, col_type, attributes in columns:
+        out += encode_db_name(name) + bytes([col_type, attributes])
+        if 11 <= col_type <= 13:
+            out += bytes([255])
+    out += encode_cardinality(0)  # cluster
+    out += struct.pack("<I", token_handle)
+    out += encode_cardinality(0)  # indexes
+    return bytes(out)
+
+def build_cluster(records, next_handle):
+    membership = 0
+    sizes = b""
+    for i, rec in enumerate(records):
+        membership |= 1 << i
+        sizes += encode_cardinality(len(rec))
+    return struct.pack("<IH", next_handle, membership) + sizes + b"".join(records)
+
+def build_fjjam_db(path, num_records=100, seed=0, delta_depth=0, dirty=False):
+    """
+    Build a synthetic FJJAM.DB file.
+
+    :param path: Path to write the database to.
+    :param num_records: Number of records in the table.
+    :param seed: Seed of the random column values.
+    :param delta_depth: Number of delta TOCs written after the base TOC.
+    :param dirty: Mark the store as dirty.
+    """
+    rng = random.Random(seed)
+    records = [build_record(rng, i, truncate=(i % 37 == 36)) for i in range(num_records)]
+    clusters_records = [records[i:i + 16] for i in range(0, len(records), 16)]
+
+    logical = bytearray(b"\x00" * 64)
+    refs = {}
+
+    refs[1] = len(logical)
+    logical += build_schema()
+
+    num_clusters = len(clusters_records)
+    first_cluster_handle = 3
+    refs[2] = len(logical)
+    logical += struct.pack("<II", first_cluster_handle if num_clusters else 0, 0) + encode_cardinality(num_records) + struct.pack("<I", 0)
+
+    for ci, recs in enumerate(clusters_records):
+        handle = first_cluster_handle + ci
+        next_handle = handle + 1 if ci + 1 < num_clusters else 0
+        refs[handle] = len(logical)
+        # randomise high bits of iNext which must be masked
+        logical += build_cluster(recs, next_handle | (rng.randrange(256) << 24))
+
+    count = 2 + num_clusters
+    # base toc; when delta toc used, break some refs which deltas then fix
+    base_refs = dict(refs)
+    broken = set()
+    if delta_depth:
+        for h in range(first_cluster_handle, count + 1, 2):
+            base_refs[h] = 0xDEAD
+            broken.add(h)
+    logical += struct.pack("<IiI", 1, 0, count)
+    toc_offset = len(logical)
+    for h in range(1, count + 1):
+        logical += struct.pack("<BI", h & 0xFF, base_refs[h])
+
+    broken = sorted(broken)
+    for depth in range(delta_depth):
+        part = broken[depth::delta_depth]
+        logical += struct.pack("<IiI", 1 | 0x80000000, 0, count)
+        delta_offset = len(logical)
+        logical += struct.pack("<IHB", toc_offset, 0, len(part))
+        for h in part:
+            logical += struct.pack("<II", h | (0x10 << 24), refs[h])
+        toc_offset = delta_offset
+
+    with open(path, "wb") as f:
+        f.write(b"\x00" * 16)
+        f.write(struct.pack("<IiiH", 1 if dirty else 0, 0, toc_offset, 0) + b"\x00\x00")
+        for i in range(0, len(logical), 0x4000):
+            f.write(logical[i:i + 0x4000])
+            f.write(b"\xAA\xBB")
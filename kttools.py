@@ -1,8 +1,17 @@
 import os
+import json
+import glob
+import time
 import argparse
+import contextlib
 from util.postprocess import *
+from util.structure_utils import DirectoryListing, NameRegistry
+from phonetypes.PhoneType import run_per_app
+from util.verify import VERIFY_MODES
 from phonetypes import DFType, SHType, Null3FolderType, ModernNType, NullPlain3FolderType, NullPlain3FolderCSPType, ModernPType, SOType, SHOldType, MType
 
+BATCH_SUMMARY_FILE_NAME = "batch_summary.json"
+
 PHONE_TYPES = {
     "SH": SHType.SHType,
     "Null3Folder": Null3FolderType.Null3FolderType,
@@ -16,56 +25,213 @@ PHONE_TYPES = {
     "M": MType.MType,
 }
 
-POSTPROCESS_OPTIONS = {
-    (post_process_SIMPLE, "Rename SIMPLE games (use if you see many 'dljar' files)"),
-    (post_process_konami, "Rename Konami games by using the 'appliname' field in the link"),
-    (post_process_sonic_cafe, "Rename Sonic Cafe games by using 'tgt' field in the link"),
-    (post_process_genki, "Rename Genki games by using 'name' field in the link"),
-}
+def rank_phone_types(directory):
+    """
+    Score every phone type against a directory, from a listing scanned once and shared between them.
 
-def get_phone_type(directory, idx=-1):
-    if idx != -1:
-        return PHONE_TYPES[idx]
+    :param directory: Top folder directory to detect the phone type of.
+
+    :return: A list of dictionaries with the phone type, its confidence and the evidence for it, best match first
+    """
+    listing = DirectoryListing(directory)
+    report = []
     for name, cls in PHONE_TYPES.items():
-        if cls().test_structure(directory):
-            return name, cls()
-    return None, None
+        confidence, evidence = cls().probe(directory, listing)
+        report.append({"phone_type": name, "confidence": confidence, "evidence": evidence})
+    # Ties keep the order of PHONE_TYPES
+    report.sort(key=lambda result: -result["confidence"])
+    return report
+
+def extract_dump(top_folder_directory, target_directory=None, verbose=False, jobs=1, incremental=True, phone_type=None, legacy_postprocess=False, verify_mode="full", verify_outputs_mode="structural", quarantine=False):
+    """
+    Detect the phone type of a dump and extract it, trying the next best phone type if the extraction fails.
+
+    :param top_folder_directory: Top folder directory containing keitai apps.
+    :param target_directory: Output folder, an "output" folder next to the top folder directory by default.
+    :param jobs: Number of worker processes to extract apps with.
+    :param incremental: Skip the apps that did not change since the last run.
+    :param phone_type: Name of the phone type to extract as, detected if None.
+    :param legacy_postprocess: Also rename apps already in the output folder by the rename rules.
+    :param verify_mode: Verification mode of the JARs checked during extraction, "structural" or "full".
+    :param verify_outputs_mode: Verification mode of the JARs of the written apps after the extraction, None not to verify them.
+    :param quarantine: Move the written apps failing verification into a quarantine folder.
+
+    :return: A dictionary summarizing the extraction, with a "status" of "ok", "undetected" or "failed"
+    """
+    summary = {"dump": top_folder_directory, "status": "undetected", "phone_type": None, "errors": []}
+    if phone_type:
+        report = [{"phone_type": phone_type, "confidence": 1.0, "evidence": ["Chosen with --phone-type."]}]
+    else:
+        report = rank_phone_types(top_folder_directory)
+
+    candidates = [result for result in report if result["confidence"] > 0]
+    if not candidates:
+        print(f"Directory {top_folder_directory} does not match any known phone type. Quitting")
+        return summary
+
+    # Fall through to the next best phone type if the extraction fails
+    phone_type_instance = None
+    for idx, result in enumerate(candidates):
+        phone_type_name = result["phone_type"]
+        if idx == 0:
+            print(f"Detected phone type: {phone_type_name}. Extracting...")
+        else:
+            print(f"Trying the next best phone type: {phone_type_name}. Extracting...")
+        if verbose:
+            print(f"Confidence is {result['confidence']}: {' '.join(result['evidence'])}")
+        phone_type_instance = PHONE_TYPES[phone_type_name]()
+        phone_type_instance.verify_mode = verify_mode
+        try:
+            summary.update(phone_type_instance.extract(os.path.abspath(top_folder_directory), verbose=verbose, jobs=jobs, incremental=incremental, target_directory=target_directory, verify_outputs_mode=verify_outputs_mode, quarantine=quarantine))
+            summary["phone_type"] = phone_type_name
+            break
+        except Exception as e:
+            print("Extraction failed with an exception.")
+            print(f"Message is {e}")
+            summary["errors"].append(f"{phone_type_name}: {e}")
+            phone_type_instance = None
+
+    if phone_type_instance is None:
+        print(f"Directory {top_folder_directory} could not be extracted as any matching phone type. Quitting")
+        summary["status"] = "failed"
+        return summary
+
+    # Rename rules are applied during extraction, the post-pass is only needed for outputs of older runs
+    if legacy_postprocess:
+        post_process(summary["target_directory"], verbose=verbose, registry=phone_type_instance.name_registry)
+
+    summary["status"] = "ok"
+    return summary
+
+def expand_dump_paths(patterns, batch_file=None):
+    """
+    Get the dump folders to process from paths, glob patterns and a batch file listing one of them per line.
+
+    :param patterns: Paths or glob patterns of dump folders.
+    :param batch_file: Path to a text file of paths or glob patterns, empty lines and lines starting with # are ignored.
+
+    :return: A list of dump folders, in the given order and without duplicates
+    """
+    patterns = list(patterns)
+    if batch_file:
+        with open(batch_file, 'r', encoding='utf-8') as f:
+            patterns += [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+    dumps = []
+    for pattern in patterns:
+        # Patterns are expanded here as well, since not every shell does it
+        paths = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isdir(path) and path not in dumps:
+                dumps.append(path)
+    return dumps
+
+def batch_output_names(dumps):
+    """
+    Name the output folder of each dump after its path relative to the common parent of all dumps,
+    with a `_N` suffix for duplicates.
+
+    :param dumps: List of absolute paths of dump folders.
+    """
+    common_path = os.path.commonpath(dumps) if len(dumps) > 1 else None
+    registry = NameRegistry()
+    names = []
+    for dump in dumps:
+        name = os.path.relpath(dump, common_path) if common_path else "."
+        if name == ".":
+            name = os.path.basename(dump)
+        names.append(registry.reserve(name.replace(os.sep, "_"), ("",)))
+    return names
+
+def extract_batch_dump(job):
+    """
+    Extract one dump of a batch, with its output printed to a log file next to its output folder.
+
+    :param job: Tuple of the dump folder, the output folder and the keyword arguments of extract_dump.
+
+    :return: The summary of the extraction, with its duration
+    """
+    top_folder_directory, target_directory, kwargs = job
+    start = time.perf_counter()
+    with open(target_directory + ".log", 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+        try:
+            summary = extract_dump(top_folder_directory, target_directory, **kwargs)
+        except Exception as e:
+            print(f"Extraction failed with an exception: {e}")
+            summary = {"dump": top_folder_directory, "status": "failed", "phone_type": None, "errors": [str(e)]}
+    summary["target_directory"] = target_directory
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    return summary
+
+def run_batch(dumps, output_root, jobs=1, **kwargs):
+    """
+    Extract many dumps, each into its own folder of the output root, and write a summary of them all.
+
+    :param dumps: List of dump folders.
+    :param output_root: Folder the output folders of the dumps are created in.
+    :param jobs: Number of worker processes to extract dumps with, each dump being extracted by a single process.
+    :param kwargs: Keyword arguments of extract_dump.
+
+    :return: A list of the summaries of the dumps, in order
+    """
+    os.makedirs(output_root, exist_ok=True)
+    jobs_list = [(dump, os.path.join(output_root, name), kwargs) for dump, name in zip(dumps, batch_output_names(dumps))]
+
+    summaries = []
+    for summary in run_per_app(extract_batch_dump, jobs_list, jobs):
+        print(f"{summary['status']:<10} {summary['phone_type'] or '-':<20} {summary.get('written', 0):>5} written {summary.get('unchanged', 0):>5} unchanged  {summary['dump']}")
+        summaries.append(summary)
+
+    summary_path = os.path.join(output_root, BATCH_SUMMARY_FILE_NAME)
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summaries, f, indent=2, ensure_ascii=False)
+    print(f"{sum(summary['status'] == 'ok' for summary in summaries)} of {len(summaries)} dumps extracted. Summary written to {summary_path}")
+    return summaries
 
 def main():
     parser = argparse.ArgumentParser(description='Process a directory of keitai apps into emulator-ready format.')
-    parser.add_argument('top_folder_directory', help='Top folder directory containing keitai apps.')
+    parser.add_argument('top_folder_directory', nargs='*', help='Top folder directory containing keitai apps. Several directories or glob patterns run a batch.')
     parser.add_argument('--verbose', action='store_true', help='Enable verbose mode.')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes to extract apps with, or dumps with in a batch.')
+    parser.add_argument('--legacy-postprocess', action='store_true', help='Also rename apps already in the output folder by the rename rules.')
+    parser.add_argument('--full', action='store_true', help='Extract all apps again, even the ones unchanged since the last run.')
+    parser.add_argument('--detect-only', action='store_true', help='Print the ranked phone type detection report as JSON and quit.')
+    parser.add_argument('--phone-type', choices=PHONE_TYPES.keys(), help='Extract as this phone type instead of detecting it.')
+    parser.add_argument('--batch-file', help='Text file listing dump folders or glob patterns to process, one per line.')
+    parser.add_argument('--verify-mode', choices=VERIFY_MODES, default="full", help='Check JARs by their structure only, or also decompress them and check their CRCs.')
+    parser.add_argument('--verify-outputs', choices=["off", *VERIFY_MODES], default="structural", help='Check the written JARs and SP sizes after the extraction, and write a report of it.')
+    parser.add_argument('--quarantine', action='store_true', help='Move the apps failing the check after the extraction into a quarantine folder.')
+    parser.add_argument('--output-root', help='Folder to create one output folder per dump in. Defaults to "output" in the current directory for a batch.')
     args = parser.parse_args()
 
+    dumps = expand_dump_paths(args.top_folder_directory, args.batch_file)
+    batch = len(dumps) > 1 or args.batch_file or args.output_root
+    if not dumps:
+        parser.error("no dump folder to process")
+
+    if args.detect_only:
+        if batch:
+            report = {dump: rank_phone_types(dump) for dump in dumps}
+        elif args.phone_type:
+            report = [{"phone_type": args.phone_type, "confidence": 1.0, "evidence": ["Chosen with --phone-type."]}]
+        else:
+            report = rank_phone_types(dumps[0])
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+
     print(f"Verbose mode is {'on' if args.verbose else 'off'}")
 
-    phone_type_name, phone_type_instance = get_phone_type(args.top_folder_directory)
-    if not phone_type_instance:
-        print(f"Directory {args.top_folder_directory} does not match any known phone type. Quitting")
+    options = dict(verbose=args.verbose, incremental=not args.full, phone_type=args.phone_type, legacy_postprocess=args.legacy_postprocess, verify_mode=args.verify_mode,
+                   verify_outputs_mode=None if args.verify_outputs == "off" else args.verify_outputs, quarantine=args.quarantine)
+    if batch:
+        run_batch(dumps, os.path.abspath(args.output_root or 'output'), jobs=args.jobs, **options)
+        return
+
+    summary = extract_dump(dumps[0], jobs=args.jobs, **options)
+    if summary["status"] != "ok":
         return
 
-    print(f"Detected phone type: {phone_type_name}. Extracting...")
-    try:
-        phone_type_instance.extract(os.path.abspath(args.top_folder_directory), verbose=args.verbose)
-    except Exception as e:
-        print("Extraction failed with an exception.")
-        print(f"Message is {e}")
-        print("If you think the phone type was misdetected")
-        print("Please enter a possible phone type:")
-        temptypes = dict(enumerate(PHONE_TYPES.keys()))
-        for i, type in temptypes.items():
-            print(f"{i}: {type}")
-        type = input("Which type: ")
-        phone_type_instance = get_phone_type(args.top_folder_directory, temptypes[int(type)])
-        if not phone_type_instance:
-            print(f"Directory {args.top_folder_directory} does not match the entered phone type. Quitting")
-            return
-        phone_type_instance().extract(os.path.abspath(args.top_folder_directory), verbose=args.verbose)
-
-    output_folder = os.path.abspath(os.path.join(args.top_folder_directory, os.pardir, 'output'))
-    for func, _ in POSTPROCESS_OPTIONS:
-        func(output_folder, verbose=args.verbose)
-        
     print("Processing finished without errors.")
 
 if __name__ == '__main__':
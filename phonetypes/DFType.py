@@ -1,8 +1,8 @@
-from phonetypes.PhoneType import PhoneType
+from phonetypes.PhoneType import PhoneType, ExtractedApp
 import os
-import shutil
 from util.jam_utils import parse_props_plaintext, parse_valid_name, fmt_spsize_header, find_plausible_keywords_for_validity, parse_jam_objects
-from util.structure_utils import create_target_folder
+from util.structure_utils import DirectoryListing
+from util.decoding import decode_file
 
 class DFType(PhoneType):
     """
@@ -16,145 +16,176 @@ class DFType(PhoneType):
     
     needs_reconstruction = False
     
-    def extract(self, top_folder_directory, verbose=False):
+    def prepare(self, top_folder_directory, verbose=False):
         """
-        Extract games from the top folder directory in a D or F phone file structure.
+        Reconstruct missing JAM files from FJJAM.DB before the game folders are processed.
         
         :param top_folder_directory: Top folder directory to extract games from.
         """
+        # hack: run test structure again to get the reconstruction flag set if needed
+        self.test_structure(top_folder_directory)
         
-        def process_subdirectory(subfolder, target_directory):
+        # Reconstruct JAMs if needed
+        if self.needs_reconstruction:
             if verbose:
-                print('-'*80)
-            
-            # List all files
-            files = os.listdir(subfolder)
-            
-            # Process JAM
-            jam_file_path = next((f for f in files if f.lower() == 'jam'), None)
-            
-            if not jam_file_path:
-                if verbose:
-                    print(f"No JAM file found in {subfolder}. Skipping.\n")
-                return
-            
-            # Read JAM file with different encodings
-            jam_file = None
-            for encoding in self.encodings:
-                try:
-                    jam_file = open(os.path.join(subfolder, jam_file_path), 'r', encoding=encoding).read()
-                    break
-                except UnicodeDecodeError:
-                    if verbose:
-                        print(f"Warning: UnicodeDecodeError with {encoding}. Trying next encoding.")
-            else:
-                if verbose:
-                    print(f"Warning: Could not read JAM file {jam_file_path}. Skipping.\n")
-                return
-            
-            if (not find_plausible_keywords_for_validity(jam_file)):
+                print("No JAM files detected in the game folders. Reconstructing from FJJAM.DB database.")
+            parse_jam_objects(top_folder_directory, verbose)
+    
+    def list_apps(self, top_folder_directory, verbose=False):
+        """
+        List the game folders in the top folder directory.
+        
+        :param top_folder_directory: Top folder directory to extract games from.
+        """
+        # List all folders in the top folder directory
+        folder_paths = [os.path.join(top_folder_directory, folder) for folder in os.listdir(top_folder_directory)]
+        return [folder_path for folder_path in folder_paths if os.path.isdir(folder_path)]
+    
+    def app_sources(self, subfolder):
+        """
+        Get the paths of the files the app is extracted from.
+
+        :param subfolder: Subfolder path.
+        """
+        return [subfolder]
+    
+    def process_app(self, subfolder, verbose=False):
+        """
+        Process a single game folder.
+        
+        :param subfolder: Path to the game folder.
+        """
+        if verbose:
+            print('-'*80)
+        
+        # List all files
+        files = os.listdir(subfolder)
+        
+        # Process JAM
+        jam_file_path = next((f for f in files if f.lower() == 'jam'), None)
+        
+        if not jam_file_path:
+            if verbose:
+                print(f"No JAM file found in {subfolder}. Skipping.\n")
+            return
+        
+        # Read JAM file with the first encoding it is valid in
+        jam_file, _ = decode_file(os.path.join(subfolder, jam_file_path), self.encodings, verbose=verbose)
+        if jam_file is None:
+            if verbose:
+                print(f"Warning: Could not read JAM file {jam_file_path}. Skipping.\n")
+            return
+        
+        if (not find_plausible_keywords_for_validity(jam_file)):
+            if verbose:
+                print(f"Warning: {subfolder} does not contain all required keywords. Skipping.\n")
+            return
+        
+        # Get the properties from the JAM file
+        jam_props = parse_props_plaintext(jam_file, verbose=verbose)
+        
+        package_url = None
+        try:
+            package_url = jam_props['PackageURL']
+        except KeyError:
                 if verbose:
-                    print(f"Warning: {subfolder} does not contain all required keywords. Skipping.\n")
-                return
-            
-            # Get the properties from the JAM file
-            jam_props = parse_props_plaintext(jam_file, verbose=verbose)
-            
-            package_url = None
+                    print(f"Warning: No PackageURL found in JAM file.")
+        
+        # Determine valid name for the app
+        app_name = None
+        if package_url:
             try:
-                package_url = jam_props['PackageURL']
-            except KeyError:
-                    if verbose:
-                        print(f"Warning: No PackageURL found in JAM file.")
-            
-            # Determine valid name for the app
-            app_name = None
-            if package_url:
+                app_name = parse_valid_name(package_url, verbose=verbose)
+            except ValueError as e:
+                if verbose:
+                    print(f"Warning: {e.args[0]}")
+        
+        if not app_name:
+            package_url_candidates = [value for value in jam_props.values() if value.find('http') != -1 and value.find(' ') == -1]
+            for package_url in package_url_candidates:
                 try:
                     app_name = parse_valid_name(package_url, verbose=verbose)
                 except ValueError as e:
                     if verbose:
                         print(f"Warning: {e.args[0]}")
-            
-            if not app_name:
-                package_url_candidates = [value for value in jam_props.values() if value.find('http') != -1 and value.find(' ') == -1]
-                for package_url in package_url_candidates:
-                    try:
-                        app_name = parse_valid_name(package_url, verbose=verbose)
-                    except ValueError as e:
-                        if verbose:
-                            print(f"Warning: {e.args[0]}")
-                if app_name is None:
-                    if verbose:
-                        print(f"Warning: No valid app name found in {jam_file_path}. Using base folder name.")
-                    app_name = f'{os.path.basename(subfolder)}'
-                
-            # Check there is no duplicate app name existing in the target directory
-            if os.path.exists(os.path.join(target_directory, f"{app_name}.jam")):
+            if app_name is None:
                 if verbose:
-                    print(f"Warning: {app_name}.jam already exists in {target_directory}.")
-                app_name = f"{app_name}_{self.duplicate_count+1}"
-                self.duplicate_count += 1                
-            
-            # Copy over JAM file with app name
-            src = os.path.join(subfolder, jam_file_path)
-            dst = os.path.join(target_directory, f"{app_name}.jam")
-            shutil.copy2(src, dst)
-            
-            # Find jar files, could be "jar" or ("fulljar" and/or "minijar")
-            jar_files = [f for f in files if any(substring == f.lower() for substring in ['jar', 'fulljar', 'minijar'])]
+                    print(f"Warning: No valid app name found in {jam_file_path}. Using base folder name.")
+                app_name = f'{os.path.basename(subfolder)}'
             
-            # Copy over jar files, name jar and fulljar files with app name, for minijar, use app name + "_mini"
-            for jar_file in jar_files:
-                if 'minijar' in jar_file.lower():
-                    shutil.copy2(os.path.join(subfolder, jar_file), os.path.join(target_directory, f"{app_name}_mini.jar"))
-                else:
-                    shutil.copy2(os.path.join(subfolder, jar_file), os.path.join(target_directory, f"{app_name}.jar"))
-                    
-            # Concatenate all "spX" files
-            sp_files = [f for f in files if f.lower().startswith('sp')]
-            concatenated_content = b''
-            for sp_file in sp_files:
-                with open(os.path.join(subfolder, sp_file), 'rb') as f:
-                    concatenated_content += f.read()
-            
-            # Write concatenated content to a file
-            if concatenated_content != b'':
-                sp_size_list = jam_props['SPsize'].split(',')
-                sp_size_list = [int(sp_size) for sp_size in sp_size_list]
-                header = fmt_spsize_header(sp_size_list)
-                with open(os.path.join(target_directory, f"{app_name}.sp"), 'wb') as wf:
-                    wf.write(header)
-                    wf.write(concatenated_content)
+        app = ExtractedApp(subfolder, app_name, jam_props.get('PackageURL'))
+        
+        # Copy over JAM file with app name
+        app.add_copy(".jam", os.path.join(subfolder, jam_file_path), preserve_metadata=True)
+        
+        # Find jar files, could be "jar" or ("fulljar" and/or "minijar")
+        jar_files = [f for f in files if any(substring == f.lower() for substring in ['jar', 'fulljar', 'minijar'])]
+        
+        # Copy over jar files, name jar and fulljar files with app name, for minijar, use app name + "_mini"
+        for jar_file in jar_files:
+            if 'minijar' in jar_file.lower():
+                app.add_copy("_mini.jar", os.path.join(subfolder, jar_file), preserve_metadata=True)
+            else:
+                app.add_copy(".jar", os.path.join(subfolder, jar_file), preserve_metadata=True)
                 
+        # Concatenate all "spX" files, in the order of their index
+        sp_files = sorted((f for f in files if f.lower().startswith('sp')), key=self.sp_file_order)
+        sp_files = [os.path.join(subfolder, f) for f in sp_files]
+        sp_segment_sizes = [os.path.getsize(sp_file) for sp_file in sp_files]
+        
+        # Stream the header and the segments into the SP file
+        if any(size > 0 for size in sp_segment_sizes):
+            sp_size_list = jam_props['SPsize'].split(',')
+            sp_size_list = [int(sp_size) for sp_size in sp_size_list]
+            # Segments not matching the SPsize fail the verification of the app
+            app.problems += self.check_sp_segments(sp_files, sp_segment_sizes, sp_size_list)
             if verbose:
-                print(f"Processed: {subfolder} -> {app_name}\n")
-                
-        # Create the target directory at the same level as the top folder directory
-        target_directory = create_target_folder(top_folder_directory)
+                for problem in app.problems:
+                    print(f"Warning: {problem}")
+            header = fmt_spsize_header(sp_size_list)
+            app.add_copy(".sp", sp_files, header=header)
+            
+        return app
+    
+    @staticmethod
+    def sp_file_order(sp_file):
+        """
+        Sort key of the "spX" files of a game folder, by their index X.
+        Files without a number after "sp" come last, by name.
         
-        # hack: run test structure again to get the reconstruction flag set if needed
-        self.test_structure(top_folder_directory)
+        :param sp_file: Name of the SP file.
+        """
+        index = sp_file[2:]
+        if index.isascii() and index.isdigit():
+            return 0, int(index), sp_file
+        return 1, 0, sp_file
+    
+    def check_sp_segments(self, sp_files, sp_segment_sizes, sp_size_list):
+        """
+        Check the number and the sizes of the SP segments against the SPsize of the JAM.
         
-        # Reconstruct JAMs if needed
-        if self.needs_reconstruction:
-            if verbose:
-                print("No JAM files detected in the game folders. Reconstructing from FJJAM.DB database.")
-            parse_jam_objects(top_folder_directory, verbose)
+        :param sp_files: Paths of the SP segment files, in order.
+        :param sp_segment_sizes: Sizes of the SP segment files.
+        :param sp_size_list: SP sizes of the JAM.
         
-        # List all folders in the top folder directory
-        for folder in os.listdir(top_folder_directory):
-            folder_path = os.path.join(top_folder_directory, folder)
-            if os.path.isdir(folder_path):
-                # Process the subdirectory and output into folder "output" at the same level as top level directory
-                process_subdirectory(folder_path, target_directory)
+        :return: A list of messages, one for every mismatch
+        """
+        problems = []
+        if len(sp_segment_sizes) != len(sp_size_list):
+            problems.append(f"Found {len(sp_segment_sizes)} SP segments, but SPsize has {len(sp_size_list)} sizes.")
+        for sp_file, segment_size, sp_size in zip(sp_files, sp_segment_sizes, sp_size_list):
+            if segment_size != sp_size:
+                problems.append(f"SP segment {os.path.basename(sp_file)} is {segment_size} bytes, but SPsize gives {sp_size} bytes.")
+        return problems
                 
-    def test_structure(self, top_folder_directory):
+    def test_structure(self, top_folder_directory, listing=None):
         """
         Test the structure of the top folder directory to see if it is of D/F file structure type.
         
         :param top_folder_directory: Top folder directory to test the structure of.
+        :param listing: Cached listing of the top folder directory shared between phone types, if any.
         """
+        listing = listing or DirectoryListing(top_folder_directory)
         
         keywords = [
             "ENTRY",
@@ -164,13 +195,13 @@ class DFType(PhoneType):
             "PUSHSMS"
         ]
         
-        if any(k.upper() in keywords for k in os.listdir(top_folder_directory)):
+        if any(k.upper() in keywords for k in listing.listdir()):
             return None # exit early if a modern n type is found
         
-        if not os.path.isdir(top_folder_directory):
+        if not listing.exists():
             return None
         
-        subdirs = [f for f in os.listdir(top_folder_directory) if os.path.isdir(os.path.join(top_folder_directory, f))]
+        subdirs = [f for f in listing.listdir() if listing.isdir(f)]
         if not subdirs:
             return None
         
@@ -182,8 +213,7 @@ class DFType(PhoneType):
             if not any(c.isdigit() or c == '_' for c in folder):
                 continue
             
-            folder_path = os.path.join(top_folder_directory, folder)
-            files = os.listdir(folder_path)
+            files = listing.listdir(folder)
             
             # Check if the folder contains a JAM file
             if not any('jam' in f.lower() for f in files):
@@ -1,8 +1,8 @@
-from phonetypes.PhoneType import PhoneType
+from phonetypes.PhoneType import PhoneType, ExtractedApp
 import os
-import shutil
-from util.jam_utils import parse_valid_name, fmt_spsize_header, parse_props_plaintext, find_plausible_keywords_for_validity
-from util.structure_utils import create_target_folder
+from util.jam_utils import parse_valid_name, fmt_spsize_header, parse_props_plaintext, find_plausible_keywords_for_validity, find_plaintext_cutoff
+from util.structure_utils import DirectoryListing
+from util.decoding import decode_text
 
 class ModernPType(PhoneType):
     """
@@ -13,150 +13,149 @@ class ModernPType(PhoneType):
     - in adf, jar and sp folders, there are numbered files and each are associated with each other across folders
     """
     
-    def extract(self, top_folder_directory, verbose=False):
+    def list_apps(self, top_folder_directory, verbose=False):
         """
-        Extract games from the top folder directory in a Modern Panasonic phone file structure.
+        List the files in the "ADF" folder, which are associated with the same numbered files in the "JAR" and "SP" folders.
         
         :param top_folder_directory: Top folder directory to extract games from.
         """
-        # Create the target directory at the same level as the top folder directory
-        target_directory = create_target_folder(top_folder_directory)
-        
         # List all files in the "ADF" folder in the top folder directory
         adf_folder = os.path.join(top_folder_directory, "adf")
-        adf_files = os.listdir(adf_folder)
+        return [(top_folder_directory, adf_file) for adf_file in os.listdir(adf_folder)]
+    
+    def app_sources(self, app):
+        """
+        Get the paths of the files the app is extracted from.
+
+        :param app: Tuple of the top folder directory and the ADF file name.
+        """
+        top_folder_directory, adf_file = app
+        if not adf_file.isdigit():
+            # The index of a deleted ADF file depends on the other ADF files
+            return [os.path.join(top_folder_directory, folder) for folder in ("adf", "jar", "sp")]
+        return [
+            os.path.join(top_folder_directory, "adf", adf_file),
+            os.path.join(top_folder_directory, "jar", str(int(adf_file))),
+            os.path.join(top_folder_directory, "sp", str(int(adf_file))),
+        ]
+    
+    def process_app(self, app, verbose=False):
+        """
+        Process a single ADF file with the same numbered JAR and SP files.
         
-        # Go through all files in the "ADF" folder and process the same numbered files in the "JAR" and "SP" folders
-        for adf_file in adf_files:
-            if verbose:
-                print('-'*80)
-                
-            # Get the file number from the adf file
-            try:
-                adf_index = int(adf_file)
-            except ValueError:
-                if verbose:
-                    print(f"Warning: {adf_file} seems to be deleted. Taking the index as the closest non-duplicate number.")
-                adf_index = None
-                for i in range(1, 1000):
-                    if os.path.exists(os.path.join(adf_folder, str(i))):
-                        adf_index = i
-                        break
-            
-            # Get the corresponding jar and sp files
-            jar_file = os.path.join(top_folder_directory, "jar", str(adf_index))
-            sp_file = os.path.join(top_folder_directory, "sp", str(adf_index))
-            old_name = adf_file
-            adf_file = open(os.path.join(adf_folder, adf_file), 'rb').read()
-            
-            # Check if there are all minimally required keywords in the ADF file
-            if (not find_plausible_keywords_for_validity(adf_file)):
-                if verbose:
-                    print(f"Warning: {old_name} does not contain all required keywords. Skipping.\n")
-                continue
+        :param app: Tuple of the top folder directory and the ADF file name.
+        """
+        top_folder_directory, adf_file = app
+        adf_folder = os.path.join(top_folder_directory, "adf")
+        
+        if verbose:
+            print('-'*80)
             
-            # Find the offset for plaintext cutoff
-            for offset in self.plaintext_cutoff_offsets:
-                if b'\x00' in adf_file[offset:] or len(adf_file[offset:]) == 0:
-                    if verbose:
-                        print(f"Plaintext cutoff not good for offset {offset}. Trying next offset.")
-                    continue
-                else:
-                    if verbose:
-                        print(f"Plaintext cutoff found at offset {offset}.")
-                    adf_file = adf_file[offset:]
-                    # Turn bytes into lines of text
-                    for encoding in self.encodings:
-                        try:
-                            adf_file = adf_file.decode(encoding)
-                            used_encoding = encoding
-                            break
-                        except UnicodeDecodeError:
-                            if verbose:
-                                print(f"Warning: UnicodeDecodeError with {encoding}. Trying next encoding.")
-                    else:
-                        if verbose:
-                            print(f"Warning: Could not decode ADF file. Skipping.\n")
-                        return
+        # Get the file number from the adf file
+        try:
+            adf_index = int(adf_file)
+        except ValueError:
+            if verbose:
+                print(f"Warning: {adf_file} seems to be deleted. Taking the index as the closest non-duplicate number.")
+            adf_index = None
+            for i in range(1, 1000):
+                if os.path.exists(os.path.join(adf_folder, str(i))):
+                    adf_index = i
                     break
-            else:
+        
+        # Get the corresponding jar and sp files
+        jar_file = os.path.join(top_folder_directory, "jar", str(adf_index))
+        sp_file = os.path.join(top_folder_directory, "sp", str(adf_index))
+        old_name = adf_file
+        adf_file = open(os.path.join(adf_folder, adf_file), 'rb').read()
+        
+        # Check if there are all minimally required keywords in the ADF file
+        if (not find_plausible_keywords_for_validity(adf_file)):
+            if verbose:
+                print(f"Warning: {old_name} does not contain all required keywords. Skipping.\n")
+            return
+        
+        # Find the offset for plaintext cutoff
+        # The first good offset keeps the most plaintext, so offsets are tried in order and only counted
+        offset, probes = find_plaintext_cutoff(adf_file, self.plaintext_cutoff_offsets)
+        self.plaintext_cutoffs.record(offset, probes)
+        if offset is None:
+            if verbose:
+                print(f"Plaintext cutoff not found. Skipping.\n")
+            return
+        if verbose:
+            print(f"Plaintext cutoff found at offset {offset}. Cutoffs: {self.plaintext_cutoffs}")
+        adf_file = adf_file[offset:]
+        # Turn bytes into lines of text
+        adf_file, used_encoding = decode_text(adf_file, self.encodings, verbose=verbose)
+        if adf_file is None:
+            if verbose:
+                print(f"Warning: Could not decode ADF file. Skipping.\n")
+            return
+        
+        # Get the properties from the ADF file
+        jam_props = parse_props_plaintext(adf_file, verbose=verbose)
+        
+        # Get name of the app
+        app_name = None
+        package_url = None
+        try:
+            package_url = jam_props['PackageURL']
+        except KeyError:
                 if verbose:
-                    print(f"Plaintext cutoff not found. Skipping.\n")
-                return
-            
-            # Get the properties from the ADF file
-            jam_props = parse_props_plaintext(adf_file, verbose=verbose)
-            
-            # Get name of the app
-            app_name = None
-            package_url = None
+                    print(f"Warning: No PackageURL found in JAM file.")
+        
+        # Determine valid name for the app
+        if package_url:
             try:
-                package_url = jam_props['PackageURL']
-            except KeyError:
-                    if verbose:
-                        print(f"Warning: No PackageURL found in JAM file.")
-            
-            # Determine valid name for the app
-            if package_url:
+                app_name = parse_valid_name(package_url, verbose=verbose)
+            except ValueError as e:
+                if verbose:
+                    print(f"Warning: {e.args[0]}")
+        
+        if not app_name:
+            package_url_candidates = [value for value in jam_props.values() if value.find('http') != -1 and value.find(' ') == -1]
+            for package_url in package_url_candidates:
                 try:
                     app_name = parse_valid_name(package_url, verbose=verbose)
                 except ValueError as e:
                     if verbose:
                         print(f"Warning: {e.args[0]}")
-            
-            if not app_name:
-                package_url_candidates = [value for value in jam_props.values() if value.find('http') != -1 and value.find(' ') == -1]
-                for package_url in package_url_candidates:
-                    try:
-                        app_name = parse_valid_name(package_url, verbose=verbose)
-                    except ValueError as e:
-                        if verbose:
-                            print(f"Warning: {e.args[0]}")
-                if app_name is None:
-                    if verbose:
-                        print(f"Warning: No valid app name found in {adf_index}. Using base folder name.")
-                        app_name = 'adf' + str(adf_index)
-            
-            # Check there is no duplicate app name existing in the target directory
-            if os.path.exists(os.path.join(target_directory, f"{app_name}.jam")):
+            if app_name is None:
                 if verbose:
-                    print(f"Warning: {app_name}.jam already exists in {target_directory}.")
-                app_name = f"{app_name}_{self.duplicate_count+1}"
-                self.duplicate_count += 1
-            
-            # Write the JAM and JAR to the target directory, put header on the SP and write
-            with open(os.path.join(target_directory, f"{app_name}.jam"), 'w', encoding=used_encoding) as jam_file:
-                jam_file.write(adf_file)
-                
-            if os.path.exists(jar_file):
-                with open(jar_file, 'rb') as jar_file:
-                    with open(os.path.join(target_directory, f"{app_name}.jar"), 'wb') as target_jar_file:
-                        target_jar_file.write(jar_file.read())
-            
-            if os.path.exists(sp_file):
-                with open(sp_file, 'rb') as sp_file:
-                    sp_size_list = jam_props['SPsize'].split(',')
-                    sp_size_list = [int(sp_size) for sp_size in sp_size_list]
-                    sp_header = fmt_spsize_header(sp_size_list)
-                    with open(os.path.join(target_directory, f"{app_name}.sp"), 'wb') as f:
-                        f.write(sp_header)
-                        f.write(sp_file.read())
+                    print(f"Warning: No valid app name found in {adf_index}. Using base folder name.")
+                app_name = 'adf' + str(adf_index)
+        
+        # Write the JAM and JAR to the target directory, put header on the SP and write
+        app = ExtractedApp(str(adf_index), app_name, jam_props.get('PackageURL'))
+        app.add_text(".jam", adf_file, used_encoding)
             
-            if verbose:
-                print(f"Processed: {str(adf_index)} -> {app_name}\n")
+        if os.path.exists(jar_file):
+            app.add_copy(".jar", jar_file)
+        
+        if os.path.exists(sp_file):
+            sp_size_list = jam_props['SPsize'].split(',')
+            sp_size_list = [int(sp_size) for sp_size in sp_size_list]
+            sp_header = fmt_spsize_header(sp_size_list)
+            app.add_copy(".sp", sp_file, header=sp_header)
+        
+        return app
             
-    def test_structure(self, top_folder_directory):
+    def test_structure(self, top_folder_directory, listing=None):
         """
         Test the structure of the top folder directory to see if it is of Modern Panasonic file structure type.
         
         :param top_folder_directory: Top folder directory to test the structure of.
+        :param listing: Cached listing of the top folder directory shared between phone types, if any.
         """
+        listing = listing or DirectoryListing(top_folder_directory)
+
         # Check if the top folder directory contains adf, jar and sp folders
         # Check if there are at least numbered files in adf, jar and sp folders
         # Expected folder names
         required_folders = ["adf", "jar", "sp"]
         
-        folders_list = os.listdir(top_folder_directory)
+        folders_list = listing.listdir()
         # Lower all folder names
         folders_list = [folder.lower() for folder in folders_list]
         
@@ -167,8 +166,7 @@ class ModernPType(PhoneType):
         
         # Check if each required folder contains at least one numbered file
         for folder in required_folders:
-            folder_path = os.path.join(top_folder_directory, folder)
-            folder_contents = os.listdir(folder_path)
+            folder_contents = listing.listdir(folder)
             
             # Check if there is at least one file with a numeric name
             if not any(item.isdigit() for item in folder_contents):
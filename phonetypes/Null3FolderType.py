@@ -1,8 +1,7 @@
-from phonetypes.PhoneType import PhoneType
+from phonetypes.PhoneType import PhoneType, ExtractedApp
 import os
-import shutil
-from util.jam_utils import parse_valid_name, parse_props_00, fmt_plaintext_jam, fmt_spsize_header
-from util.structure_utils import create_target_folder
+from util.jam_utils import parse_valid_name, validate_null_props, fmt_plaintext_jam, fmt_spsize_header
+from util.structure_utils import DirectoryListing
 
 class Null3FolderType(PhoneType):
     """
@@ -17,15 +16,12 @@ class Null3FolderType(PhoneType):
     For further proof of type assurance, the top folder may contain files "$____DIR._ID", "$_____00._BK" or "APPINFO"
     """
     
-    def extract(self, top_folder_directory, verbose=False):
+    def list_apps(self, top_folder_directory, verbose=False):
         """
-        Extract games from the top folder directory in this phone file structure.
+        List the ADF files in the adf folder, with their corresponding JAR and SP file paths.
         
         :param top_folder_directory: Top folder directory to extract games from.
         """
-        # Create the target directory at the same level as the top folder directory
-        target_directory = create_target_folder(top_folder_directory)
-        
         # Get actual folder names while preserving case
         folder_map = {folder.lower(): folder for folder in os.listdir(top_folder_directory)}
 
@@ -34,158 +30,156 @@ class Null3FolderType(PhoneType):
         if not all(folder in folder_map for folder in required_folders):
             if verbose:
                 print("Error: Missing required folders (adf, jar, sp) in top folder.")
-            return
+            return []
 
         # Paths to required folders (preserving original case)
         folder_paths = {folder: os.path.join(top_folder_directory, folder_map[folder]) for folder in required_folders}
 
         # Process all ADF files, with corresponding JAR and SP files
+        apps = []
         for adf_file in os.listdir(folder_paths["adf"]):
             if not adf_file.lower().startswith("adf"):
                 continue
 
-            if verbose:
-                print('-' * 80)
-
             adf_index = adf_file[3:]
 
             # Get the corresponding JAR and SP files
             jar_file = os.path.join(folder_paths["jar"], f"{folder_paths['jar'][-3:]}{adf_index}")
             sp_file = os.path.join(folder_paths["sp"], f"{folder_paths['sp'][-2:]}{adf_index}")
 
-            # Get the properties from the JAM file
-            jam_props = None
+            apps.append((os.path.join(folder_paths["adf"], adf_file), jar_file, sp_file))
+        return apps
 
-            for offset in self.null_type_offsets:
-                try:
-                    adf_file_path = os.path.join(folder_paths["adf"], adf_file)
-                    adf_content = open(adf_file_path, 'rb').read()
-                    jam_props = parse_props_00(adf_content, offset[0], offset[1], verbose=verbose)
+    def app_sources(self, app):
+        """
+        Get the paths of the files the app is extracted from.
 
-                    # Ensure JAM properties are valid
-                    if " " in jam_props['PackageURL']:
-                        raise ValueError("Space found in PackageURL.")
+        :param app: Tuple of the ADF, JAR and SP file paths.
+        """
+        return list(app)
+    
+    def process_app(self, app, verbose=False):
+        """
+        Process a single ADF file with its corresponding JAR and SP files.
+        
+        :param app: Tuple of the ADF, JAR and SP file paths.
+        """
+        adf_file_path, jar_file, sp_file = app
+        adf_file = os.path.basename(adf_file_path)
+
+        if verbose:
+            print('-' * 80)
+
+        # Get the properties from the JAM file
+        # Read the file once, only the plausible offsets are parsed
+        try:
+            with open(adf_file_path, 'rb') as f:
+                adf_content = f.read()
+        except OSError:
+            # No layout fits an unreadable file
+            adf_content = b""
+        jam_props, offset = self.null_layout.parse(adf_content, validate_null_props, verbose=verbose)
+        if offset is None:
+            if verbose:
+                print(f"Warning: Could not read ADF file {adf_file}. Skipping.\n")
+            return
 
-                    break
-                except Exception as e:
-                    if verbose:
-                        print(f"Warning: Not good with offset {offset}. Trying next offset.")
-                        print(f"    - {e.args[0]}")
-            else:
-                if verbose:
-                    print(f"Warning: Could not read ADF file {adf_file}. Skipping.\n")
-                continue
+        if jam_props is None:
+            if verbose:
+                print(f"Warning: Could not read ADF file {adf_file}'s props. Skipping.\n")
+            return
 
-            if jam_props is None:
-                if verbose:
-                    print(f"Warning: Could not read ADF file {adf_file}'s props. Skipping.\n")
-                continue
+        # Get JAR size in bytes into jam props
+        try:
+            jar_size = os.path.getsize(jar_file)
+            jam_props['AppSize'] = jar_size
+        except FileNotFoundError:
+            if verbose:
+                print(f"Warning: JAR file {jar_file} not found. Skipping {adf_file}.")
+            return
 
-            # Get JAR size in bytes into jam props
-            try:
-                jar_size = os.path.getsize(jar_file)
-                jam_props['AppSize'] = jar_size
-            except FileNotFoundError:
-                if verbose:
-                    print(f"Warning: JAR file {jar_file} not found. Skipping {adf_file}.")
-                continue
+        # Get app name
+        app_name = None
+        try:
+            app_name = parse_valid_name(jam_props['PackageURL'], verbose=verbose)
+        except ValueError as e:
+            if verbose:
+                print(f"Warning: {e.args[0]}")
+
+        if not app_name:
+            if verbose:
+                print(f"Warning: No valid app name found in {adf_file}. Using base name.")
+            app_name = f'{os.path.splitext(adf_file)[0]}'
 
-            # Get app name
-            app_name = None
+        # Build JAM file content
+        jam_file = fmt_plaintext_jam(jam_props)
+
+        # Write JAM file
+        app = ExtractedApp(adf_file, app_name, jam_props.get('PackageURL'))
+        for encoding in self.encodings:
             try:
-                app_name = parse_valid_name(jam_props['PackageURL'], verbose=verbose)
-            except ValueError as e:
+                jam_file.encode(encoding)
+                app.add_text(".jam", jam_file, encoding)
+                break
+            except UnicodeEncodeError:
                 if verbose:
-                    print(f"Warning: {e.args[0]}")
+                    print(f"Warning: UnicodeEncodeError with {encoding}. Trying next encoding.")
+                if encoding == self.encodings[-1]:
+                    if verbose:
+                        print(f"Warning: Could not write JAM file {app_name}. Skipping.")
+                    return
 
-            if not app_name:
-                if verbose:
-                    print(f"Warning: No valid app name found in {adf_file}. Using base name.")
-                app_name = f'{os.path.splitext(adf_file)[0]}'
+        # Copy JAR and SP files
+        app.add_copy(".jar", jar_file)
 
-            # Check for duplicate app names
-            if os.path.exists(os.path.join(target_directory, f"{app_name}.jam")):
+        if os.path.exists(sp_file):
+            try:
+                sp_size_list = jam_props['SPsize'].split(',')
+                sp_size_list = [int(sp_size) for sp_size in sp_size_list]
+                sp_header = fmt_spsize_header(sp_size_list)
+                app.add_copy(".sp", sp_file, header=sp_header)
+            except Exception as e:
                 if verbose:
-                    print(f"Warning: {app_name}.jam already exists in {target_directory}.")
-                app_name = f"{app_name}_{self.duplicate_count+1}"
-                self.duplicate_count += 1
-
-            # Build JAM file content
-            jam_file = fmt_plaintext_jam(jam_props)
-
-            # Write JAM file
-            for encoding in self.encodings:
-                try:
-                    with open(os.path.join(target_directory, f"{app_name}.jam"), 'w', encoding=encoding) as f:
-                        f.write(jam_file)
-                    break
-                except UnicodeEncodeError:
-                    if verbose:
-                        print(f"Warning: UnicodeEncodeError with {encoding}. Trying next encoding.")
-                    if encoding == self.encodings[-1]:
-                        if verbose:
-                            print(f"Warning: Could not write JAM file {app_name}. Skipping.")
-                        return
-
-            # Copy JAR and SP files
-            shutil.copy(jar_file, os.path.join(target_directory, f"{app_name}.jar"))
-
-            if os.path.exists(sp_file):
-                try:
-                    sp_size_list = jam_props['SPsize'].split(',')
-                    sp_size_list = [int(sp_size) for sp_size in sp_size_list]
-                    sp_header = fmt_spsize_header(sp_size_list)
-                    with open(sp_file, 'rb') as sp, open(os.path.join(target_directory, f"{app_name}.sp"), 'wb') as f:
-                        f.write(sp_header)
-                        f.write(sp.read())
-                except Exception as e:
-                    if verbose:
-                        print(f"Warning: Failed to process SP file {sp_file}. Error: {e}")
+                    print(f"Warning: Failed to process SP file {sp_file}. Error: {e}")
 
-            if verbose:
-                print(f"Processed: {adf_file} -> {app_name}")
+        return app
             
-    def test_structure(self, top_folder_directory):
+    def test_structure(self, top_folder_directory, listing=None):
         """
         Test the structure of the top folder directory to see if it is of this type.
         
         :param top_folder_directory: Top folder directory to extract games from.
+        :param listing: Cached listing of the top folder directory shared between phone types, if any.
         """
+        listing = listing or DirectoryListing(top_folder_directory)
         
         # Expected folder names (case-insensitive detection)
         required_folders = ["adf", "jar", "sp"]
 
         # Get the actual folder names while preserving case
-        folder_map = {folder.lower(): folder for folder in os.listdir(top_folder_directory)}
+        folder_map = {folder.lower(): folder for folder in listing.listdir()}
 
         # Ensure all required folders exist (case-insensitively)
         if not all(folder in folder_map for folder in required_folders):
             return None
 
-        # Paths to required folders (preserving original case)
-        folder_paths = {folder: os.path.join(top_folder_directory, folder_map[folder]) for folder in required_folders}
-
         # Check if the "sp" folder contains any subfolders
-        sp_folder_path = folder_paths["sp"]
-        sp_contents = os.listdir(sp_folder_path)
+        sp_contents = listing.entries(folder_map["sp"])
 
-        for item in sp_contents:
-            if os.path.isdir(os.path.join(sp_folder_path, item)):
-                return None  
+        if any(sp_contents.values()):
+            return None  
 
         for folder in required_folders:
-            folder_path = folder_paths[folder]
-            folder_files = os.listdir(folder_path)
+            folder_files = listing.listdir(folder_map[folder])
 
             # In the adf folder, check for any file starting with 'adffile'
             if folder == "adf":
+                if any(file.lower().startswith("adffile") for file in folder_files):
+                    return None
+                # Check if a file contains at least one 00 byte, reading past the start of the file only if it has none
                 for file in folder_files:
-                    if file.lower().startswith("adffile"):
+                    if not listing.file_contains(b'\x00', folder_map[folder], file):
                         return None
-                    # Check if a file contains at least one 00 byte
-                    with open(os.path.join(folder_path, file), 'rb') as f:
-                        if f.read().count(b'\x00') == 0:
-                            return None
             
             # Ensure there is at least one valid 'folderX' file (e.g., adf1, jar2, sp3)
             valid_file_found = False
@@ -1,38 +1,468 @@
 from util.constants import *
+from util.structure_utils import create_target_folder, copy_ranges, NameRegistry, DirectoryListing
+from util.postprocess import POSTPROCESS_RULES, find_real_name
+from util.manifest import ExtractionManifest, stat_sources, new_digest, expand_sources
+from util.decoding import remember_file_encoding
+from util.jam_utils import find_plausible_keywords_for_validity, NullADFLayout, LayoutCache
+from util.verify import verify_jar, verify_outputs, VerdictCache, VERDICT_CACHE_FILE_NAME, VERIFICATION_REPORT_FILE_NAME
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import groupby
+import os
+import shutil
+
+class ExtractedApp:
+    """
+    A class to represent the result of processing a single app.
+
+    It only records what has to be written. The extraction engine decides the final app name
+    and writes the outputs, so per-app processing can safely run in worker processes.
+    """
+
+    def __init__(self, source_name, app_name, package_url=None):
+        """
+        Initialize the result.
+
+        :param source_name: Name of the source the app was extracted from, used in messages.
+        :param app_name: Preferred app name, before rename rules and duplicate handling.
+        :param package_url: PackageURL of the app, used by the rename rules.
+        """
+        self.source_name = source_name
+        self.app_name = app_name
+        self.package_url = package_url
+        self.outputs = []
+
+        # Set by the extraction engine for the manifest
+        self.manifest_key = None
+        self.sources = None
+        # JAR verdicts found while processing the app, added to the verdict cache by the extraction engine
+        self.verdicts = {}
+        # Problems found in the outputs while processing the app, added to the verification report by the extraction engine
+        self.problems = []
+        # Message of the exception processing the app failed with, the app being skipped
+        self.error = None
+
+    def add_text(self, suffix, text, encoding):
+        """
+        Add a text output, e.g. a JAM file.
+
+        :param suffix: Suffix appended to the app name, including the extension.
+        :param text: Text content.
+        :param encoding: Encoding to write the text with.
+        """
+        self.outputs.append(("text", suffix, text, encoding))
+
+    def add_bytes(self, suffix, data):
+        """
+        Add a binary output with content already in memory.
+
+        :param suffix: Suffix appended to the app name, including the extension.
+        :param data: Bytes content.
+        """
+        self.outputs.append(("bytes", suffix, data))
+
+    def add_copy(self, suffix, src_paths, header=b"", preserve_metadata=False):
+        """
+        Add an output copied from source files, without reading them into memory.
+
+        :param suffix: Suffix appended to the app name, including the extension.
+        :param src_paths: A source file path or (path, offset, length) range, or a list of them to be concatenated.
+                          A length of None copies up to the end of the file.
+        :param header: Bytes to write before the copied contents, e.g. a SP size header.
+        :param preserve_metadata: Copy file metadata as well, only for a single whole source file without header.
+        """
+        if isinstance(src_paths, (str, os.PathLike, tuple)):
+            src_paths = [src_paths]
+        src_ranges = [src if isinstance(src, tuple) else (src, 0, None) for src in src_paths]
+        self.outputs.append(("copy", suffix, src_ranges, header, preserve_metadata))
+
+    @property
+    def suffixes(self):
+        """
+        Suffixes of all outputs, used to reserve the app name.
+        """
+        return [output[1] for output in self.outputs]
+
+    def write(self, target_directory, app_name):
+        """
+        Write all outputs into the target directory under the given app name.
+
+        :param target_directory: Directory to write the outputs into.
+        :param app_name: Final app name.
+
+        :return: A dictionary of the written files, as [size, hash] by file name. Copied files are not read, their hash is None
+        """
+        written = {}
+        for kind, suffix, *args in self.outputs:
+            file_name = f"{app_name}{suffix}"
+            dst = os.path.join(target_directory, file_name)
+            digest = None
+            if kind in ("text", "bytes"):
+                if kind == "text":
+                    # Same newline translation as a file opened in text mode
+                    text, encoding = args
+                    data = text.replace("\n", os.linesep).encode(encoding)
+                else:
+                    data = args[0]
+                with open(dst, 'wb') as f:
+                    f.write(data)
+                if kind == "text":
+                    remember_file_encoding(dst, encoding, ENCODINGS)
+                digest = new_digest()
+                digest.update(data)
+                digest = digest.hexdigest()
+            elif kind == "copy":
+                src_ranges, header, preserve_metadata = args
+                with open(dst, 'wb') as f:
+                    f.write(header)
+                    # Consecutive ranges of the same file are copied with the file opened once
+                    for src_path, group in groupby(src_ranges, key=lambda src: src[0]):
+                        copy_ranges(src_path, f, [(offset, length) for _, offset, length in group])
+                if preserve_metadata and not header and len(src_ranges) == 1 and src_ranges[0][1:] == (0, None):
+                    shutil.copystat(src_ranges[0][0], dst)
+            written[file_name] = [os.path.getsize(dst), digest]
+        return written
+
+def run_per_app(process_app, apps, jobs=1):
+    """
+    Run the per-app function over all apps and yield the results in input order.
+
+    :param process_app: Picklable function taking a single app entry.
+    :param apps: List of app entries, as returned by PhoneType.list_apps.
+    :param jobs: Number of worker processes. 1 runs everything in the current process.
+    """
+    if jobs <= 1 or len(apps) <= 1:
+        yield from map(process_app, apps)
+        return
+
+    # Bigger chunks keep the pickling overhead low for dumps with thousands of apps
+    chunksize = max(1, len(apps) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(process_app, apps, chunksize=chunksize)
 
 class PhoneType(ABC):
     """
     An abstract class to represent a phone type with its extraction method.
     """
-    
+
     def __init__(self):
         """
         Initialize the phone type.
         """
-        self.duplicate_count = 0
+        self.name_registry = None
+        self.manifest = None
+        self.rename_rules = []
+        self.verify_mode = "full"
+        self.verdict_cache = VerdictCache()
         self.encodings = ENCODINGS
         self.null_type_offsets = NULL_TYPE_OFFSETS
+        self.null_layout = NullADFLayout(self.null_type_offsets)
         self.plaintext_cutoff_offsets = PLAINTEXT_CUTOFF_OFFSETS
+        self.plaintext_cutoffs = LayoutCache(self.plaintext_cutoff_offsets)
         self.sh_type_offsets = SH_TYPE_OFFSETS
         self.so_type_offsets = SO_TYPE_OFFSETS
+        self.so_layouts = LayoutCache(self.so_type_offsets)
         self.so_no_garb_offsets = SO_NO_GARB
 
+    def extract(self, top_folder_directory, verbose=False, jobs=1, rename_rules=None, incremental=True, target_directory=None, verify_outputs_mode="structural", quarantine=False):
+        """
+        Extract games from the top folder directory.
+
+        Apps are processed by process_app, in worker processes if jobs > 1. Name allocation
+        and writes are done here in order, so the output is the same as a sequential run.
+
+        :param top_folder_directory: Top folder directory to extract games from.
+        :param jobs: Number of worker processes to process apps with.
+        :param rename_rules: Rename rule functions applied to app names before writing, all registered rules by default.
+        :param incremental: Skip the apps that did not change since the last extraction into the same output folder.
+        :param target_directory: Output folder, an "output" folder next to the top folder directory by default.
+        :param verify_outputs_mode: Verification mode of the JARs of the written apps after the extraction, None not to verify them.
+        :param quarantine: Move the written apps failing verification into a quarantine folder.
+
+        :return: A dictionary with the output folder, the number of apps listed, unchanged, written and skipped,
+                 and the number of written apps failing verification
+        """
+        # Create the target directory at the same level as the top folder directory, unless given
+        target_directory = create_target_folder(top_folder_directory, target_directory)
+        self.name_registry = NameRegistry(target_directory)
+        self.manifest = ExtractionManifest(target_directory, type(self).__name__)
+        self.verdict_cache = VerdictCache(os.path.join(target_directory, VERDICT_CACHE_FILE_NAME))
+        self.rename_rules = [rule for rule, _ in POSTPROCESS_RULES] if rename_rules is None else list(rename_rules)
+
+        self.prepare(top_folder_directory, verbose=verbose)
+
+        # Apps are committed in the order of their keys, not of the directory listing, so duplicate names get the same suffixes every run
+        apps = sorted(self.list_apps(top_folder_directory, verbose=verbose), key=lambda app: self.app_key(app, top_folder_directory))
+        summary = {"target_directory": target_directory, "listed": len(apps), "unchanged": 0, "written": 0, "skipped": 0, "failed_apps": 0, "failed_verification": 0}
+        if incremental:
+            apps = [app for app in apps if not self.is_app_unchanged(app, top_folder_directory, verbose=verbose)]
+            summary["unchanged"] = summary["listed"] - len(apps)
+
+        written_apps = {}
+        failed = False
+        try:
+            process_app = partial(self.process_app_with_sources, top_folder_directory=top_folder_directory, verbose=verbose)
+            app_problems = {}
+            app_keys = {}
+            errors = []
+            for app in run_per_app(process_app, apps, jobs):
+                if app is not None and app.error is None:
+                    app_name, outputs = self.commit_app(app, target_directory, verbose=verbose)
+                    written_apps[app_name] = list(outputs)
+                    app_problems[app_name] = app.problems
+                    app_keys[app_name] = app.manifest_key
+                    summary["written"] += 1
+                else:
+                    summary["skipped"] += 1
+                    if app is not None:
+                        errors.append(app.error)
+            summary["failed_apps"] = len(errors)
+
+            # Apps failing one by one are skipped, all of them failing means the dump is not of this phone type
+            if errors and len(errors) == len(apps):
+                raise ValueError(f"All {len(apps)} apps failed, the first one with: {errors[0]}")
+
+            # Check the written apps, the unchanged ones were checked when they were written
+            if verify_outputs_mode:
+                # Results of earlier runs are kept for the apps still in the output folder
+                kept_apps = {entry["app_name"] for entry in self.manifest.apps.values()}
+                report = verify_outputs(target_directory, written_apps, verify_outputs_mode, jobs, self.verdict_cache, quarantine, verbose=verbose, problems=app_problems, kept_apps=kept_apps)
+                summary["failed_verification"] = report["failed"]
+                for result in report["apps"]:
+                    if result.get("quarantine_files") and app_keys.get(result["app_name"]):
+                        self.manifest.quarantine(app_keys[result["app_name"]], result["quarantine_files"])
+                if report["failed"]:
+                    print(f"Warning: {report['failed']} of {report['checked']} apps failed verification. See {VERIFICATION_REPORT_FILE_NAME} in {target_directory}.")
+        except Exception:
+            # Nothing of a failed extraction is kept, so another phone type can be extracted into the same folder
+            failed = True
+            self.remove_written_apps(target_directory, written_apps)
+            raise
+        finally:
+            if not failed:
+                self.manifest.save()
+                self.verdict_cache.save()
+        return summary
+
+    def remove_written_apps(self, target_directory, written_apps):
+        """
+        Remove the files written by an extraction, and release their names.
+
+        :param target_directory: Output folder of the extraction.
+        :param written_apps: Dictionary of the file names of the outputs by app name.
+        """
+        for app_name, output_names in written_apps.items():
+            for output_name in output_names:
+                try:
+                    os.remove(os.path.join(target_directory, output_name))
+                except OSError:
+                    pass
+            self.name_registry.release(app_name, [output_name[len(app_name):] for output_name in output_names])
+
+    def app_key(self, app, top_folder_directory):
+        """
+        Get the key of an app in the manifest, from its entry with paths relative to the top folder.
+
+        :param app: App entry as returned by list_apps.
+        :param top_folder_directory: Top folder directory to extract games from.
+        """
+        parts = app if isinstance(app, (tuple, list)) else (app,)
+        return "|".join(os.path.relpath(part, top_folder_directory) if os.path.isabs(part) else part for part in map(str, parts))
+
+    def app_sources(self, app):
+        """
+        Hook to get the paths of the files an app is extracted from. Directories stand for all the files they contain.
+
+        :param app: App entry as returned by list_apps.
+
+        :return: A list of paths, or None if the app cannot be skipped when unchanged
+        """
+        return None
+
+    def is_app_unchanged(self, app, top_folder_directory, verbose=False):
+        """
+        Check in the manifest if an app did not change since it was last extracted.
+
+        :param app: App entry as returned by list_apps.
+        :param top_folder_directory: Top folder directory to extract games from.
+        """
+        source_paths = self.app_sources(app)
+        if source_paths is None:
+            return False
+        key = self.app_key(app, top_folder_directory)
+        if not self.manifest.is_unchanged(key, source_paths, top_folder_directory):
+            return False
+        if verbose:
+            print(f"Unchanged: {key} -> {self.manifest.get(key)['app_name']}. Skipping.")
+        return True
+
+    def process_app_with_sources(self, app, top_folder_directory, verbose=False):
+        """
+        Process a single app, and get the state of its source files for the manifest.
+
+        :param app: App entry as returned by list_apps.
+        :param top_folder_directory: Top folder directory to extract games from.
+
+        :return: An ExtractedApp, or None if the app is skipped
+        """
+        try:
+            result = self.process_app(app, verbose=verbose)
+        except Exception as e:
+            # A single app failing does not stop the extraction of the others
+            print(f"Warning: Processing {app} failed with an exception: {e}")
+            result = ExtractedApp(str(app), None)
+            result.error = f"{type(e).__name__}: {e}"
+            return result
+        if result is not None:
+            result.verdicts = self.verdict_cache.take_added()
+        source_paths = self.app_sources(app)
+        if result is not None and source_paths is not None:
+            result.manifest_key = self.app_key(app, top_folder_directory)
+            previous = self.manifest.get(result.manifest_key)
+            result.sources = stat_sources(source_paths, top_folder_directory, previous["sources"] if previous else None)
+        return result
+
+    def verify_jar(self, jar_data):
+        """
+        Verify a JAR with the verification mode of the phone type, through the verdict cache.
+
+        :param jar_data: JAR contents as a bytes-like object, or path to the JAR file.
+
+        :return: True if the JAR is valid, False otherwise
+        """
+        return verify_jar(jar_data, self.verify_mode, self.verdict_cache)
+
+    def prepare(self, top_folder_directory, verbose=False):
+        """
+        Hook to run once before any app is processed, in the main process.
+
+        :param top_folder_directory: Top folder directory to extract games from.
+        """
+        pass
+
     @abstractmethod
-    def extract(self, top_folder_directory, verbose=False):
+    def list_apps(self, top_folder_directory, verbose=False):
         """
-        Abstract method to extract phone type from the top folder directory.
-        
+        Abstract method to list the apps in the top folder directory.
+
         :param top_folder_directory: Top folder directory to extract games from.
+
+        :return: An iterable of picklable app entries to be passed to process_app
+        """
+        ...
+
+    @abstractmethod
+    def process_app(self, app, verbose=False):
+        """
+        Abstract method to process a single app. It must not write into the target directory.
+
+        :param app: App entry as returned by list_apps.
+
+        :return: An ExtractedApp, or None if the app is skipped
         """
         ...
-    
+
+    def commit_app(self, app, target_directory, verbose=False):
+        """
+        Allocate the final name for a processed app and write its outputs.
+
+        :param app: ExtractedApp returned by process_app.
+        :param target_directory: Directory to write the outputs into.
+        """
+        # An app extracted before keeps its files, they are overwritten
+        previous = self.manifest.get(app.manifest_key) if app.manifest_key else None
+        if previous:
+            previous_name = previous["app_name"]
+            self.name_registry.release(previous_name, [output_name[len(previous_name):] for output_name in previous["outputs"]])
+
+        app_name = app.app_name
+
+        # Apply the rename rules, so the app is written under its final name right away
+        if app.package_url:
+            real_name = find_real_name(app_name, app.package_url, self.rename_rules)
+            if real_name:
+                if verbose:
+                    print(f"Renamed: {app_name} -> {real_name}")
+                app_name = real_name
+
+        # Reserve a name not colliding with any file already in the target directory
+        preferred_name = app_name
+        app_name = self.name_registry.reserve(preferred_name, app.suffixes)
+        if app_name != preferred_name and verbose:
+            print(f"Warning: {preferred_name} already exists in {target_directory}.")
+
+        outputs = app.write(target_directory, app_name)
+
+        if previous:
+            for output_name in previous["outputs"]:
+                if output_name not in outputs:
+                    try:
+                        os.remove(os.path.join(target_directory, output_name))
+                    except OSError:
+                        pass
+        if app.manifest_key:
+            self.manifest.record(app.manifest_key, app.sources, app_name, outputs)
+        self.verdict_cache.update(app.verdicts)
+
+        if verbose:
+            print(f"Processed: {app.source_name} -> {app_name}\n")
+
+        return app_name, outputs
+
+    def probe(self, top_folder_directory, listing=None, sample_size=DETECTION_SAMPLE_SIZE):
+        """
+        Score how likely the top folder directory is of this phone type.
+        Half of the score comes from the structure test, the other half from a sample of the listed apps:
+        whether their source files exist, and whether the start of one of them has the minimal JAM keywords.
+
+        :param top_folder_directory: Top folder directory to test.
+        :param listing: Cached listing of the top folder directory shared between phone types, if any.
+        :param sample_size: Maximum number of apps, and of source files per app, looked at.
+
+        :return: A tuple of the confidence between 0 and 1, and a list of evidence messages
+        """
+        listing = listing or DirectoryListing(top_folder_directory)
+        try:
+            if not self.test_structure(top_folder_directory, listing):
+                return 0.0, ["Structure test did not match."]
+        except Exception as e:
+            return 0.0, [f"Structure test failed: {e}"]
+        evidence = ["Structure test matched."]
+
+        try:
+            apps = list(self.list_apps(top_folder_directory))
+        except Exception as e:
+            return 0.5, evidence + [f"Listing apps failed: {e}"]
+        if not apps:
+            return 0.5, evidence + ["No apps found."]
+
+        # Spread the sample over the whole list
+        step = max(1, len(apps) // sample_size)
+        sample = apps[::step][:sample_size]
+        present = plausible = 0
+        for app in sample:
+            try:
+                source_paths = expand_sources(self.app_sources(app) or [])[:sample_size]
+            except Exception:
+                continue
+            source_paths = [path for path in source_paths if os.path.isfile(path)]
+            if source_paths:
+                present += 1
+            if any(find_plausible_keywords_for_validity(listing.read_prefix(os.path.relpath(path, top_folder_directory))) for path in source_paths):
+                plausible += 1
+
+        evidence.append(f"{len(apps)} apps listed, {present} of {len(sample)} sampled have source files, {plausible} have JAM keywords.")
+        confidence = 0.5 + 0.25 * present / len(sample) + 0.25 * plausible / len(sample)
+        return round(confidence, 3), evidence
+
     @staticmethod
     @abstractmethod
-    def test_structure(self, top_folder_directory):
+    def test_structure(self, top_folder_directory, listing=None):
         """
         Abstract method to test the structure of the top folder directory to see if it is of corresponding phone type.
-        
+
         :param top_folder_directory: Top folder directory to test the structure of.
+        :param listing: Cached listing of the top folder directory shared between phone types, if any.
         """
-        ...
\ No newline at end of file
+        ...
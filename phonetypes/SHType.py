@@ -1,8 +1,10 @@
-from phonetypes.PhoneType import PhoneType
+from phonetypes.PhoneType import PhoneType, ExtractedApp
 import os
+import mmap
 import struct
 from util.jam_utils import parse_props_plaintext, parse_valid_name, fmt_spsize_header, find_plausible_keywords_for_validity, is_valid_sh_header, filter_sdf_fields, fmt_plaintext_jam
-from util.structure_utils import create_target_folder
+from util.structure_utils import DirectoryListing
+from util.decoding import decode_text
 
 class SHType(PhoneType):
     """
@@ -19,190 +21,193 @@ class SHType(PhoneType):
         - jar file
     """
 
-    def extract(self, top_folder_directory, verbose=False):
+    def list_apps(self, top_folder_directory, verbose=False):
         """
-        Extract games from the top folder directory in a SO phone file structure.
+        List the .apl files in the top folder directory.
 
         :param top_folder_directory: Top folder directory to extract games from.
         """
-        # Create the target directory at the same level as the top folder directory
-        target_directory = create_target_folder(top_folder_directory)
+        # List all files
+        files = os.listdir(top_folder_directory)
+
+        # Process APL files
+        apl_files = [f for f in files if f.lower().endswith('.apl')]
+
+        return [os.path.join(top_folder_directory, apl_file) for apl_file in apl_files]
+
+    def app_sources(self, apl_file_path):
+        """
+        Get the paths of the files the app is extracted from.
+
+        :param apl_file_path: APL file path.
+        """
+        apl_name = os.path.splitext(os.path.basename(apl_file_path))[0]
+        return [apl_file_path, os.path.join(os.path.dirname(apl_file_path), f"{apl_name}.scp")]
+    
+    def process_app(self, apl_file_path, verbose=False):
+        """
+        Process a single .apl file, with its .scp file if present.
 
-        def process_file(apl_file_path):
+        :param apl_file_path: Path to the .apl file.
+        """
+        if verbose:
+            print('-' * 80)
+
+        apl_name = os.path.basename(apl_file_path).split('.')[0]
+
+        # Map the file once, sections are then sliced or copied from it without reading the whole file
+        with open(apl_file_path, 'rb') as f:
+            try:
+                apl_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                apl_map = None
+
+        # Preliminary check for the file to have a valid JAM entry
+        if apl_map is None or not find_plausible_keywords_for_validity(apl_map):
             if verbose:
-                print('-' * 80)
+                print(f"Warning: Skipping file {apl_name}: No minimal required keywords found for the .apl to have a valid JAM file")
+            if apl_map is not None:
+                apl_map.close()
+            return
+
+        with apl_map:
+            sections = self.find_sections(apl_map, apl_name, verbose=verbose)
+            if sections is None:
+                return
+            jam_file = apl_map[sections["jam"][0]:sum(sections["jam"])]
+            sdf_file = apl_map[sections["sdf"][0]:sum(sections["sdf"])]
 
-            apl_name = os.path.basename(apl_file_path).split('.')[0]
+        jam_size = sections["jam"][1]
+        sdf_size = sections["sdf"][1]
+        jar_size = sections["jar"][1]
 
-            # Preliminary check for the file to have a valid JAM entry
-            apl_contents = open(apl_file_path, 'rb').read()
-            if not find_plausible_keywords_for_validity(apl_contents):
+        # Decode and validate JAM file
+        jam_file, used_encoding = decode_text(jam_file, self.encodings, verbose=verbose)
+        if jam_file is None:
+            if verbose:
+                print(f"Warning: Could not read JAM file {apl_name}. Skipping.")
+            return
+        
+        # Get props as kv map
+        jam_props = parse_props_plaintext(jam_file, verbose=verbose)
+        
+        if sections["linear"]:
+            # Filter out SDF fields
+            jam_props, sdf_props = filter_sdf_fields(jam_props)
+            jam_file = fmt_plaintext_jam(jam_props)
+            sdf_file = fmt_plaintext_jam(sdf_props).encode()
+            sdf_size = len(sdf_file)
+        
+        # Determine app name
+        package_url = jam_props.get('PackageURL')
+        app_name = None
+        if package_url:
+            try:
+                app_name = parse_valid_name(package_url, verbose=verbose)
+            except ValueError as e:
                 if verbose:
-                    print(f"Warning: Skipping file {apl_name}: No minimal required keywords found for the .apl to have a valid JAM file")
-                return
-            
-            valid_offset = -1
-            
-            with open(apl_file_path, 'rb') as apl_file:
-                size_header = apl_file.read(max(self.sh_type_offsets) + 32)  # Read offset + 32
-                for offset in self.sh_type_offsets:
-                    # Check if header is valid
-                    if is_valid_sh_header(size_header, offset):
-                        if offset != 0:
-                            # Dynamically unpack header based on offset
-                            num_integers = offset // 4
-                            format_string = f'<{"I" * num_integers}'
-                            unpacked_values = struct.unpack(format_string, size_header[:offset])
-
-                            # Assign values to variables
-                            jam_size, sdf_size, unknown_size1, icon160_size, icon48_size, *extra_sizes, jar_size = unpacked_values
-
-                        valid_offset = offset
-                        # If a valid offset is found, stop checking further offsets
-                        if verbose:
-                            print(f"Valid header found at offset {offset}")
-                        break
-                else:
-                    # If no valid offset is found
-                    if verbose:
-                        print(f"Warning: Skipping file {apl_name}. It has no known offsets as a header for sizes.")
-                    return
-                
-                # Process the contents of the file using the unpacked sizes
-                # Reset the file pointer based on the offset
-                apl_file.seek(offset)
-                
-                if valid_offset == 0:
+                    print(f"Warning: {e.args[0]}")
+
+        if not app_name:
+            package_url_candidates = [value for value in jam_props.values() if 'http' in value and ' ' not in value]
+            for package_url in package_url_candidates:
+                try:
+                    app_name = parse_valid_name(package_url, verbose=verbose)
+                except ValueError as e:
                     if verbose:
-                        print(f"Assuming linear JAM + SDF + ICON + ... + JAR structure.")
-                    whole_content = apl_file.read()
-                    # Find if there is an icon between SDF and JAR by using GIF file magic header
-                    gif_pos = whole_content.find(b"GIF89a")
-                    # Find the first archive header
-                    jar_pos = whole_content.find(b"\x50\x4B\x03\04")
-                    # The GIF magic header found is not an icon if it is inside the archive
-                    if gif_pos > jar_pos:
-                        gif_pos = -1
-                    if jar_pos == -1:
-                        if verbose:
-                            print(f"Warning: Skipping file {apl_name}: Unknown format.")
-                        return
-                    jam_file = whole_content[:jar_pos if gif_pos == -1 else gif_pos]
-                    jar_file = whole_content[jar_pos:]
-                    jam_size = len(jam_file)
-                    jar_size = len(jar_file)
-                    sdf_size = 0
-                elif valid_offset != 0:
-                    # Fetch data
-                    jam_file = apl_file.read(jam_size)
-                    sdf_file = apl_file.read(sdf_size)
-                    unknown1_file = apl_file.read(unknown_size1)
-                    for idx, extra_size in enumerate(extra_sizes):
-                        extra_file = apl_file.read(extra_size)
-                    icon160_file = apl_file.read(icon160_size)
-                    icon48_file = apl_file.read(icon48_size)
-                    jar_file = apl_file.read(jar_size)
-                
-                # Decode and validate JAM file
-                for encoding in self.encodings:
-                    try:
-                        jam_file = jam_file.decode(encoding)
-                        used_encoding = encoding
-                        break
-                    except UnicodeDecodeError:
-                        if verbose:
-                            print(f"Warning: UnicodeDecodeError with {encoding}. Trying next encoding.")
-                else:
-                    if verbose:
-                        print(f"Warning: Could not read JAM file {apl_name}. Skipping.")
-                    return
-                
-                # Get props as kv map
-                jam_props = parse_props_plaintext(jam_file, verbose=verbose)
-                
-                if valid_offset == 0:
-                    # Filter out SDF fields
-                    jam_props, sdf_props = filter_sdf_fields(jam_props)
-                    jam_file = fmt_plaintext_jam(jam_props)
-                    sdf_file = fmt_plaintext_jam(sdf_props).encode()
-                    sdf_size = len(sdf_file)
-                
-                # Determine app name
-                package_url = jam_props.get('PackageURL')
-                app_name = None
-                if package_url:
-                    try:
-                        app_name = parse_valid_name(package_url, verbose=verbose)
-                    except ValueError as e:
-                        if verbose:
-                            print(f"Warning: {e.args[0]}")
-
-                if not app_name:
-                    package_url_candidates = [value for value in jam_props.values() if 'http' in value and ' ' not in value]
-                    for package_url in package_url_candidates:
-                        try:
-                            app_name = parse_valid_name(package_url, verbose=verbose)
-                        except ValueError as e:
-                            if verbose:
-                                print(f"Warning: {e.args[0]}")
-                    if app_name is None:
-                        if verbose:
-                            print(f"Warning: No valid app name found in {apl_file_path}. Using base name.")
-                        app_name = apl_name
-
-                # Handle duplicate app names
-                if os.path.exists(os.path.join(target_directory, f"{app_name}.jam")):
-                    if verbose:
-                        print(f"Warning: {app_name}.jam already exists in {target_directory}.")
-                    app_name = f"{app_name}_{self.duplicate_count + 1}"
-                    self.duplicate_count += 1
-
-                # Check if there is an SCP file with the same name
-                scp_file_path = os.path.join(os.path.dirname(apl_file_path), f"{apl_name}.scp")
-                if os.path.exists(scp_file_path):
-                    sp_sizes = jam_props.get('SPsize', '').split(',')
-                    sp_sizes = [int(sp_size) for sp_size in sp_sizes if sp_size.isdigit()]
-                    header = fmt_spsize_header(sp_sizes)
-                    with open(scp_file_path, 'rb') as scp_file:
-                        with open(os.path.join(target_directory, f"{app_name}.sp"), 'wb') as f:
-                            f.write(header)
-                            f.write(scp_file.read())
-
-                # Write files
-                if jam_size > 0:
-                    with open(os.path.join(target_directory, f"{app_name}.jam"), 'w', encoding=used_encoding) as f:
-                        f.write(jam_file)
-
-                if sdf_size > 0:
-                    with open(os.path.join(target_directory, f"{app_name}.sdf"), 'wb') as f:
-                        f.write(sdf_file)
-
-                if jar_size > 0:
-                    with open(os.path.join(target_directory, f"{app_name}.jar"), 'wb') as f:
-                        f.write(jar_file)
-
+                        print(f"Warning: {e.args[0]}")
+            if app_name is None:
                 if verbose:
-                    print(f"Processed: {apl_name} -> {app_name}\n")
+                    print(f"Warning: No valid app name found in {apl_file_path}. Using base name.")
+                app_name = apl_name
 
-        # List all files
-        files = os.listdir(top_folder_directory)
+        app = ExtractedApp(apl_name, app_name, jam_props.get('PackageURL'))
 
-        # Process APL files
-        apl_files = [f for f in files if f.lower().endswith('.apl')]
+        # Check if there is an SCP file with the same name
+        scp_file_path = os.path.join(os.path.dirname(apl_file_path), f"{apl_name}.scp")
+        if os.path.exists(scp_file_path):
+            sp_sizes = jam_props.get('SPsize', '').split(',')
+            sp_sizes = [int(sp_size) for sp_size in sp_sizes if sp_size.isdigit()]
+            header = fmt_spsize_header(sp_sizes)
+            app.add_copy(".sp", scp_file_path, header=header)
+
+        # Write files
+        if jam_size > 0:
+            app.add_text(".jam", jam_file, used_encoding)
+
+        if sdf_size > 0:
+            app.add_bytes(".sdf", sdf_file)
+
+        if jar_size > 0:
+            # The JAR is copied straight from the APL file
+            app.add_copy(".jar", (apl_file_path, *sections["jar"]))
+
+        return app
 
-        for apl_file in apl_files:
-            apl_file_path = os.path.join(top_folder_directory, apl_file)
-            process_file(apl_file_path)
+    def find_sections(self, apl_map, apl_name, verbose=False):
+        """
+        Compute the section table of an APL file from its size header.
+
+        :param apl_map: Mapped contents of the APL file.
+        :param apl_name: Name of the APL file, used in messages.
 
-    def test_structure(self, top_folder_directory):
+        :return: A dictionary of the (offset, size) of the "jam", "sdf" and "jar" sections, with "linear" set
+                 if the file has no size header, or None if the file has an unknown format
+        """
+        size_header = apl_map[:max(self.sh_type_offsets) + 32]  # Read offset + 32
+        for offset in self.sh_type_offsets:
+            # Check if header is valid
+            if is_valid_sh_header(size_header, offset):
+                # If a valid offset is found, stop checking further offsets
+                if verbose:
+                    print(f"Valid header found at offset {offset}")
+                break
+        else:
+            # If no valid offset is found
+            if verbose:
+                print(f"Warning: Skipping file {apl_name}. It has no known offsets as a header for sizes.")
+            return None
+
+        if offset == 0:
+            if verbose:
+                print(f"Assuming linear JAM + SDF + ICON + ... + JAR structure.")
+            # Find the first archive header
+            jar_pos = apl_map.find(b"\x50\x4B\x03\04")
+            if jar_pos == -1:
+                if verbose:
+                    print(f"Warning: Skipping file {apl_name}: Unknown format.")
+                return None
+            # Find if there is an icon between SDF and JAR by using GIF file magic header, not inside the archive
+            gif_pos = apl_map.find(b"GIF89a", 0, jar_pos)
+            jam_end = jar_pos if gif_pos == -1 else gif_pos
+            return {"linear": True, "jam": (0, jam_end), "sdf": (jam_end, 0), "jar": (jar_pos, len(apl_map) - jar_pos)}
+
+        # Dynamically unpack header based on offset
+        num_integers = offset // 4
+        format_string = f'<{"I" * num_integers}'
+        jam_size, sdf_size, unknown_size1, icon160_size, icon48_size, *extra_sizes, jar_size = struct.unpack(format_string, size_header[:offset])
+
+        # Sections follow the header in this order, the extra ones before the icons
+        sections = {"linear": False}
+        position = offset
+        for section, size in [("jam", jam_size), ("sdf", sdf_size), ("unknown1", unknown_size1), *[(f"extra{idx}", size) for idx, size in enumerate(extra_sizes)], ("icon160", icon160_size), ("icon48", icon48_size), ("jar", jar_size)]:
+            # Sections past the end of the file are cut when sliced or copied, like reads would be
+            sections[section] = (position, size)
+            position += size
+        return sections
+
+    def test_structure(self, top_folder_directory, listing=None):
         """
         Test the structure of the top folder directory to see if it is of SH type.
         
         :param top_folder_directory: Top folder directory to extract games from.
+        :param listing: Cached listing of the top folder directory shared between phone types, if any.
         """
-        files = os.listdir(top_folder_directory)
-        subdirectories = [f for f in files if os.path.isdir(os.path.join(top_folder_directory, f))]
-        if subdirectories:
+        listing = listing or DirectoryListing(top_folder_directory)
+
+        files = listing.entries()
+        if any(files.values()):
             return None
 
         apl_scp_files = [f for f in files if f.lower().endswith('.apl') or f.lower().endswith('.scp')]
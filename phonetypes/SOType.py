@@ -1,8 +1,9 @@
-from phonetypes.PhoneType import PhoneType
-from util.jam_utils import find_plausible_keywords_for_validity, parse_props_plaintext, parse_valid_name, remove_garbage_so, fmt_spsize_header
-from util.structure_utils import create_target_folder
+from phonetypes.PhoneType import PhoneType, ExtractedApp
+from util.jam_utils import find_plausible_keywords_for_validity, parse_props_plaintext, parse_valid_name, remove_garbage_so, so_payload_ranges, fmt_spsize_header
 from util.verify import *
 import os
+from util.structure_utils import DirectoryListing
+from util.decoding import decode_text
 
 class SOType(PhoneType):
     """
@@ -19,198 +20,211 @@ class SOType(PhoneType):
         - jar file
     """
 
-    def extract(self, top_folder_directory, verbose=False):
+    def list_apps(self, top_folder_directory, verbose=False):
         """
-        Extract games from the top folder directory in a SO phone file structure.
+        List the .dat files in the top folder directory and its 'new' and 'old' subfolders.
 
         :param top_folder_directory: Top folder directory to extract games from.
         """
+        apps = []
+        for file in os.listdir(top_folder_directory):
+            if file.endswith('.dat'):
+                apps.append((os.path.splitext(file)[0], top_folder_directory))
+
+        for folder in ['new', 'old']:
+            subdir = os.path.join(top_folder_directory, folder)
+            if os.path.exists(subdir):
+                for file in os.listdir(subdir):
+                    if file.endswith('.dat'):
+                        apps.append((os.path.splitext(file)[0], subdir))
+        return apps
+
+    def app_sources(self, app):
+        """
+        Get the paths of the files the app is extracted from.
+
+        :param app: Tuple of the app name and its folder.
+        """
+        name, current_directory = app
+        return [os.path.join(current_directory, f"{name}{ext}") for ext in (".dat", ".jar", ".scr")]
+    
+    def process_app(self, app, verbose=False):
+        """
+        Process a single .dat, .jar and .scr triplet.
+
+        :param app: Tuple of the triplet base name and the directory containing it.
+        """
         # Mostly contributed by kagekiyo
-        
-        def process_triplet(name, current_directory):
+        name, current_directory = app
+        if verbose:
+            print('-' * 80)
+        dat_path = os.path.join(current_directory, f"{name}.dat")
+        jar_path = os.path.join(current_directory, f"{name}.jar")
+        if not os.path.isfile(jar_path):
             if verbose:
-                print('-' * 80)
-            dat_path = os.path.join(current_directory, f"{name}.dat")
-            jar_path = os.path.join(current_directory, f"{name}.jar")
-            if not os.path.isfile(jar_path):
-                if verbose:
-                    print(f"Warning: {name} does not have .jar file. Skipping.\n")
-                return
-            scr_path = os.path.join(current_directory, f"{name}.scr")
-            
-            with open(dat_path, 'rb') as file:
-                dat_content = file.read()
-                
-            # Verify if valid keywords are present
-            if not find_plausible_keywords_for_validity(dat_content):
-                if verbose:
-                    print(f"Warning: {name} does not contain all required keywords. Skipping.\n")
-                return
+                print(f"Warning: {name} does not have .jar file. Skipping.\n")
+            return
+        scr_path = os.path.join(current_directory, f"{name}.scr")
+        
+        with open(dat_path, 'rb') as file:
+            dat_content = file.read()
             
-            used_offset = -1
-            ok = False
-            for offset in self.so_type_offsets:
-                jam_size = 0
-                indent = offset + jam_size
-                for i in range(5):
-                    indent = indent + jam_size
-                    # "any" etc may occasionally be inserted, causing the indent to shift
-                    # check if next 3 bytes are "any"
-                    if dat_content[indent:indent + 3] == b"any":
-                        indent += 3
-                        i-=1
-                        continue
-                    indent += 2
-                    jam_size = int.from_bytes(dat_content[indent - 2 : indent], "little") - 0x4000 # look behind 2 bytes for size after consuming it
-                    jam_content = dat_content[indent : indent + jam_size] # plaintext
-                    if jam_size > 0x30 and find_plausible_keywords_for_validity(jam_content):
-                        ok = True
-                        break
-                else:
-                    if verbose:
-                        print(f"Warning: 0x{offset:X} is not a valid offset for {name}. Trying next offset.")
-                if ok:
-                    if verbose:
-                        print(f"Valid keywords found. Using offset 0x{offset:X}")
-                    used_offset = offset
-                    break
-            else:
+        # Verify if valid keywords are present
+        if not find_plausible_keywords_for_validity(dat_content):
+            if verbose:
+                print(f"Warning: {name} does not contain all required keywords. Skipping.\n")
+            return
+        
+        # Offsets are tried from the most frequent in the dump, the first valid one in the table being used
+        jam_contents = {}
+        
+        def is_valid(offset):
+            jam_contents[offset] = self.find_jam_content(dat_content, offset)
+            if jam_contents[offset] is None:
                 if verbose:
-                    print(f"Warning: {name} does not contain a valid JAM file. Skipping.")
-                return
-            
-            jam_file = None
-            for encoding in self.encodings:
-                try:
-                    jam_file = jam_content.decode(encoding)
-                    used_encoding = encoding
-                    break
-                except UnicodeDecodeError:
-                    if verbose:
-                        print(f"Warning: UnicodeDecodeError with {encoding}. Trying next encoding.")
-            else:
+                    print(f"Warning: 0x{offset:X} is not a valid offset for {name}. Trying next offset.")
+                return False
+            return True
+        
+        used_offset, _ = self.so_layouts.resolve(is_valid)
+        if used_offset is None:
+            if verbose:
+                print(f"Warning: {name} does not contain a valid JAM file. Skipping.")
+            return
+        if verbose:
+            print(f"Valid keywords found. Using offset 0x{used_offset:X}. Offsets: {self.so_layouts}")
+        jam_content = jam_contents[used_offset]
+        
+        jam_file, used_encoding = decode_text(jam_content, self.encodings, verbose=verbose)
+        if jam_file is None:
+            if verbose:
+                print(f"Warning: Could not read JAM file for {name}. Skipping.\n")
+            return
+        
+        # Get the properties from the JAM file
+        jam_props = parse_props_plaintext(jam_file, verbose=verbose)
+        
+        package_url = None
+        try:
+            package_url = jam_props['PackageURL']
+        except KeyError:
                 if verbose:
-                    print(f"Warning: Could not read JAM file for {name}. Skipping.\n")
-                return
-            
-            # Get the properties from the JAM file
-            jam_props = parse_props_plaintext(jam_file, verbose=verbose)
-            
-            package_url = None
+                    print(f"Warning: No PackageURL found in JAM file.")
+        
+        # Determine valid name for the app
+        app_name = None
+        if package_url:
             try:
-                package_url = jam_props['PackageURL']
-            except KeyError:
-                    if verbose:
-                        print(f"Warning: No PackageURL found in JAM file.")
-            
-            # Determine valid name for the app
-            app_name = None
-            if package_url:
+                app_name = parse_valid_name(package_url, verbose=verbose)
+            except ValueError as e:
+                if verbose:
+                    print(f"Warning: {e.args[0]}")
+        
+        if not app_name:
+            package_url_candidates = [value for value in jam_props.values() if value.find('http') != -1 and value.find(' ') == -1]
+            for package_url in package_url_candidates:
                 try:
                     app_name = parse_valid_name(package_url, verbose=verbose)
                 except ValueError as e:
                     if verbose:
                         print(f"Warning: {e.args[0]}")
+            if app_name is None:
+                if verbose:
+                    print(f"Warning: No valid app name found in {name}. Using base folder name.")
+                app_name = f'{os.path.basename(name)}'
+        
+        # Extract JAR and SP and write files
+        app = ExtractedApp(name, app_name, jam_props.get('PackageURL'))
+        app.add_text(".jam", jam_file, used_encoding)
             
-            if not app_name:
-                package_url_candidates = [value for value in jam_props.values() if value.find('http') != -1 and value.find(' ') == -1]
-                for package_url in package_url_candidates:
-                    try:
-                        app_name = parse_valid_name(package_url, verbose=verbose)
-                    except ValueError as e:
-                        if verbose:
-                            print(f"Warning: {e.args[0]}")
-                if app_name is None:
+        if os.path.exists(jar_path):
+            if used_offset in self.so_no_garb_offsets:
+                jar_data = open(jar_path, 'rb').read()
+                # trim leading bytes before the JAR header signature, ending with 03 04 or 07 08
+                jar_signature_index = jar_data.find(b"PK\x03\x04")
+                if jar_signature_index == -1:
+                    jar_signature_index = jar_data.find(b"PK\x07\x08")
+                jar_signature_index = max(jar_signature_index, 0)
+                if not self.verify_jar(memoryview(jar_data)[jar_signature_index:]):
                     if verbose:
-                        print(f"Warning: No valid app name found in {name}. Using base folder name.")
-                    app_name = f'{os.path.basename(name)}'
-            
-            # Extract JAR and SP and write files
-            # Check there is no duplicate app name existing in the target directory
-            if os.path.exists(os.path.join(target_directory, app_name+".jam")):
-                if verbose:
-                    print(f"Warning: {app_name}.jam already exists in {target_directory}.")
-                app_name = f"{app_name}_{self.duplicate_count+1}"
-                self.duplicate_count += 1 
-            new_jam_path = os.path.join(target_directory, app_name+".jam")
-            with open(new_jam_path, 'w', encoding=used_encoding) as f:
-                f.write(jam_file)
-                
-            if os.path.exists(jar_path):
-                if used_offset in self.so_no_garb_offsets:
-                    jar_data = open(jar_path, 'rb').read()
-                    # trim leading bytes before the JAR header signature, ending with 03 04 or 07 08
-                    jar_signature_index = jar_data.find(b"PK\x03\x04")
-                    if jar_signature_index == -1:
-                        jar_signature_index = jar_data.find(b"PK\x07\x08")
-                    if jar_signature_index != -1:
-                        jar_data = jar_data[jar_signature_index:]
-                else:
-                    jar_data = remove_garbage_so(open(jar_path, 'rb').read())
+                        print(f"Warning: JAR is corrupted for {name}. Skipping.")
+                    return app
+                # The JAR is a range of the file, it does not need to be kept in memory
+                app.add_copy(".jar", (jar_path, jar_signature_index, None))
+            else:
+                jar_data = remove_garbage_so(open(jar_path, 'rb').read())
 
-                if not verify_jar(jar_data):
+                if not self.verify_jar(jar_data):
                     if verbose:
                         print(f"Warning: JAR is corrupted for {name}. Skipping.")
-                    return
+                    return app
                 
-                new_jar_path = os.path.join(target_directory, app_name+".jar")
-                with open(new_jar_path, 'wb') as f:
-                    f.write(jar_data)
+                # The blocks of the JAR are copied from the file, the payload does not need to be kept in memory
+                app.add_copy(".jar", [(jar_path, offset, length) for offset, length in so_payload_ranges(os.path.getsize(jar_path))])
+        else:
+            if verbose:
+                print(f"Warning: {name} doesn't have a JAR file. Skipping.")
+            return app
+        
+        if os.path.exists(scr_path):
+            # Only the header type is read, the blocks are copied from the file
+            with open(scr_path, 'rb') as scr_file:
+                header_type = scr_file.read(0x1F)[0x1E]
+            if header_type in [1,2]:
+                sp_ranges = so_payload_ranges(os.path.getsize(scr_path), header=0x20+0x16)
             else:
-                if verbose:
-                    print(f"Warning: {name} doesn't have a JAR file. Skipping.")
-                return
+                sp_ranges = so_payload_ranges(os.path.getsize(scr_path))
             
-            if os.path.exists(scr_path):
-                sp_data = open(scr_path, 'rb').read()
-                
-                header_type = sp_data[0x1E]
-                if header_type in [1,2]:
-                    sp_data = remove_garbage_so(open(scr_path, 'rb').read(), header=0x20+0x16)
-                else:
-                    sp_data = remove_garbage_so(open(scr_path, 'rb').read())
-                
-                sp_path = os.path.join(target_directory, app_name+".sp")
-                with open(sp_path, 'wb') as f:
-                    sp_size_list = jam_props['SPsize'].split(',')
-                    sp_size_list = [int(sp_size) for sp_size in sp_size_list]
-                    header = fmt_spsize_header(sp_size_list)
-                    f.write(header)
-                    f.write(sp_data)
-                
-            if verbose:
-                print(f"Processed: {name} -> {app_name}\n")
+            sp_size_list = jam_props['SPsize'].split(',')
+            sp_size_list = [int(sp_size) for sp_size in sp_size_list]
+            header = fmt_spsize_header(sp_size_list)
+            app.add_copy(".sp", [(scr_path, offset, length) for offset, length in sp_ranges], header=header)
         
-        # Main loop
+        return app
+
+    def find_jam_content(self, dat_content, offset):
+        """
+        Find the plaintext JAM of a .dat file from an offset of its size table.
         
-        # Create the target directory at the same level as the top folder directory
-        target_directory = create_target_folder(top_folder_directory)
+        :param dat_content: Contents of the .dat file.
+        :param offset: Offset to read the JAM sizes from.
         
-        for file in os.listdir(top_folder_directory):
-            if file.endswith('.dat'):
-                process_triplet(os.path.splitext(file)[0], top_folder_directory)
-            
-        for folder in ['new', 'old']:
-            subdir = os.path.join(top_folder_directory, folder)
-            if os.path.exists(subdir):
-                for file in os.listdir(subdir):
-                    if file.endswith('.dat'):
-                        process_triplet(os.path.splitext(file)[0], subdir)
-
-    def test_structure(self, top_folder_directory):
+        :return: The JAM contents, or None if no valid JAM is found from the offset
+        """
+        jam_size = 0
+        indent = offset + jam_size
+        for i in range(5):
+            indent = indent + jam_size
+            # "any" etc may occasionally be inserted, causing the indent to shift
+            # check if next 3 bytes are "any"
+            if dat_content[indent:indent + 3] == b"any":
+                indent += 3
+                i-=1
+                continue
+            indent += 2
+            jam_size = int.from_bytes(dat_content[indent - 2 : indent], "little") - 0x4000 # look behind 2 bytes for size after consuming it
+            jam_content = dat_content[indent : indent + jam_size] # plaintext
+            if jam_size > 0x30 and find_plausible_keywords_for_validity(jam_content):
+                return jam_content
+        return None
+    
+    def test_structure(self, top_folder_directory, listing=None):
         """
         Test the structure of the top folder directory to see if it is of SO type.
         
         :param top_folder_directory: Top folder directory to extract games from.
+        :param listing: Cached listing of the top folder directory shared between phone types, if any.
         """
+        listing = listing or DirectoryListing(top_folder_directory)
+
         # check if folders new and old exist
         # if not os.path.exists(os.path.join(top_folder_directory, 'new')) or not os.path.exists(os.path.join(top_folder_directory, 'old')):
         #     return None
         
         # check at least one .dat, .jar, .scr files with same name exist in the root dir (000.dat, 000.jar, 000.scr)
-        for file in os.listdir(top_folder_directory):
+        for file in listing.listdir():
             if file.endswith('.dat'):
-                if os.path.exists(os.path.join(top_folder_directory, file.replace('.dat', '.jar'))) or os.path.exists(os.path.join(top_folder_directory, file.replace('.dat', '.scr'))):
+                if listing.exists(file.replace('.dat', '.jar')) or listing.exists(file.replace('.dat', '.scr')):
                     return "SO"
         
         return None
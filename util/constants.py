@@ -1,4 +1,5 @@
 ENCODINGS = ['cp932', 'utf-8']
+LAST_MODIFIED_FORMAT = "%a, %d %b %Y %H:%M:%S"
 EARLY_NULL_TYPE_OFFSETS = [
     (0x5C, 0x6C),
 ]
@@ -125,6 +126,23 @@ FJJAM_WANTED_COLS = [
     "drawAreaWidth",
     "drawAreaHeight",
 ]
+# Columns consumed by assemble_jam, with the app number to inject the JAM with
+FJJAM_JAM_COLS = [
+    "app_No",
+    "appName",
+    "appNameFull",
+    "appVersion",
+    "packageUrl",
+    "profileVersion",
+    "jar_Size",
+] + [f"spSize{i}" for i in range(15)] + [
+    "appClass",
+    "appParam",
+    "lastModifiedTime",
+    "drawAreaWidth",
+    "drawAreaHeight",
+    "trustedApid",
+]
 SO_TYPE_OFFSETS = [
     0xD3A,
     0xD42,
@@ -135,4 +153,10 @@ SO_TYPE_OFFSETS = [
 SO_NO_GARB = [
     0xF7F,
     0xF82,
-]
\ No newline at end of file
+]
+
+# Maximum number of apps sampled when scoring a phone type
+DETECTION_SAMPLE_SIZE = 8
+
+# Maximum number of bytes of a file read when scoring a phone type
+DETECTION_PREFIX_SIZE = 0x2000
\ No newline at end of file
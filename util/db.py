@@ -2,9 +2,17 @@
 
 from construct import *
 import os
+import sys
+import io
+import mmap
 import itertools
+import struct
+import hashlib
 import scsu
-from util.constants import FJJAM_WANTED_COLS
+from array import array
+from collections import namedtuple
+from functools import lru_cache
+from util.constants import FJJAM_WANTED_COLS, LAST_MODIFIED_FORMAT
 from datetime import datetime, timedelta
 
 checked_uid_struct = Struct(
@@ -142,34 +150,243 @@ db_schema_struct = Struct(
 
 ATTRIB_NOT_NULL = 1
 
+STORE_HEADER_SIZE = 32
+FRAME_SIZE = 0x4000
+FRAME_DESCRIPTOR_SIZE = 2
+
+class StoreReader:
+    """
+    Page-mapped reader of a permanent file store, such as FJJAM.DB.
+
+    The file is memory mapped and logical store offsets are translated to file offsets by skipping
+    the 2 byte descriptor following every 0x4000 byte frame, so nothing is copied but what is read.
+    """
+
+    def __init__(self, path: os.PathLike):
+        self.path = path
+        self._file = open(path, "rb")
+        file_size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if file_size else None
+        self._view = memoryview(self._map) if self._map is not None else memoryview(b"")
+
+        # The last frame may be incomplete, with or without its descriptor
+        frames, rest = divmod(max(0, file_size - STORE_HEADER_SIZE), FRAME_SIZE + FRAME_DESCRIPTOR_SIZE)
+        self.size = frames * FRAME_SIZE + min(rest, FRAME_SIZE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        try:
+            self._view.release()
+            if self._map is not None:
+                try:
+                    self._map.close()
+                except BufferError:
+                    # Views read from the store are still alive, e.g. in the traceback of a failed parse.
+                    # The map is closed when they are freed, and the error of the parse is not hidden.
+                    pass
+        finally:
+            self._file.close()
+
+    @property
+    def header(self) -> memoryview:
+        return self._view[:STORE_HEADER_SIZE]
+
+    def _file_offset(self, offset):
+        frame, frame_offset = divmod(offset, FRAME_SIZE)
+        return STORE_HEADER_SIZE + frame * (FRAME_SIZE + FRAME_DESCRIPTOR_SIZE) + frame_offset
+
+    def read(self, offset, size):
+        """
+        Read bytes at a logical store offset. Reads within a single frame are zero-copy.
+
+        :param offset: Logical offset in the store.
+        :param size: Number of bytes to read, fewer are returned at the end of the store.
+
+        :return: A memoryview, or bytes if the read spans several frames
+        """
+        size = max(0, min(size, self.size - offset))
+        start = self._file_offset(offset)
+        if offset % FRAME_SIZE + size <= FRAME_SIZE:
+            return self._view[start:start + size]
+
+        parts = []
+        while size > 0:
+            chunk = min(size, FRAME_SIZE - offset % FRAME_SIZE)
+            start = self._file_offset(offset)
+            parts.append(self._view[start:start + chunk])
+            offset += chunk
+            size -= chunk
+        return b"".join(parts)
+
+    def stream(self, offset):
+        """
+        Get a file-like stream over the logical store, e.g. for Construct's parse_stream.
+
+        :param offset: Logical offset to start at.
+        """
+        return StoreStream(self, offset)
+
+class StoreStream(io.RawIOBase):
+    def __init__(self, store: StoreReader, offset=0):
+        self._store = store
+        self._pos = offset
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._store.size - self._pos
+        data = bytes(self._store.read(self._pos, size))
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._store.size
+        self._pos = offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+TOC_CACHE_SUFFIX = ".toccache"
+TOC_CACHE_MAGIC = b"KTTOC1"
+toc_cache_header_struct = struct.Struct("<6sQq16sII")
+TOC_MISSING_ENTRY = 0xFFFFFFFF
+toc_entry_unpacker = struct.Struct("<BI")
+toc_delta_entry_unpacker = struct.Struct("<II")
+
 class StoreToc:
-    def __init__(self):
-        self.primary = 0
-        self.entries = []
+    """
+    Table of content of a permanent file store, mapping stream handles to logical offsets.
 
-    def parse(self, data, offset):
-        toc_header = toc_header_struct.parse(data[offset-12:offset])
-        if toc_header.primary & 0x80000000:
-            toc_delta_header = toc_delta_header_struct.parse(data[offset:offset+7])
+    Delta TOCs are flattened iteratively into a compact array, entries without a reference being
+    TOC_MISSING_ENTRY. The flattened TOC can be saved to and loaded from a sidecar cache file.
+    """
 
-            self.parse(data, toc_delta_header.tocoff)
+    def __init__(self):
+        self.primary = 0
+        self.entries = array("I")
 
-            toc_delta_entries = Array(toc_delta_header.n, toc_delta_entry_struct).parse(data[offset+7:offset+7+(toc_delta_header.n*8)])
+    def parse(self, store: StoreReader, offset):
+        # Walk the delta chain down to the base TOC, then apply the deltas from the oldest one
+        deltas = []
+        seen_offsets = set()
+        while True:
+            if offset in seen_offsets:
+                raise ValueError("ERROR: Loop found in the delta TOC chain.")
+            seen_offsets.add(offset)
+
+            toc_header = toc_header_struct.parse(store.read(offset-12, 12))
+            if not deltas:
+                self.primary = toc_header.primary & 0x7FFFFFFF
+            if not toc_header.primary & 0x80000000:
+                break
+            toc_delta_header = toc_delta_header_struct.parse(store.read(offset, 7))
+            deltas.append((offset, toc_header.count, toc_delta_header.n))
+            offset = toc_delta_header.tocoff
 
-            self.entries.extend(itertools.repeat(-1, toc_header.count - len(self.entries)))
-            for entry in toc_delta_entries:
-                self.entries[(entry.handle & 0xFFFFFF) - 1] = entry.ref
-        else:
-            toc_entries = Array(toc_header.count, toc_entry_struct).parse(data[offset:offset+(toc_header.count*5)])
-            self.entries = [e.ref for e in toc_entries]
+        toc_entries = read_exactly(store, offset, toc_header.count*5)
+        self.entries = array("I", (ref for _, ref in toc_entry_unpacker.iter_unpack(toc_entries)))
 
-        self.primary = toc_header.primary & 0x7FFFFFFF
+        for offset, count, n in reversed(deltas):
+            toc_delta_entries = read_exactly(store, offset+7, n*8)
+            if count > len(self.entries):
+                self.entries.extend(itertools.repeat(TOC_MISSING_ENTRY, count - len(self.entries)))
+            for handle, ref in toc_delta_entry_unpacker.iter_unpack(toc_delta_entries):
+                self.entries[(handle & 0xFFFFFF) - 1] = ref
 
     def num_entries(self):
         return len(self.entries)
 
     def get_offset(self, handle):
-        return self.entries[handle - 1]
+        offset = self.entries[handle - 1]
+        return -1 if offset == TOC_MISSING_ENTRY else offset
+
+    @staticmethod
+    def cache_key(store: StoreReader):
+        """
+        Get the cache key of a store: its file size and modification time, and a hash of the store header.
+        The store header points to the current TOC, so it changes whenever the TOC does.
+        """
+        stat = os.stat(store.path)
+        return stat.st_size, stat.st_mtime_ns, hashlib.blake2b(store.header, digest_size=16).digest()
+
+    def load_cache(self, cache_path, key) -> bool:
+        """
+        Load the flattened TOC from a cache file, if it was saved with the same key.
+
+        :return: True if the cache was loaded
+        """
+        try:
+            with open(cache_path, "rb") as f:
+                magic, size, mtime, digest, primary, count = toc_cache_header_struct.unpack(f.read(toc_cache_header_struct.size))
+                if magic != TOC_CACHE_MAGIC or (size, mtime, digest) != key:
+                    return False
+                entries = array("I")
+                entries.frombytes(f.read(count * entries.itemsize))
+        except (OSError, struct.error, ValueError):
+            return False
+        if len(entries) != count:
+            return False
+        if sys.byteorder != "little":
+            entries.byteswap()
+        self.primary = primary
+        self.entries = entries
+        return True
+
+    def save_cache(self, cache_path, key):
+        """
+        Save the flattened TOC to a cache file. Failing to write it, e.g. on a read-only dump, is not an error.
+        """
+        entries = array("I", self.entries)
+        if sys.byteorder != "little":
+            entries.byteswap()
+        try:
+            with open(cache_path, "wb") as f:
+                f.write(toc_cache_header_struct.pack(TOC_CACHE_MAGIC, *key, self.primary, len(entries)))
+                f.write(entries.tobytes())
+        except OSError:
+            pass
+
+def read_exactly(store: StoreReader, offset, size):
+    data = store.read(offset, size)
+    if len(data) != size:
+        raise StreamError(f"stream read less than specified amount, expected {size}, found {len(data)}")
+    return data
+
+def read_store_toc(store: StoreReader, offset, use_cache=True, verbose=False):
+    """
+    Read the TOC of a store, from its sidecar cache file if it is up to date.
+
+    :param offset: Offset of the current TOC, from the store header.
+    :param use_cache: Load and save the sidecar cache file.
+    """
+    toc = StoreToc()
+    if not use_cache:
+        toc.parse(store, offset)
+        return toc
+
+    cache_path = f"{os.fspath(store.path)}{TOC_CACHE_SUFFIX}"
+    key = StoreToc.cache_key(store)
+    if toc.load_cache(cache_path, key):
+        if verbose:
+            print(f"Loaded TOC from cache {cache_path}.")
+        return toc
+    toc.parse(store, offset)
+    toc.save_cache(cache_path, key)
+    return toc
     
 table_token_struct = Struct(
     "iHead" / Int32ul, # head cluster ID
@@ -185,132 +402,353 @@ cluster_struct = Struct(
     "data" / Array(16, If(lambda this: this.sizes[this._index] is not None, Bytes(lambda this: this.sizes[this._index])))
 )
 
-def extract_jam_objects(fjjam_path: os.PathLike, verbose=False):
+def build_table_schema(table):
+    """
+    Convert a table schema to a Construct schema parsing its records. This is the generic decoder.
+
+    :param table: Table schema, as parsed by table_schema_struct.
+
+    :return: A Construct Struct
+    """
+    columns_schemas = [
+        "_rowSize" / TCardinality
+    ]
+    for column in table.columns:
+        column_schema = None
+        if column.type == 0:
+            column_schema = ReadBitSequence()
+        elif column.type == 1:
+            column_schema = Int8sl
+        elif column.type == 2:
+            column_schema = Int8ul
+        elif column.type == 3:
+            column_schema = Int16sl
+        elif column.type == 4:
+            column_schema = Int16ul
+        elif column.type == 5:
+            column_schema = Int32sl
+        elif column.type == 6:
+            column_schema = Int32ul
+        elif column.type == 7:
+            column_schema = Int64sl
+        elif column.type == 8:
+            column_schema = Float32l
+        elif column.type == 9:
+            column_schema = Float64l
+        elif column.type == 10:
+            column_schema = Int64sl # datetime
+        elif column.type == 11:
+            column_schema = PascalString(Int8ul, "cp932")
+        elif column.type == 12:
+            # Symbian uses SCSU for unicode strings
+            column_schema = PascalString(TCardinality, "SCSU")
+        elif column.type == 13:
+            column_schema = Prefixed(Int8ul, GreedyBytes)
+        elif column.type == 14 or column.type == 15 or column.type == 16:
+            data_schema = None
+            match column.type:
+                case 14:
+                    data_schema = PascalString(Int8ul, "cp932")
+                case 15:
+                    data_schema = PascalString(TCardinality, "SCSU")
+                case 16:
+                    data_schema = Prefixed(Int8ul, GreedyBytes)
+            column_schema = Struct(
+                "isInline" / ReadBitSequence(),
+                "outOfLineData" / If(not this.isInline, Struct(
+                    "packedBlobId" / TCardinality,
+                    "size" / TCardinality
+                )),
+                "data" / If(this.isInline, data_schema)
+            )            
+        else:
+            raise ValueError(f"column type {column.type} not supported")
+
+        if (column.attributes & 1) == 0:
+            column_schema = FocusedSeq(
+                "data",
+                "exists" / ReadBitSequence(),
+                "data" / If(this.exists, column_schema)
+            )
+
+        # We use Optional because if there are no following entries, eof can be premature
+        columns_schemas.append(column.name / Optional(column_schema))
+
+    return Struct(*columns_schemas)
+
+def compile_table_schema(table_construct_schema):
+    """
+    Compile a Construct schema if Construct can, otherwise keep it interpreted.
+    """
+    try:
+        return table_construct_schema.compile()
+    except Exception:
+        return table_construct_schema
+
+LongColumn = namedtuple("LongColumn", ["isInline", "outOfLineData", "data"])
+
+FIXED_COLUMN_STRUCTS = {
+    1: struct.Struct("<b"),
+    2: struct.Struct("<B"),
+    3: struct.Struct("<h"),
+    4: struct.Struct("<H"),
+    5: struct.Struct("<i"),
+    6: struct.Struct("<I"),
+    7: struct.Struct("<q"),
+    8: struct.Struct("<f"),
+    9: struct.Struct("<d"),
+    10: struct.Struct("<q"), # datetime
+}
+
+LONG_COLUMN_DATA_TYPES = {14: 11, 15: 12, 16: 13}
+
+def read_cardinality(data, pos):
+    """
+    Read a TCardinality from bytes.
+
+    :return: A tuple of the value and the position after it
+    """
+    n = data[pos]
+    if (n & 0x1) == 0:
+        return n >> 1, pos + 1
+    elif (n & 0x2) == 0:
+        return (n | data[pos + 1] << 8) >> 2, pos + 2
+    elif (n & 0x4) == 0:
+        if pos + 4 > len(data):
+            raise IndexError("TCardinality out of range")
+        return (n | data[pos + 1] << 8 | data[pos + 2] << 16 | data[pos + 3] << 24) >> 3, pos + 4
+    else:
+        raise ValueError("invalid TCardinality value")
+
+def read_column_data(data, pos, column_type, decode=True):
+    """
+    Read a length prefixed column value (types 11 to 13) from bytes.
+
+    :param decode: Decode the value, otherwise only skip it and return None.
+
+    :return: A tuple of the value and the position after it
+    """
+    if column_type == 12:
+        size, pos = read_cardinality(data, pos)
+    else:
+        size = data[pos]
+        pos += 1
+    end = pos + size
+    if end > len(data):
+        raise IndexError("column data out of range")
+    if not decode:
+        return None, end
+    value = data[pos:end]
+    if column_type == 11:
+        value = value.decode("cp932")
+    elif column_type == 12:
+        value = value.decode("SCSU")
+    return value, end
+
+class RecordDecoder:
+    """
+    Hand-written decoder for the records of a table, giving the same values as the Construct schema
+    of build_table_schema. It only handles well-formed records: it raises on anything unexpected,
+    and the caller is expected to fall back to the generic decoder, which knows how to recover.
+
+    Columns that are not wanted are skipped without being decoded, and decoding stops after the last wanted column.
+    """
+
+    def __init__(self, columns, wanted_columns=None):
+        """
+        Initialize the decoder.
+
+        :param columns: Column schemas of the table.
+        :param wanted_columns: Names of the columns to decode, all columns if None.
+        """
+        self.columns = []
+        for column in columns:
+            if not 0 <= column.type <= 16:
+                raise ValueError(f"column type {column.type} not supported")
+            wanted = wanted_columns is None or column.name in wanted_columns
+            self.columns.append((column.name, column.type, (column.attributes & ATTRIB_NOT_NULL) == 0, FIXED_COLUMN_STRUCTS.get(column.type), wanted))
+
+        # Nothing after the last wanted column has to be read
+        while self.columns and not self.columns[-1][4]:
+            self.columns.pop()
+
+    def decode(self, data) -> dict:
+        """
+        Decode a record.
+
+        :param data: Record bytes, starting with the row size.
+
+        :return: A dictionary of column values
+        """
+        _, pos = read_cardinality(data, 0)
+        # Bits are read 8 at a time from a byte, like ReadBitSequence
+        bits = 0
+        record = {}
+        for name, column_type, nullable, fixed_struct, wanted in self.columns:
+            if nullable:
+                bits >>= 1
+                if (bits & 0x1000000) == 0:
+                    bits = data[pos] | 0xFF000000
+                    pos += 1
+                if (bits & 1) == 0:
+                    if wanted:
+                        record[name] = None
+                    continue
+
+            if fixed_struct is not None:
+                if wanted:
+                    value = fixed_struct.unpack_from(data, pos)[0]
+                elif pos + fixed_struct.size > len(data):
+                    raise IndexError("column data out of range")
+                pos += fixed_struct.size
+            elif column_type == 0:
+                bits >>= 1
+                if (bits & 0x1000000) == 0:
+                    bits = data[pos] | 0xFF000000
+                    pos += 1
+                value = bits & 1
+            elif column_type <= 13:
+                value, pos = read_column_data(data, pos, column_type, wanted)
+            else:
+                bits >>= 1
+                if (bits & 0x1000000) == 0:
+                    bits = data[pos] | 0xFF000000
+                    pos += 1
+                is_inline = bits & 1
+                column_data = None
+                if is_inline:
+                    column_data, pos = read_column_data(data, pos, LONG_COLUMN_DATA_TYPES[column_type], wanted)
+                value = LongColumn(is_inline, None, column_data)
+            if wanted:
+                record[name] = value
+        return record
+
+def read_cluster(store: StoreReader, offset, fast=True):
+    """
+    Read a cluster, with the fast path if possible.
+
+    :return: A tuple of the next cluster ID field and a list of the 16 record bytes, None for unused slots
+    """
+    if fast:
+        try:
+            return read_cluster_fast(store, offset)
+        except Exception:
+            # Truncated or unusual cluster, let Construct handle it
+            pass
+    cluster = cluster_struct.parse_stream(store.stream(offset))
+    return cluster.iNext, cluster.data
+
+def read_cluster_fast(store: StoreReader, offset):
+    """
+    Read a cluster without Construct. Raises on anything unexpected, e.g. a truncated cluster.
+
+    :return: A tuple of the next cluster ID field and a list of the 16 record bytes, None for unused slots
+    """
+    header = bytes(store.read(offset, 6 + 16 * 4))
+    next_id, membership = struct.unpack_from("<IH", header, 0)
+    pos = 6
+    sizes = []
+    for i in range(16):
+        if membership & (1 << i):
+            size, pos = read_cardinality(header, pos)
+            sizes.append(size)
+        else:
+            sizes.append(None)
+
+    records = []
+    offset += pos
+    for size in sizes:
+        if size is None:
+            records.append(None)
+            continue
+        record_data = bytes(store.read(offset, size))
+        if len(record_data) != size:
+            raise IndexError("record out of range")
+        records.append(record_data)
+        offset += size
+    return next_id, records
+
+def extract_jam_objects(fjjam_path: os.PathLike, verbose=False, fast=True, columns=FJJAM_WANTED_COLS, toc_cache=True):
     # Author: usernameak | /bin/cat
-    with open(fjjam_path, "rb") as f:
-        checked_uid = checked_uid_struct.parse(f.read(16))
-        store_header = store_header_struct.parse(f.read(16))
+    return list(iter_jam_objects(fjjam_path, verbose, fast, columns, toc_cache))
 
-        if store_header.iBackup & 1:
-            raise ValueError("ERROR: Store is dirty! Quitting processing.")
+def iter_jam_objects(fjjam_path: os.PathLike, verbose=False, fast=True, columns=FJJAM_WANTED_COLS, toc_cache=True):
+    """
+    Iterate over the jam objects of a FJJAM.DB file, yielding them as soon as their cluster is decoded.
 
-        data = bytearray()
-        while True:
-            buf = f.read(0x4000)
-            if len(buf) == 0:
-                break
+    :param fjjam_path: Path to the FJJAM.DB file.
+    :param fast: Use the fast path decoder, falling back to the generic one when needed.
+    :param columns: Names of the columns to get for each jam object.
+    :param toc_cache: Keep the flattened TOC in a sidecar cache file next to the database.
+    """
+    with StoreReader(fjjam_path) as store:
+        yield from _iter_jam_objects(store, verbose, fast, columns, toc_cache)
 
-            data.extend(buf)
+def _iter_jam_objects(store: StoreReader, verbose, fast, columns, toc_cache):
+    checked_uid = checked_uid_struct.parse(store.header[:16])
+    store_header = store_header_struct.parse(store.header[16:])
 
-            f.read(2) # Skip frame descriptors, even though they're needed to get record sizes
+    if store_header.iBackup & 1:
+        raise ValueError("ERROR: Store is dirty! Quitting processing.")
 
     # Get database table of content
-    toc = StoreToc()
-    toc.parse(data, store_header.iRef)
+    toc = read_store_toc(store, store_header.iRef, toc_cache, verbose)
         
     db_schema_offset = toc.get_offset(toc.primary)
-    db_schema = db_schema_struct.parse(data[db_schema_offset:])
+    db_schema = db_schema_struct.parse_stream(store.stream(db_schema_offset))
 
-    # Convert the schema to Construct schema
+    # Convert the schema to record decoders
     for table in db_schema.tables:
-        columns_schemas = [
-            "_rowSize" / TCardinality
-        ]
-        for column in table.columns:
-            column_schema = None
-            if column.type == 0:
-                column_schema = ReadBitSequence()
-            elif column.type == 1:
-                column_schema = Int8sl
-            elif column.type == 2:
-                column_schema = Int8ul
-            elif column.type == 3:
-                column_schema = Int16sl
-            elif column.type == 4:
-                column_schema = Int16ul
-            elif column.type == 5:
-                column_schema = Int32sl
-            elif column.type == 6:
-                column_schema = Int32ul
-            elif column.type == 7:
-                column_schema = Int64sl
-            elif column.type == 8:
-                column_schema = Float32l
-            elif column.type == 9:
-                column_schema = Float64l
-            elif column.type == 10:
-                column_schema = Int64sl # datetime
-            elif column.type == 11:
-                column_schema = PascalString(Int8ul, "cp932")
-            elif column.type == 12:
-                # Symbian uses SCSU for unicode strings
-                column_schema = PascalString(TCardinality, "SCSU")
-            elif column.type == 13:
-                column_schema = Prefixed(Int8ul, GreedyBytes())
-            elif column.type == 14 or column.type == 15 or column.type == 16:
-                data_schema = None
-                match column.type:
-                    case 14:
-                        data_schema = PascalString(Int8ul, "cp932")
-                    case 15:
-                        data_schema = PascalString(TCardinality, "SCSU")
-                    case 16:
-                        data_schema = Prefixed(Int8ul, GreedyBytes())
-                column_schema = Struct(
-                    "isInline" / ReadBitSequence(),
-                    "outOfLineData" / If(not this.isInline, Struct(
-                        "packedBlobId" / TCardinality,
-                        "size" / TCardinality
-                    )),
-                    "data" / If(this.isInline, data_schema)
-                )            
-            else:
-                raise ValueError(f"column type {column.type} not supported")
-            
-            if (column.attributes & 1) == 0:
-                column_schema = FocusedSeq(
-                    "data",
-                    "exists" / ReadBitSequence(),
-                    "data" / If(this.exists, column_schema)
-                )
-            
-            # We use Optional because if there are no following entries, eof can be premature
-            columns_schemas.append(column.name / Optional(column_schema))
-
-    table_construct_schema = Struct(*columns_schemas)
+        table_construct_schema = build_table_schema(table)
+        generic_schema = compile_table_schema(table_construct_schema)
+        # The app name is always needed to filter out empty entries
+        record_decoder = RecordDecoder(table.columns, set(columns) | {"appName"}) if fast else None
     table_token_offset = toc.get_offset(table.iTokenId)
-    table_token = table_token_struct.parse(data[table_token_offset:])
+    table_token = table_token_struct.parse_stream(store.stream(table_token_offset))
     cur_cluster_id = table_token.iHead
     
-    jam_objects = []
+    jam_objects_count = 0
     
     while cur_cluster_id != 0:
         cluster_offset = toc.get_offset(cur_cluster_id)
-        cluster = cluster_struct.parse(data[cluster_offset:])
+        cluster_next, cluster_records = read_cluster(store, cluster_offset, fast)
         try:
-            for record_data in cluster.data:
+            for record_data in cluster_records:
                 if record_data is None: continue
-                column_data = table_construct_schema.parse(record_data)
+                column_data = None
+                if record_decoder is not None:
+                    try:
+                        column_data = record_decoder.decode(record_data)
+                    except Exception:
+                        # Incomplete or unusual record, let the generic decoder handle it
+                        pass
+                if column_data is None:
+                    column_data = generic_schema.parse(record_data)
                 if column_data["appName"] == None: continue
                 jam_obj = dict()
-                for column in FJJAM_WANTED_COLS:
+                for column in columns:
                     jam_obj[column] = column_data.get(column, None)
-                jam_objects.append(jam_obj)
+                jam_objects_count += 1
+                yield jam_obj
         except StreamError:
             # ignore incomplete entries
             pass
 
-        cur_cluster_id = cluster.iNext & 0xFFFFFF
+        cur_cluster_id = cluster_next & 0xFFFFFF
     
     if verbose:
-        print(f"Parsed {len(jam_objects)} valid entries from the database.")
-    
-    return jam_objects
+        print(f"Parsed {jam_objects_count} valid entries from the database.")
 
+@lru_cache(maxsize=4096)
 def convert_db_datetime(microseconds: int) -> datetime:
     # From Symbian DB:
     # It represents a date and time as a number of microseconds since midnight, January 1st, 1 AD nominal Gregorian.
     seconds = microseconds / 1_000_000
     reference_date = datetime(1, 1, 1)
     resulting_date = reference_date + timedelta(seconds=seconds)
-    return resulting_date
\ No newline at end of file
+    return resulting_date
+
+@lru_cache(maxsize=4096)
+def format_db_datetime(microseconds: int) -> str:
+    # Apps of a database often share their modification times
+    return convert_db_datetime(microseconds).strftime(LAST_MODIFIED_FORMAT)
\ No newline at end of file
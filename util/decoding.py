@@ -0,0 +1,75 @@
+"""
+This module contains the decoding of the text files of apps, shared by the phone types and the later stages.
+"""
+
+import os
+from util.constants import ENCODINGS
+
+# Encodings found for the files decoded in this run, by path, size and modification time
+_file_encodings = {}
+
+def decode_text(content, encodings=ENCODINGS, verbose=False) -> tuple:
+    """
+    Decode text bytes with the first encoding they are valid in.
+
+    ASCII bytes are decoded once, as they are the same text in every encoding. Other bytes are decoded with
+    each encoding in turn, a decoder stopping at the first byte it does not accept.
+
+    :param content: Bytes of the text.
+    :param encodings: Encodings to try, in order.
+
+    :return: A tuple of the text and its encoding, or (None, None) if no encoding is valid
+    """
+    content = bytes(content)
+    if content.isascii():
+        return content.decode('ascii'), encodings[0]
+    for encoding in encodings:
+        try:
+            return content.decode(encoding), encoding
+        except UnicodeDecodeError:
+            if verbose:
+                print(f"Warning: UnicodeDecodeError with {encoding}. Trying next encoding.")
+    return None, None
+
+def _file_key(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+def decode_file(path, encodings=ENCODINGS, verbose=False) -> tuple:
+    """
+    Read a text file once and decode it with the first encoding it is valid in.
+    The encoding found is kept for the run, so the file is decoded only once when it is read again.
+
+    :param path: Path to the text file.
+    :param encodings: Encodings to try, in order.
+
+    :return: A tuple of the text and its encoding, or (None, None) if no encoding is valid
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    key = (_file_key(path), tuple(encodings))
+    if key in _file_encodings:
+        encoding = _file_encodings[key]
+        if encoding is None:
+            return None, None
+        try:
+            return content.decode(encoding), encoding
+        except UnicodeDecodeError:
+            # Changed without its size and modification time changing
+            pass
+
+    text, encoding = decode_text(content, encodings, verbose=verbose)
+    _file_encodings[key] = encoding
+    return text, encoding
+
+def remember_file_encoding(path, encoding, encodings=ENCODINGS):
+    """
+    Record the encoding a text file was just written with, for the later stages reading it.
+    Only the first encoding is recorded, as a text written in another one may also be valid in an earlier one.
+
+    :param path: Path to the written file.
+    :param encoding: Encoding the text was written with.
+    :param encodings: Encodings the file will be decoded with, in order.
+    """
+    if encoding == encodings[0]:
+        _file_encodings[(_file_key(path), tuple(encodings))] = encoding
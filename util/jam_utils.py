@@ -2,13 +2,25 @@
 This module contains utility functions for parsing JAM/ADF files.
 """
 
+import re
 import struct
 import os
+import mmap
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping
 from datetime import datetime
 from urllib.parse import urlparse, parse_qs
-from util.constants import EARLY_NULL_TYPE_OFFSETS, MINIMAL_VALID_KEYWORDS, SDF_PROP_NAMES, ENCODINGS
-from util.db import extract_jam_objects, convert_db_datetime
+from util.constants import EARLY_NULL_TYPE_OFFSETS, MINIMAL_VALID_KEYWORDS, SDF_PROP_NAMES, ENCODINGS, FJJAM_JAM_COLS, LAST_MODIFIED_FORMAT
+from util.db import iter_jam_objects, format_db_datetime
 from util.structure_utils import inject_jam_into_folder
+from util.sp_header import encode_sp_header, decode_sp_header, swap_sp_header
+
+# Usual form of LastModified dates, with the fields strptime takes for them
+DAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+MONTH_NAMES = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+MONTH_NUMBERS = {month: number for number, month in enumerate(MONTH_NAMES, 1)}
+LAST_MODIFIED_PATTERN = re.compile(rf"(?:{'|'.join(DAY_NAMES)}), ([0-9]{{2}}) ({'|'.join(MONTH_NAMES)}) ([0-9]{{4}}) ([0-9]{{2}}):([0-9]{{2}}):([0-9]{{2}})")
 
 def parse_props_00(adf_content, sp_start_offset, adf_start_offset, verbose=False) -> dict:
     """
@@ -61,24 +73,7 @@ def parse_props_00(adf_content, sp_start_offset, adf_start_offset, verbose=False
     else:
         adf_items.insert(5, None)
 
-    adf_dict["LastModified"] = adf_items[6]
-    
-    try:
-        # Try parsing the full string
-        dt_obj = datetime.strptime(adf_dict["LastModified"], "%a, %d %b %Y %H:%M:%S")
-    except ValueError as e:
-        if "unconverted data remains:" in str(e):
-            # Trim off the unconverted portion
-            valid_len = len(adf_dict["LastModified"]) - len(str(e).split("unconverted data remains:")[1].strip())
-            trimmed_str = adf_dict["LastModified"][:valid_len].strip()
-            dt_obj = datetime.strptime(trimmed_str, "%a, %d %b %Y %H:%M:%S")
-        else:
-            raise  # Re-raise any other parsing errors
-
-    # Format the datetime object
-    formatted_date = dt_obj.strftime("%a, %d %b %Y %H:%M:%S")
-    
-    adf_dict["LastModified"] = formatted_date
+    adf_dict["LastModified"] = normalize_last_modified(adf_items[6])
 
     other_items = []
     if len(adf_items) > 6:
@@ -117,6 +112,61 @@ def parse_props_00(adf_content, sp_start_offset, adf_start_offset, verbose=False
         
     return adf_dict
 
+@lru_cache(maxsize=4096)
+def normalize_last_modified(last_modified) -> str:
+    """
+    Parse a LastModified date and format it again, without anything after the seconds.
+    The usual form of the dates is parsed with a fixed pattern, any other one with strptime.
+    
+    :param last_modified: LastModified date
+    
+    :return: The formatted date
+    :raises ValueError: If the date cannot be parsed
+    """
+    try:
+        dt_obj = parse_last_modified_fast(last_modified)
+        if dt_obj.year >= 1000:
+            # Same as strftime, which does not pad smaller years the same way everywhere
+            return f"{DAY_NAMES[dt_obj.weekday()]}, {dt_obj.day:02} {MONTH_NAMES[dt_obj.month - 1]} {dt_obj.year} {dt_obj.hour:02}:{dt_obj.minute:02}:{dt_obj.second:02}"
+        return dt_obj.strftime(LAST_MODIFIED_FORMAT)
+    except ValueError:
+        pass
+    
+    try:
+        # Try parsing the full string
+        dt_obj = datetime.strptime(last_modified, LAST_MODIFIED_FORMAT)
+    except ValueError as e:
+        if "unconverted data remains:" in str(e):
+            # Trim off the unconverted portion
+            valid_len = len(last_modified) - len(str(e).split("unconverted data remains:")[1].strip())
+            trimmed_str = last_modified[:valid_len].strip()
+            dt_obj = datetime.strptime(trimmed_str, LAST_MODIFIED_FORMAT)
+        else:
+            raise  # Re-raise any other parsing errors
+    
+    # Format the datetime object
+    return dt_obj.strftime(LAST_MODIFIED_FORMAT)
+
+def parse_last_modified_fast(last_modified) -> datetime:
+    """
+    Parse a LastModified date of the usual form, e.g. "Mon, 01 Jan 2007 12:00:00", like strptime does.
+    Text after the seconds is ignored, like it is trimmed when strptime finds it.
+    
+    :param last_modified: LastModified date
+    
+    :return: The parsed date
+    :raises ValueError: If the date is not of the usual form, or not valid
+    """
+    match = LAST_MODIFIED_PATTERN.match(last_modified)
+    if match is None:
+        raise ValueError("LastModified is not of the usual form.")
+    rest = last_modified[match.end():]
+    # strptime is left with anything the trim would not cut right after the seconds
+    if rest and (last_modified[:len(last_modified) - len(rest.strip())].strip() != match.group() or "unconverted data remains:" in rest):
+        raise ValueError("LastModified has text after the seconds that is not trimmed.")
+    day, month, year, hour, minute, second = match.groups()
+    return datetime(int(year), MONTH_NUMBERS[month], int(day), int(hour), int(minute), int(second))
+
 def read_spsize_00(adf_content, start_offset, verbose=False) -> list:
     """
     Read SP sizes from null delimited ADF file.
@@ -126,17 +176,8 @@ def read_spsize_00(adf_content, start_offset, verbose=False) -> list:
     
     :return: A list of SP sizes
     """
-    integers = []
-    offset = start_offset
-    
-    # Extract 64 bytes from the starting offset
-    extracted_bytes = adf_content[offset:offset + 64]
-    
-    # Iterate over the extracted bytes in chunks of 4 bytes
-    for i in range(0, len(extracted_bytes), 4):
-        integer = struct.unpack('<I', extracted_bytes[i:i + 4])[0]
-        if integer != 0xFFFFFFFF:
-            integers.append(integer)
+    # Read the 64 bytes from the starting offset in place, without the 0xFFFFFFFF padding
+    integers = decode_sp_header(adf_content, start_offset)
     
     # Check if any SP size is 0
     if 0 in integers:
@@ -164,25 +205,241 @@ def read_spsize_00_early(adf_content, start_offset, verbose=False):
     
     return integers
 
-def parse_props_plaintext(adf_content, verbose=False) -> dict:
+def is_plausible_null_layout(adf_content, sp_start_offset, adf_start_offset) -> bool:
     """
-    Parse plaintext ADF file and return a dictionary of its contents.
+    Check with byte comparisons only if a null delimited ADF file may be parsed with the given offsets.
+    A layout failing the check would make parse_props_00 raise, so it does not need to be parsed.
+
+    :param adf_content: Null delimited ADF file content
+    :param sp_start_offset: Start offset of SP sizes
+    :param adf_start_offset: Start offset of JAM section
+
+    :return: False if parse_props_00 cannot succeed with the offsets
+    """
+    # SP sizes are read as whole 32-bit integers, none of them 0
+    if (sp_start_offset, adf_start_offset) in EARLY_NULL_TYPE_OFFSETS:
+        if len(adf_content[sp_start_offset:sp_start_offset + 4]) != 4:
+            return False
+    else:
+        sp_sizes = adf_content[sp_start_offset:sp_start_offset + 64]
+        if len(sp_sizes) % 4 or 0 in (size for size, in struct.iter_unpack('<I', sp_sizes)):
+            return False
+
+    # Items that fail to decode make parse_props_00 drop items, so such files are left to it
+    tail = adf_content[adf_start_offset:]
+    if not tail.isascii():
+        try:
+            for item in tail.split(b"\x00"):
+                item.decode(ENCODINGS[0])
+        except UnicodeDecodeError:
+            return True
+
+    # Follow the optional items to LastModified, like parse_props_00 does
+    items = []
+    position = adf_start_offset
+    while len(items) < 7:
+        while position < len(adf_content) and adf_content[position] == 0:
+            position += 1
+        if position >= len(adf_content):
+            break
+        end = adf_content.find(b"\x00", position)
+        end = len(adf_content) if end == -1 else end
+        items.append(adf_content[position:end])
+        position = end
+
+    try:
+        if items[1].startswith(b"http"):
+            items.insert(1, None)
+        if not items[3].startswith(b"CLDC"):
+            items.insert(3, None)
+        if items[5].startswith((b"Mon", b"Tue", b"Wed", b"Thu", b"Fri", b"Sat", b"Sun")):
+            items.insert(5, None)
+        last_modified = items[6]
+    except IndexError:
+        return False
+
+    # LastModified must start with an abbreviated day name and a comma to be parsed as a date
+    return last_modified[:3].lower() in (b"mon", b"tue", b"wed", b"thu", b"fri", b"sat", b"sun") and last_modified[3:4] == b","
+
+def validate_null_props(jam_props, allow_empty_values=True):
+    """
+    Check the properties parsed from a null delimited ADF file, raising a ValueError if they are not valid.
+
+    :param jam_props: Properties parsed by parse_props_00
+    :param allow_empty_values: Accept properties with empty values
+    """
+    if not allow_empty_values and not all(jam_props.values()):
+        raise ValueError("Empty value found in JAM properties.")
+    if " " in jam_props['PackageURL']:
+        raise ValueError("Space found in PackageURL.")
+
+def find_plaintext_cutoff(adf_content, offsets):
+    """
+    Find the first offset from which an ADF file is plaintext until its end, searching for its last null byte only once.
+
+    :param adf_content: ADF file content
+    :param offsets: Candidate offsets, in the order they are tried.
+
+    :return: A tuple of the offset, or None if no offset is good, and the number of offsets tried
+    """
+    last_null = adf_content.rfind(b"\x00")
+    for probes, offset in enumerate(offsets, 1):
+        if last_null < offset < len(adf_content):
+            return offset, probes
+    return None, len(offsets)
+
+class LayoutCache:
+    """
+    A class to count how often the candidate layouts matched the files of a dump, to try the most frequent ones first.
+    Nearly every file of a dump has the same layout.
+
+    The counts only make the search faster, a file gets the first matching layout in the order of the candidates
+    whatever the files seen before. They are not shared between worker processes.
+    """
+
+    def __init__(self, candidates):
+        """
+        Initialize the layout cache.
+
+        :param candidates: Candidate layouts, the order being kept between layouts matching as often.
+        """
+        self.candidates = list(candidates)
+        self.hits = dict.fromkeys(self.candidates, 0)
+        self.files = 0
+        self.probes = 0
+
+    def ordered(self, candidates=None) -> list:
+        """
+        Get the candidate layouts, the most frequent first.
+
+        :param candidates: Candidate layouts to order, all of them by default.
+        """
+        return sorted(self.candidates if candidates is None else candidates, key=lambda candidate: -self.hits[candidate])
+
+    def resolve(self, matches, candidates=None) -> tuple:
+        """
+        Find the first candidate layout matching a file, in the order of the candidates.
+        The most frequent layouts are tried first, then only the ones coming before the layout found,
+        which match less often but take precedence over it. The layout found is recorded.
+
+        :param matches: Function taking a candidate layout and returning True if it matches the file.
+        :param candidates: Candidate layouts to try, in the order of the candidates, all of them by default.
+
+        :return: A tuple of the matching layout, or None if none matched, and the number of layouts tried
+        """
+        candidates = self.candidates if candidates is None else list(candidates)
+        tried = set()
+        found = None
+        for candidate in self.ordered(candidates):
+            tried.add(candidate)
+            if matches(candidate):
+                found = candidate
+                break
+
+        if found is not None:
+            for candidate in candidates[:candidates.index(found)]:
+                if candidate not in tried:
+                    tried.add(candidate)
+                    if matches(candidate):
+                        found = candidate
+                        break
+
+        self.record(found, len(tried))
+        return found, len(tried)
+
+    def record(self, candidate, probes):
+        """
+        Record the layout of a file.
+
+        :param candidate: Layout matching the file, None if none matched.
+        :param probes: Number of layouts tried.
+        """
+        self.files += 1
+        self.probes += probes
+        if candidate is not None:
+            self.hits[candidate] += 1
+
+    def __str__(self):
+        def fmt(candidate):
+            return f"0x{candidate:X}" if isinstance(candidate, int) else "(" + ", ".join(f"0x{value:X}" for value in candidate) + ")"
+        hits = ", ".join(f"{fmt(candidate)}: {count}" for candidate, count in self.hits.items() if count)
+        return f"{sum(self.hits.values())} of {self.files} files matched, {self.probes / max(1, self.files):.2f} layouts tried per file ({hits or 'no hits'})"
+
+class NullADFLayout:
+    """
+    A class to resolve the offsets of the SP sizes and the JAM section in the null delimited ADF files of a dump.
+
+    The ADF files of a dump share the same layout, so the most frequent ones are tried first.
+    A file valid with several layouts gets the first one of the offsets.
+    """
+
+    def __init__(self, offsets):
+        """
+        Initialize the layout resolver.
+
+        :param offsets: Candidate (SP sizes offset, JAM section offset) pairs, in the order they are tried.
+        """
+        self.layouts = LayoutCache(offsets)
+
+    def candidates(self, adf_content) -> list:
+        """
+        Get the plausible offsets for an ADF file, in the order of the offsets.
+
+        :param adf_content: Null delimited ADF file content
+        """
+        return [offset for offset in self.layouts.candidates if is_plausible_null_layout(adf_content, *offset)]
+
+    def parse(self, adf_content, validate=None, verbose=False) -> tuple:
+        """
+        Parse a null delimited ADF file with the first plausible layout giving valid properties, in the order of the offsets.
+
+        :param adf_content: Null delimited ADF file content
+        :param validate: Function raising a ValueError for invalid properties, if any.
+
+        :return: A tuple of the properties and the offsets they were parsed with.
+                 If no layout gives valid properties, the offsets are None and the properties are the last ones parsed, if any.
+        """
+        # Properties parsed with each offset, valid or not
+        parsed = {}
+
+        def is_valid(offset):
+            try:
+                jam_props = parse_props_00(adf_content, offset[0], offset[1], verbose=verbose)
+                parsed[offset] = jam_props
+                if jam_props is None:
+                    raise ValueError("Could not decode the JAM section.")
+                if validate is not None:
+                    validate(jam_props)
+                return True
+            except Exception as e:
+                if verbose:
+                    print(f"Warning: Not good with offset {offset}. Trying next offset.")
+                    print(f"    - {e.args[0]}")
+                return False
+
+        offset, _ = self.layouts.resolve(is_valid, self.candidates(adf_content))
+        if offset is None:
+            # Every plausible offset was tried, the last one parsed is the last one in their order
+            parsed_offsets = [candidate for candidate in self.layouts.candidates if candidate in parsed]
+            return (parsed[parsed_offsets[-1]] if parsed_offsets else None), None
+        if verbose:
+            print(f"Layouts: {self.layouts}")
+        return parsed[offset], offset
+
+def parse_props_plaintext(adf_content, verbose=False, encoding=ENCODINGS[0]) -> Mapping:
+    """
+    Parse plaintext ADF file and return a read-only mapping of its contents.
+    The same content is only parsed once per run.
     
-    :param adf_content: Plaintext ADF file content
+    :param adf_content: Plaintext ADF file content, as text or as bytes
+    :param encoding: Encoding to decode the content with if it is bytes
     
-    :return: A dictionary of plaintext ADF contents
+    :return: A read-only mapping of plaintext ADF contents, in file order
+    :raises UnicodeDecodeError: If the bytes do not decode with the encoding
     """
-    keys = {}
-
-    for line in adf_content.splitlines():
-        if '=' in line:
-            name, value = line.split('=', 1)
-            if name.lower().find("spsize") != -1:
-                name = "SPsize"
-            name = name.strip()
-            if name.rfind("\x00") != -1:
-                name = name[name.rfind("\x00")+1:]
-            keys[name] = value.strip()
+    if not isinstance(adf_content, str):
+        adf_content = bytes(adf_content).decode(encoding)
+    keys = _parse_props_plaintext(adf_content)
 
     if verbose:
         print("JAM properties found.")
@@ -191,6 +448,22 @@ def parse_props_plaintext(adf_content, verbose=False) -> dict:
         print()
     return keys
 
+@lru_cache(maxsize=8192)
+def _parse_props_plaintext(adf_content) -> Mapping:
+    keys = {}
+    for line in adf_content.splitlines():
+        name, separator, value = line.partition('=')
+        if not separator:
+            continue
+        if "spsize" in name.lower():
+            name = "SPsize"
+        else:
+            name = name.strip()
+            if "\x00" in name:
+                name = name[name.rfind("\x00")+1:]
+        keys[name] = value.strip()
+    return MappingProxyType(keys)
+
 def parse_valid_name(package_url, verbose=False) -> str:
     """
     Parse valid app name from PackageURL.
@@ -244,12 +517,7 @@ def fmt_spsize_header(sp_size_list) -> bytes:
     
     :return: Header format of SP sizes
     """
-    sp_size_header = b""
-    for sp_size in sp_size_list:
-        sp_size_header += struct.pack('<I', sp_size)
-    while len(sp_size_header) < 64:
-        sp_size_header += b"\xFF\xFF\xFF\xFF"
-    return sp_size_header
+    return encode_sp_header(sp_size_list)
 
 def find_plausible_keywords_for_validity(adf_file) -> bool:
     """
@@ -257,6 +525,9 @@ def find_plausible_keywords_for_validity(adf_file) -> bool:
     
     :return: True if the ADF file has some keywords which may make it valid, False otherwise
     """
+    if isinstance(adf_file, (bytes, bytearray, mmap.mmap)):
+        # Searched in place, the keywords cannot come from the escapes of the string form of the bytes
+        return all(adf_file.find(keyword.encode()) != -1 for keyword in MINIMAL_VALID_KEYWORDS)
     return all(keyword in str(adf_file) for keyword in MINIMAL_VALID_KEYWORDS)
 
 def is_valid_sh_header(header, offset):
@@ -277,13 +548,14 @@ def is_valid_sh_header(header, offset):
 
 def filter_sdf_fields(jam_props: dict) -> tuple[dict, dict]:
     """
-    Removes specific SDF fields from the jam_props dictionary and returns a tuple:
+    Removes specific SDF fields from a copy of the jam_props mapping and returns a tuple:
     (modified jam_props, sdf_props containing the removed fields).
 
     :param jam_props: The original dictionary containing various keys.
     :return: A tuple containing the modified jam_props (with SDF fields removed)
              and the sdf_props (which only has the removed fields).
     """
+    jam_props = dict(jam_props)
     sdf_props = {}
     
     # Safely remove 'PackageURL' if it exists.
@@ -323,7 +595,7 @@ def assemble_jam(jam_obj) -> dict:
     jam_dict["AppClass"] = app_class.data if app_class is not None else None
 
     last_modified = jam_obj.get("lastModifiedTime", None)
-    jam_dict["LastModified"] = convert_db_datetime(last_modified).strftime("%a, %d %b %Y %H:%M:%S") if last_modified else None
+    jam_dict["LastModified"] = format_db_datetime(last_modified) if last_modified else None
 
     jam_dict["UseNetwork"] = 'http'
     jam_dict["UseBrowser"] = 'launch'
@@ -343,24 +615,40 @@ def assemble_jam(jam_obj) -> dict:
     return jam_dict
 
 def parse_jam_objects(java_folder_path: str, verbose=False):
-    jam_objects = extract_jam_objects(os.path.join(java_folder_path, "FJJAM.DB"), verbose)
-    for obj in jam_objects:
+    # JAMs are injected as soon as their record is decoded
+    for obj in iter_jam_objects(os.path.join(java_folder_path, "FJJAM.DB"), verbose, columns=FJJAM_JAM_COLS):
         jam_dict = assemble_jam(obj)
         id = obj["app_No"]
         inject_jam_into_folder(java_folder_path, id, fmt_plaintext_jam(jam_dict), verbose)
     if verbose:
         print("JAM reconstruction from database complete without errors.", end="\n\n")
 
-def remove_garbage_so(content, interval=0x4000, header=0x20, footer=0x13, oob=0x2):
-    content_ = content[header: len(content) - footer]
-    content_len = len(content_)
+def so_payload_ranges(size, interval=0x4000, header=0x20, footer=0x13, oob=0x2) -> list:
+    """
+    Get the ranges of the payload of a SO file, which is stored in blocks each followed by out-of-band bytes,
+    between a header and a footer.
+
+    :param size: Size of the SO file.
+    :param interval: Size of a block.
+    :param header: Size of the header.
+    :param footer: Size of the footer.
+    :param oob: Number of out-of-band bytes after every block.
+
+    :return: A list of (offset, length) ranges in the file
+    """
+    end = max(header, size - footer)
+    return [(start, min(interval, end - start)) for start in range(header, end, interval + oob)]
 
-    new_content = bytearray()
-    for i in range(0, content_len, interval + oob):
-        end = min(i + interval, content_len)
-        new_content += content_[i : end]
+def remove_garbage_so(content, interval=0x4000, header=0x20, footer=0x13, oob=0x2) -> bytes:
+    """
+    Get the payload of a SO file in memory, gathering its blocks in a single pass.
 
-    return new_content
+    :param content: Contents of the SO file, as any bytes-like object.
+
+    :return: The payload, without header, footer and out-of-band bytes
+    """
+    with memoryview(content) as view:
+        return b"".join(view[offset:offset + length] for offset, length in so_payload_ranges(len(view), interval, header, footer, oob))
 
 def swap_spsize_header_endian(header_bytes: bytes) -> bytes:
     """
@@ -369,16 +657,5 @@ def swap_spsize_header_endian(header_bytes: bytes) -> bytes:
     :param header_bytes: 64-byte header
     :return: Header with each 4-byte word swapped unless 0xFFFFFFFF is encountered
     """
-    swapped_header = b""
-    
-    for i in range(0, len(header_bytes), 4):
-        chunk = header_bytes[i:i+4]
-        
-        if chunk == b"\xFF\xFF\xFF\xFF":
-            swapped_header += chunk
-        else:
-            # Unpack as little-endian, repack as big-endian (or vice versa)
-            value = struct.unpack("<I", chunk)[0]
-            swapped_header += struct.pack(">I", value)
-    
-    return swapped_header
+    # 0xFFFFFFFF is the same swapped, so every word is swapped at once
+    return swap_sp_header(header_bytes)
@@ -0,0 +1,177 @@
+import os
+import json
+import hashlib
+
+MANIFEST_FILE_NAME = ".kttools_manifest.json"
+MANIFEST_VERSION = 1
+
+def new_digest():
+    return hashlib.blake2b(digest_size=16)
+
+def file_digest(path, chunk_size=1 << 20) -> str:
+    """
+    Get the content hash of a file.
+
+    :param path: Path to the file.
+
+    :return: Hex digest of the file content
+    """
+    digest = new_digest()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def expand_sources(source_paths) -> list:
+    """
+    Expand source paths of an app, directories being replaced by the files they contain.
+
+    :param source_paths: Paths of the files and directories an app is extracted from.
+
+    :return: A sorted list of file paths, including the ones that do not exist
+    """
+    paths = set()
+    for path in source_paths:
+        if os.path.isdir(path):
+            with os.scandir(path) as entries:
+                paths.update(entry.path for entry in entries if entry.is_file())
+        else:
+            paths.add(os.fspath(path))
+    return sorted(paths)
+
+def stat_sources(source_paths, top_folder_directory, previous=None) -> dict:
+    """
+    Get the state of the source files of an app, as [size, mtime, hash] by path relative to the top folder.
+    Missing files have a None state. Hashes from the previous state are reused for files with the same size and mtime.
+
+    :param source_paths: Paths of the files and directories an app is extracted from.
+    :param top_folder_directory: Top folder directory the paths are relative to.
+    :param previous: Previous state of the source files, if any.
+    """
+    previous = previous or {}
+    states = {}
+    for path in expand_sources(source_paths):
+        key = os.path.relpath(path, top_folder_directory)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            states[key] = None
+            continue
+        state = previous.get(key)
+        if state is not None and state[0] == stat.st_size and state[1] == stat.st_mtime_ns:
+            states[key] = state
+        else:
+            states[key] = [stat.st_size, stat.st_mtime_ns, file_digest(path)]
+    return states
+
+class ExtractionManifest:
+    """
+    A class to represent the manifest of an output folder, recording for every app the state of its source files
+    and the files produced from them, so a re-run can skip the apps that did not change.
+    """
+
+    def __init__(self, target_directory, phone_type_name):
+        """
+        Initialize the manifest, loading the existing one if it was made for the same phone type.
+
+        :param target_directory: Output folder of the extraction.
+        :param phone_type_name: Name of the phone type extracted into the folder.
+        """
+        self.target_directory = target_directory
+        self.path = os.path.join(target_directory, MANIFEST_FILE_NAME)
+        self.phone_type_name = phone_type_name
+        self.apps = {}
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION and manifest.get("phone_type") == phone_type_name:
+                self.apps = manifest["apps"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def get(self, key):
+        """
+        Get the recorded entry of an app.
+
+        :param key: Key of the app.
+
+        :return: A dictionary with the "sources", "app_name" and "outputs" of the app, or None
+        """
+        return self.apps.get(key)
+
+    def is_unchanged(self, key, source_paths, top_folder_directory) -> bool:
+        """
+        Check if an app is unchanged since it was recorded, and its outputs are still there.
+        Only stats are needed, unless a source file was touched, in which case it is hashed again.
+
+        :param key: Key of the app.
+        :param source_paths: Paths of the files and directories the app is extracted from.
+        :param top_folder_directory: Top folder directory the paths are relative to.
+        """
+        entry = self.apps.get(key)
+        if entry is None:
+            return False
+
+        paths = expand_sources(source_paths)
+        if sorted(os.path.relpath(path, top_folder_directory) for path in paths) != sorted(entry["sources"]):
+            return False
+
+        for path in paths:
+            state = entry["sources"][os.path.relpath(path, top_folder_directory)]
+            try:
+                stat = os.stat(path)
+            except OSError:
+                if state is not None:
+                    return False
+                continue
+            if state is None or state[0] != stat.st_size:
+                return False
+            if state[1] != stat.st_mtime_ns:
+                # Touched but maybe not changed, e.g. rewritten with the same content
+                if file_digest(path) != state[2]:
+                    return False
+                state[1] = stat.st_mtime_ns
+
+        for output_name, (size, _) in entry["outputs"].items():
+            try:
+                if os.stat(os.path.join(self.target_directory, output_name)).st_size != size:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def record(self, key, sources, app_name, outputs):
+        """
+        Record an app after it was written.
+
+        :param key: Key of the app.
+        :param sources: State of the source files, as returned by stat_sources.
+        :param app_name: Final app name.
+        :param outputs: Produced files, as [size, hash] by file name, the hash being None for copied files.
+        """
+        self.apps[key] = {"sources": sources, "app_name": app_name, "outputs": outputs}
+
+    def quarantine(self, key, quarantined_outputs):
+        """
+        Record that outputs of an app were moved into the quarantine folder.
+        They are no longer expected in the output folder, so the app is not extracted again until its source files change.
+
+        :param key: Key of the app.
+        :param quarantined_outputs: File names in the quarantine folder, by output name.
+        """
+        entry = self.apps.get(key)
+        if entry is None:
+            return
+        entry["outputs"] = {output_name: state for output_name, state in entry["outputs"].items() if output_name not in quarantined_outputs}
+        entry["quarantined"] = {**entry.get("quarantined", {}), **quarantined_outputs}
+
+    def save(self):
+        """
+        Save the manifest into the output folder.
+        """
+        manifest = {"version": MANIFEST_VERSION, "phone_type": self.phone_type_name, "apps": self.apps}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, sort_keys=True)
+        os.replace(temp_path, self.path)
@@ -1,161 +1,134 @@
 import os
 from util.jam_utils import parse_props_plaintext
 from util.constants import ENCODINGS
+from util.structure_utils import NameRegistry
+from util.decoding import decode_file
 from urllib.parse import urlparse, parse_qs
 
-def post_process_SIMPLE(output_folder_path, verbose=False):
+RENAMED_EXTENSIONS = ['.jam', '.jar', '_mini.jar', '.sp', '.sdf']
+
+# Registered rename rules as (rule, description), in the order they are applied
+POSTPROCESS_RULES = []
+
+def get_registry(folder_path, registry=None):
     """
-    This function is a postprocessing script for the SIMPLE games. Sometimes, their links have 'dljar.jar' in them
-    which is valid, but then one of the link arguments have the real name. This script will fix that by renaming
-    the 'dljar.jar' to the real name.
+    Get the name registry for a folder, reusing the given one if it was made for the same folder.
     """
+    if registry is not None and registry.directory == os.path.abspath(folder_path):
+        return registry
+    return NameRegistry(folder_path)
+
+def rename_app(folder_path, jam_file, real_name, registry, verbose=False):
+    """
+    Rename the JAM file of an app and its corresponding JAR, mini JAR, SP and SDF files to the real name.
+    A `_N` suffix is added if the real name is already taken by another app.
+
+    :param folder_path: Folder containing the app files.
+    :param jam_file: File name of the JAM file.
+    :param real_name: New app name.
+    :param registry: NameRegistry of the folder.
+
+    :return: The new app name
+    """
+    app_name = os.path.splitext(jam_file)[0]
+    extensions = [ext for ext in RENAMED_EXTENSIONS if os.path.exists(os.path.join(folder_path, app_name + ext))]
+    registry.release(app_name, extensions)
+    new_name = registry.reserve(real_name, extensions)
+    for ext in extensions:
+        os.replace(os.path.join(folder_path, app_name + ext), os.path.join(folder_path, new_name + ext))
     if verbose:
-        print("Postprocessing SIMPLE games name pattern.")
-    for root, _, files in os.walk(output_folder_path):
-        for file in files:
-            if 'dljar' in file and file.endswith('.jam'):
-                for encoding in ENCODINGS:
-                    try:
-                        file_content = open(os.path.join(root, file), 'r', encoding=encoding).read()
-                        jam_props = parse_props_plaintext(file_content, False)
-                        package_url = jam_props.get('PackageURL', None) if jam_props else None
-                        if package_url:
-                            url_parsed = parse_qs(urlparse(package_url).query)
-                            # Get 'f' argument from the URL
-                            real_name = url_parsed.get('f', None)[0] if url_parsed else None
-                            if real_name:
-                                os.replace(os.path.join(root, file), os.path.join(root, real_name + '.jam'))
-                                # Find the corresponding .jar and .sp files with the same name as the current .jam
-                                # Rename them to the real name and append the extension
-                                for ext in ['.jar', '.sp', '.sdf']:
-                                    path = os.path.join(root, file.replace('.jam', ext))
-                                    if os.path.exists(path):
-                                        os.replace(path, os.path.join(root, real_name + ext))
-                            if verbose:
-                                print(f"Renamed: {file} -> {real_name}")
-                                break
-                    except UnicodeDecodeError:
-                        if verbose:
-                            print(f"Could not decode {file} with encoding {encoding}, trying next encoding.")
-                        continue
-                else:
-                    if verbose:
-                        print(f"Could not decode {file} with any encoding. Skipping.")
-                    continue
-
-def post_process_konami(output_folder_path, verbose=False):
-    if verbose:
-        print("Postprocessing Konami games name pattern.")
-    for root, _, files in os.walk(output_folder_path):
-        for file in files:
-            if file.endswith('.jam'):
-                for encoding in ENCODINGS:
-                    try:
-                        file_content = open(os.path.join(root, file), 'r', encoding=encoding).read()
-                        jam_props = parse_props_plaintext(file_content, False)
-                        package_url = jam_props.get('PackageURL', None) if jam_props else None
-                        if package_url:
-                            url_parsed = parse_qs(urlparse(package_url).query)
-                            # Get 'appliname' argument from the URL
-                            mid = url_parsed.get('appliname', None)
-                            if mid is not None:    
-                                real_name = url_parsed.get('appliname', None)[0] if url_parsed else None
-                                if real_name:
-                                    real_name = real_name.split('.')[0]
-                                    os.replace(os.path.join(root, file), os.path.join(root, real_name + '.jam'))
-                                    # Find the corresponding .jar and .sp files with the same name as the current .jam
-                                    # Rename them to the real name and append the extension
-                                    for ext in ['.jar', '.sp', '.sdf']:
-                                        path = os.path.join(root, file.replace('.jam', ext))
-                                        if os.path.exists(path):
-                                            os.replace(path, os.path.join(root, real_name + ext))
-                                    if verbose:
-                                        print(f"Renamed: {file} -> {real_name}")
-                                    break
-                        break
-                    except UnicodeDecodeError:
-                        if verbose:
-                            print(f"Could not decode {file} with encoding {encoding}, trying next encoding.")
-                        continue
-                else:
-                    if verbose:
-                        print(f"Could not decode {file} with any encoding. Skipping.")
-                    continue
-        
-def post_process_sonic_cafe(output_folder_path, verbose=False):
-    if verbose:
-        print("Postprocessing Sonic Cafe games name pattern.")
-    for root, _, files in os.walk(output_folder_path):
-        for file in files:
-            if file.endswith('.jam'):
-                for encoding in ENCODINGS:
-                    try:
-                        file_content = open(os.path.join(root, file), 'r', encoding=encoding).read()
-                        jam_props = parse_props_plaintext(file_content, False)
-                        package_url = jam_props.get('PackageURL', None) if jam_props else None
-                        if package_url:
-                            url_parsed = parse_qs(urlparse(package_url).query)
-                            # Get 'tgt' argument from the URL
-                            mid = url_parsed.get('tgt', None)
-                            if mid is not None:    
-                                real_name = url_parsed.get('tgt', None)[0] if url_parsed else None
-                                if real_name:
-                                    real_name = real_name.split('.')[0]
-                                    os.replace(os.path.join(root, file), os.path.join(root, real_name + '.jam'))
-                                    # Find the corresponding .jar and .sp files with the same name as the current .jam
-                                    # Rename them to the real name and append the extension
-                                    for ext in ['.jar', '.sp', '.sdf']:
-                                        path = os.path.join(root, file.replace('.jam', ext))
-                                        if os.path.exists(path):
-                                            os.replace(path, os.path.join(root, real_name + ext))
-                                    if verbose:
-                                        print(f"Renamed: {file} -> {real_name}")
-                                    break
-                        break
-                    except UnicodeDecodeError:
-                        if verbose:
-                            print(f"Could not decode {file} with encoding {encoding}, trying next encoding.")
-                        continue
-                else:
-                    if verbose:
-                        print(f"Could not decode {file} with any encoding. Skipping.")
-                    continue
-
-def post_process_genki(output_folder_path, verbose=False):
+        print(f"Renamed: {jam_file} -> {new_name}")
+    return new_name
+
+def read_jam_props(jam_file_path, verbose=False):
+    """
+    Read a plaintext JAM file once and parse its properties, trying every encoding.
+
+    :param jam_file_path: Path to the JAM file.
+
+    :return: A read-only mapping of JAM properties, or None if the file could not be decoded
+    """
+    content, _ = decode_file(jam_file_path, ENCODINGS, verbose=verbose)
+    if content is None:
+        if verbose:
+            print(f"Could not decode {os.path.basename(jam_file_path)} with any encoding. Skipping.")
+        return None
+    return parse_props_plaintext(content, False)
+
+def postprocess_rule(description):
+    """
+    Decorator to register a rename rule. A rule takes the current app name and the parsed query
+    arguments of the PackageURL, and returns the real name or None if it does not apply.
+
+    :param description: Description of the rule.
+    """
+    def register(rule):
+        POSTPROCESS_RULES.append((rule, description))
+        return rule
+    return register
+
+@postprocess_rule("Rename SIMPLE games (use if you see many 'dljar' files)")
+def rename_SIMPLE(app_name, query):
+    # Their links have 'dljar.jar' in them which is valid, but the 'f' argument has the real name
+    if 'dljar' in app_name:
+        return query.get('f', [None])[0]
+
+@postprocess_rule("Rename Konami games by using the 'appliname' field in the link")
+def rename_konami(app_name, query):
+    if 'appliname' in query:
+        return query['appliname'][0].split('.')[0]
+
+@postprocess_rule("Rename Sonic Cafe games by using 'tgt' field in the link")
+def rename_sonic_cafe(app_name, query):
+    if 'tgt' in query:
+        return query['tgt'][0].split('.')[0]
+
+@postprocess_rule("Rename Genki games by using 'name' field in the link")
+def rename_genki(app_name, query):
+    if 'name' in query:
+        return query['name'][0].split('.')[0]
+
+def find_real_name(app_name, package_url, rules=None):
+    """
+    Evaluate the rename rules against a PackageURL. Rules are applied in registration order,
+    each one seeing the name given by the previous ones, so the last matching rule wins.
+
+    :param app_name: Current app name.
+    :param package_url: PackageURL of the app.
+    :param rules: Rule functions to evaluate, all registered rules by default.
+
+    :return: The real name, or None if no rule applies
+    """
+    if rules is None:
+        rules = [rule for rule, _ in POSTPROCESS_RULES]
+    query = parse_qs(urlparse(package_url).query)
+    real_name = None
+    for rule in rules:
+        name = rule(real_name or app_name, query)
+        if name:
+            real_name = name
+    return real_name
+
+def post_process(output_folder_path, verbose=False, registry=None, rules=None):
+    """
+    Rename the apps in the output folder by the rename rules, in a single walk.
+    Each JAM file is read and parsed only once, whatever the number of rules.
+
+    :param output_folder_path: Output folder to rename apps in.
+    :param registry: NameRegistry of the output folder, if there is one already.
+    :param rules: Rule functions to evaluate, all registered rules by default.
+    """
     if verbose:
-        print("Postprocessing Genki games name pattern.")
+        print("Postprocessing app names.")
     for root, _, files in os.walk(output_folder_path):
-        for file in files:
-            if file.endswith('.jam'):
-                for encoding in ENCODINGS:
-                    try:
-                        file_content = open(os.path.join(root, file), 'r', encoding=encoding).read()
-                        jam_props = parse_props_plaintext(file_content, False)
-                        package_url = jam_props.get('PackageURL', None) if jam_props else None
-                        if package_url:
-                            url_parsed = parse_qs(urlparse(package_url).query)
-                            # Get 'name' argument from the URL
-                            mid = url_parsed.get('name', None)
-                            if mid is not None:    
-                                real_name = url_parsed.get('name', None)[0] if url_parsed else None
-                                if real_name:
-                                    real_name = real_name.split('.')[0]
-                                    os.replace(os.path.join(root, file), os.path.join(root, real_name + '.jam'))
-                                    # Find the corresponding .jar and .sp files with the same name as the current .jam
-                                    # Rename them to the real name and append the extension
-                                    for ext in ['.jar', '.sp', '.sdf']:
-                                        path = os.path.join(root, file.replace('.jam', ext))
-                                        if os.path.exists(path):
-                                            os.replace(path, os.path.join(root, real_name + ext))
-                                    if verbose:
-                                        print(f"Renamed: {file} -> {real_name}")
-                                    break
-                        break
-                    except UnicodeDecodeError:
-                        if verbose:
-                            print(f"Could not decode {file} with encoding {encoding}, trying next encoding.")
-                        continue
-                else:
-                    if verbose:
-                        print(f"Could not decode {file} with any encoding. Skipping.")
-                    continue
\ No newline at end of file
+        root_registry = get_registry(root, registry)
+        for file in sorted(files):
+            if not file.endswith('.jam'):
+                continue
+            jam_props = read_jam_props(os.path.join(root, file), verbose=verbose)
+            package_url = jam_props.get('PackageURL', None) if jam_props else None
+            if not package_url:
+                continue
+            real_name = find_real_name(os.path.splitext(file)[0], package_url, rules)
+            if real_name:
+                rename_app(root, file, real_name, root_registry, verbose=verbose)
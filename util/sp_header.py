@@ -0,0 +1,76 @@
+"""
+This module contains the encoding, decoding and checks of the SP size header found at the start of SP files.
+"""
+
+import struct
+
+# The header holds up to 16 little-endian sizes, padded with 0xFFFFFFFF
+SP_HEADER_WORDS = 16
+SP_HEADER_PADDING = 0xFFFFFFFF
+SP_HEADER = struct.Struct(f"<{SP_HEADER_WORDS}I")
+SP_HEADER_BIG_ENDIAN = struct.Struct(f">{SP_HEADER_WORDS}I")
+SP_HEADER_SIZE = SP_HEADER.size
+
+def encode_sp_header(sp_sizes) -> bytes:
+    """
+    Encode SP sizes into an SP header, padded to 16 sizes.
+    More than 16 sizes make a longer header, without padding.
+
+    :param sp_sizes: List of SP sizes.
+
+    :return: The SP header
+    :raises struct.error: If a size does not fit in 32 bits
+    """
+    if len(sp_sizes) <= SP_HEADER_WORDS:
+        return SP_HEADER.pack(*sp_sizes, *[SP_HEADER_PADDING] * (SP_HEADER_WORDS - len(sp_sizes)))
+    return struct.pack(f"<{len(sp_sizes)}I", *sp_sizes)
+
+def decode_sp_header(buffer, offset=0) -> list:
+    """
+    Decode the SP sizes of an SP header, without its padding.
+    The header is read in place, a buffer ending before its end is read up to its end.
+
+    :param buffer: Bytes-like object holding the header.
+    :param offset: Offset of the header in the buffer.
+
+    :return: A list of SP sizes
+    :raises struct.error: If the buffer ends in the middle of a size
+    """
+    if 0 <= offset and len(buffer) - offset >= SP_HEADER_SIZE:
+        words = SP_HEADER.unpack_from(buffer, offset)
+    else:
+        words = [word for word, in struct.iter_unpack("<I", buffer[offset:offset + SP_HEADER_SIZE])]
+    return [word for word in words if word != SP_HEADER_PADDING]
+
+def swap_sp_header(header) -> bytes:
+    """
+    Swap the endianness of every size of an SP header. The padding reads the same in both endiannesses.
+
+    :param header: SP header, as any bytes-like object.
+
+    :return: The swapped header
+    :raises struct.error: If the header ends in the middle of a size
+    """
+    if len(header) == SP_HEADER_SIZE:
+        return SP_HEADER_BIG_ENDIAN.pack(*SP_HEADER.unpack(header))
+    words = [word for word, in struct.iter_unpack("<I", header)]
+    return struct.pack(f">{len(words)}I", *words)
+
+def verify_sp(spsize, jam_spsize_str):
+    jam_spsize = sum([int(n) for n in jam_spsize_str.split(",")])
+    return spsize == jam_spsize
+
+def verify_sp_header(header, jam_spsize_str) -> bool:
+    """
+    Check that an SP header holds the SP sizes of a JAM, so their total is the one verify_sp checks the SP against.
+
+    :param header: SP header, as any bytes-like object.
+    :param jam_spsize_str: SPsize of the JAM.
+
+    :return: True if the header is the one of the SPsize
+    :raises ValueError: If the SPsize is not a list of numbers
+    """
+    try:
+        return bytes(header) == encode_sp_header([int(n) for n in jam_spsize_str.split(",")])
+    except struct.error:
+        return False
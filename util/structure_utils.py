@@ -1,12 +1,154 @@
 import os
+import threading
+from util.constants import DETECTION_PREFIX_SIZE
 
-def create_target_folder(top_folder_directory):
-    # Create the target directory at the same level as the top folder directory
-    target_directory = os.path.join(os.path.dirname(top_folder_directory), 'output')
+COPY_CHUNK_SIZE = 1 << 20
+
+def create_target_folder(top_folder_directory, target_directory=None):
+    # Create the target directory at the same level as the top folder directory, unless given
+    if target_directory is None:
+        target_directory = os.path.join(os.path.dirname(top_folder_directory), 'output')
     if not os.path.exists(target_directory):
         os.makedirs(target_directory)
     return target_directory
 
+def copy_range(src_path, dst_file, offset=0, length=None) -> int:
+    """
+    Copy a range of a file at the current position of another one.
+    The copy is done by the kernel with copy_file_range or sendfile where available, in chunks otherwise.
+
+    :param src_path: Path to the source file.
+    :param dst_file: Destination file object opened in binary mode.
+    :param offset: Offset of the range in the source file.
+    :param length: Length of the range, up to the end of the source file if None.
+
+    :return: Number of bytes copied
+    """
+    return copy_ranges(src_path, dst_file, [(offset, length)])
+
+def copy_ranges(src_path, dst_file, ranges) -> int:
+    """
+    Copy ranges of a file one after the other at the current position of another one, opening the source file once.
+
+    :param src_path: Path to the source file.
+    :param dst_file: Destination file object opened in binary mode.
+    :param ranges: Iterable of (offset, length) ranges, a length of None meaning up to the end of the source file.
+
+    :return: Number of bytes copied
+    """
+    copied = 0
+    with open(src_path, 'rb') as src:
+        size = os.fstat(src.fileno()).st_size
+        for offset, length in ranges:
+            if length is None:
+                length = max(0, size - offset)
+            copied += _copy_file_object_range(src, dst_file, offset, length)
+    return copied
+
+def _copy_file_object_range(src, dst_file, offset, length) -> int:
+    # Anything written before, e.g. a header, must be in the file before the kernel writes after it
+    dst_file.flush()
+    copied = 0
+
+    for kernel_copy in (getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)):
+        if kernel_copy is None:
+            continue
+        try:
+            while copied < length:
+                if kernel_copy is os.sendfile:
+                    count = os.sendfile(dst_file.fileno(), src.fileno(), offset + copied, length - copied)
+                else:
+                    count = kernel_copy(src.fileno(), dst_file.fileno(), length - copied, offset + copied)
+                if count == 0:
+                    # End of the source file
+                    return copied
+                copied += count
+            return copied
+        except OSError:
+            # Not supported for these files, e.g. across file systems, go on with the next method
+            continue
+
+    src.seek(offset + copied)
+    while copied < length:
+        chunk = src.read(min(COPY_CHUNK_SIZE, length - copied))
+        if not chunk:
+            break
+        dst_file.write(chunk)
+        copied += len(chunk)
+    return copied
+
+class NameRegistry:
+    """
+    A class to allocate unique app names in an output folder.
+
+    The registry is seeded with a single scan of the folder, so collision checks are done in memory.
+    Duplicates get a `_N` suffix counted per name, so the result only depends on the order names are reserved in.
+    """
+
+    def __init__(self, directory=None):
+        """
+        Initialize the registry.
+
+        :param directory: Folder the names are allocated in. Existing files in it are considered taken.
+        """
+        self.directory = os.path.abspath(directory) if directory is not None else None
+        self._lock = threading.Lock()
+        self._taken = set()
+        self._counters = {}
+        if directory is not None and os.path.isdir(directory):
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    self._taken.add(os.path.normcase(entry.name))
+
+    def __getstate__(self):
+        # Locks cannot be pickled, e.g. when the owning phone type is sent to worker processes
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _is_free(self, name, suffixes):
+        return not any(os.path.normcase(f"{name}{suffix}") in self._taken for suffix in suffixes)
+
+    def reserve(self, name, suffixes=(".jam",)):
+        """
+        Reserve a name for an app. If any of its files is already taken, a `_N` suffix is added.
+
+        :param name: Preferred app name.
+        :param suffixes: Suffixes of the files that will be written for the app, including the extension.
+
+        :return: The reserved app name
+        """
+        suffixes = tuple(suffixes) or (".jam",)
+        with self._lock:
+            reserved_name = name
+            if not self._is_free(name, suffixes):
+                key = os.path.normcase(name)
+                count = self._counters.get(key, 0)
+                while True:
+                    count += 1
+                    reserved_name = f"{name}_{count}"
+                    if self._is_free(reserved_name, suffixes):
+                        break
+                self._counters[key] = count
+            for suffix in suffixes:
+                self._taken.add(os.path.normcase(f"{reserved_name}{suffix}"))
+            return reserved_name
+
+    def release(self, name, suffixes=(".jam",)):
+        """
+        Release the files of an app, e.g. after it has been renamed.
+
+        :param name: App name to release.
+        :param suffixes: Suffixes of the files to release, including the extension.
+        """
+        with self._lock:
+            for suffix in suffixes:
+                self._taken.discard(os.path.normcase(f"{name}{suffix}"))
+
 def inject_jam_into_folder(java_folder_path, id, jam_file, verbose=False):
     # Find folder with id filled upto two digits and insert as 'jam'
     if not os.path.exists(java_folder_path):
@@ -20,4 +162,147 @@ def inject_jam_into_folder(java_folder_path, id, jam_file, verbose=False):
     with open(os.path.join(java_folder_path, f"{int(id):02}", "jam"), "w", encoding="cp932") as f:
         f.write(jam_file)
     if verbose:
-        print(f"Injected JAM into folder {id}.")
\ No newline at end of file
+        print(f"Injected JAM into folder {id}.")
+
+class DirectoryListing:
+    """
+    A class to represent a cached listing of a top folder directory, shared by the structure tests of all phone types.
+
+    Every directory is scanned at most once, and files are only read up to a bounded prefix, so detecting
+    the phone type of a dump does not depend on the size of the files in it.
+    """
+
+    def __init__(self, top_folder_directory, prefix_size=DETECTION_PREFIX_SIZE):
+        """
+        Initialize the listing. Nothing is scanned until it is needed.
+
+        :param top_folder_directory: Top folder directory to list.
+        :param prefix_size: Maximum number of bytes read from a file.
+        """
+        self.top_folder_directory = top_folder_directory
+        self.prefix_size = prefix_size
+        self._entries = {}
+        self._normcased = {}
+        self._prefixes = {}
+
+    def path(self, *parts):
+        """
+        Get the full path of an entry.
+
+        :param parts: Path components relative to the top folder directory.
+        """
+        return os.path.join(self.top_folder_directory, *parts)
+
+    def entries(self, *parts) -> dict:
+        """
+        Get the entries of a directory, scanning it on first use.
+
+        :param parts: Path components of the directory relative to the top folder directory.
+
+        :return: A dictionary of entry name to whether it is a directory, empty if the directory does not exist
+        """
+        key = os.path.join(*parts) if parts else ""
+        entries = self._entries.get(key)
+        if entries is None:
+            entries = {}
+            try:
+                with os.scandir(self.path(key)) as it:
+                    for entry in it:
+                        try:
+                            entries[entry.name] = entry.is_dir()
+                        except OSError:
+                            entries[entry.name] = False
+            except OSError:
+                pass
+            self._entries[key] = entries
+            self._normcased[key] = {os.path.normcase(name) for name in entries}
+        return entries
+
+    def listdir(self, *parts) -> list:
+        """
+        List the entry names of a directory, like os.listdir.
+
+        :param parts: Path components of the directory relative to the top folder directory.
+        """
+        return list(self.entries(*parts))
+
+    def exists(self, *parts) -> bool:
+        """
+        Check if an entry exists, like os.path.exists.
+
+        :param parts: Path components of the entry relative to the top folder directory.
+        """
+        if not parts:
+            return os.path.isdir(self.top_folder_directory)
+        self.entries(*parts[:-1])
+        return os.path.normcase(parts[-1]) in self._normcased[os.path.join(*parts[:-1]) if parts[:-1] else ""]
+
+    def isdir(self, *parts) -> bool:
+        """
+        Check if an entry is a directory, like os.path.isdir.
+
+        :param parts: Path components of the entry relative to the top folder directory.
+        """
+        if not parts:
+            return os.path.isdir(self.top_folder_directory)
+        return self.entries(*parts[:-1]).get(parts[-1], False)
+
+    def isfile(self, *parts) -> bool:
+        """
+        Check if an entry is a file, like os.path.isfile.
+
+        :param parts: Path components of the entry relative to the top folder directory.
+        """
+        if not parts:
+            return False
+        entries = self.entries(*parts[:-1])
+        return parts[-1] in entries and not entries[parts[-1]]
+
+    def read_prefix(self, *parts) -> bytes:
+        """
+        Read the start of a file, up to the prefix size of the listing.
+
+        :param parts: Path components of the file relative to the top folder directory.
+
+        :return: The prefix of the file, empty if it cannot be read
+        """
+        key = os.path.join(*parts)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            try:
+                with open(self.path(key), 'rb') as f:
+                    prefix = f.read(self.prefix_size)
+            except OSError:
+                prefix = b""
+            self._prefixes[key] = prefix
+        return prefix
+
+    def file_contains(self, needle, *parts) -> bool:
+        """
+        Check if a file contains some bytes. The rest of the file is only read if its prefix does not contain them.
+
+        :param needle: Bytes to search for.
+        :param parts: Path components of the file relative to the top folder directory.
+
+        :return: True if the file contains the bytes, False otherwise or if it cannot be read
+        """
+        prefix = self.read_prefix(*parts)
+        if needle in prefix:
+            return True
+        if len(prefix) < self.prefix_size:
+            # The prefix is the whole file
+            return False
+
+        # Bytes across the end of the prefix are searched again
+        overlap = len(needle) - 1
+        try:
+            with open(self.path(os.path.join(*parts)), 'rb') as f:
+                f.seek(len(prefix) - overlap)
+                rest = b""
+                while chunk := f.read(1 << 20):
+                    rest = rest[len(rest) - overlap:] + chunk if overlap else chunk
+                    if needle in rest:
+                        return True
+        except OSError:
+            pass
+        return False
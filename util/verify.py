@@ -1,16 +1,391 @@
 import zipfile
+import struct
+import mmap
+import json
 import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from util.manifest import new_digest, file_digest
+from util.postprocess import read_jam_props
+from util.sp_header import verify_sp, verify_sp_header
+from util.structure_utils import NameRegistry
 
-def verify_jar(jar_data):
-    if jar_data[0:4] != b"PK\x03\x04":
+VERIFY_MODES = ["structural", "full"]
+VERDICT_CACHE_FILE_NAME = ".kttools_verdicts.json"
+VERIFICATION_REPORT_FILE_NAME = ".kttools_verification.json"
+QUARANTINE_FOLDER_NAME = "quarantine"
+
+# Zip records, see zipfile
+END_OF_CENTRAL_DIRECTORY = struct.Struct("<4s4H2LH")
+CENTRAL_DIRECTORY_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+LOCAL_FILE_HEADER = struct.Struct("<4s2B4HL2L2H")
+MAX_COMMENT_SIZE = 0xFFFF
+# Stored, deflated, bzip2 and lzma, the compression methods zipfile can test
+SUPPORTED_COMPRESSIONS = {0, 8, 12, 14}
+
+class MemoryViewReader(io.RawIOBase):
+    """
+    A class to represent a read-only seekable file over a bytes-like object, without copying it.
+    """
+
+    def __init__(self, data):
+        self.view = memoryview(data).cast("B")
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.view[self.position:self.position + len(buffer)]
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self.view.release()
+        super().close()
+
+def verify_jar_structure(view) -> bool:
+    """
+    Check that the end of central directory record, the central directory and the local file headers of a JAR
+    are consistent, without decompressing anything.
+
+    :param view: Memoryview of the JAR contents.
+
+    :return: True if the structure is valid, False otherwise, or None for ZIP64 archives which are not checked this way
+    """
+    if view[0:4] != b"PK\x03\x04":
+        return False
+
+    # The end of central directory record is at the end, followed by a comment of at most 64 KiB
+    tail_start = max(0, len(view) - MAX_COMMENT_SIZE - END_OF_CENTRAL_DIRECTORY.size)
+    eocd_position = bytes(view[tail_start:]).rfind(b"PK\x05\x06")
+    if eocd_position == -1:
+        return False
+    eocd_position += tail_start
+    if eocd_position + END_OF_CENTRAL_DIRECTORY.size > len(view):
         return False
-    
+    # Disk numbers and the entry count of the disk are ignored, like zipfile does
+    _, _, _, _, total_entries, cd_size, cd_offset, comment_size = END_OF_CENTRAL_DIRECTORY.unpack_from(view, eocd_position)
+    if eocd_position + END_OF_CENTRAL_DIRECTORY.size + comment_size > len(view):
+        return False
+    if total_entries == 0xFFFF or 0xFFFFFFFF in (cd_size, cd_offset):
+        # ZIP64 archives are left to the full check
+        return None
+    # Data prepended to the archive shifts all offsets
+    concat = eocd_position - cd_size - cd_offset
+    if concat < 0:
+        return False
+    cd_offset += concat
+
+    position = cd_offset
+    for _ in range(total_entries):
+        if position + CENTRAL_DIRECTORY_HEADER.size > eocd_position:
+            return False
+        (signature, _, _, _, _, flag_bits, compress_type, _, _, _, compress_size, file_size,
+         name_size, extra_size, comment_size, _, _, _, header_offset) = CENTRAL_DIRECTORY_HEADER.unpack_from(view, position)
+        if signature != b"PK\x01\x02":
+            return False
+        if 0xFFFFFFFF in (compress_size, file_size, header_offset):
+            return None
+        header_offset += concat
+        name = view[position + CENTRAL_DIRECTORY_HEADER.size:position + CENTRAL_DIRECTORY_HEADER.size + name_size]
+        position += CENTRAL_DIRECTORY_HEADER.size + name_size + extra_size + comment_size
+
+        # Encrypted entries cannot be tested, and unknown compressions cannot be read
+        if flag_bits & 0x1 or compress_type not in SUPPORTED_COMPRESSIONS:
+            return False
+
+        if header_offset + LOCAL_FILE_HEADER.size > cd_offset:
+            return False
+        local_signature, _, _, _, local_compress_type, _, _, _, _, _, local_name_size, local_extra_size = LOCAL_FILE_HEADER.unpack_from(view, header_offset)
+        if local_signature != b"PK\x03\x04" or local_compress_type != compress_type:
+            return False
+        data_start = header_offset + LOCAL_FILE_HEADER.size
+        if view[data_start:data_start + local_name_size] != name:
+            return False
+        if data_start + local_name_size + local_extra_size + compress_size > cd_offset:
+            return False
+
+    return position == eocd_position
+
+def verify_jar_full(jar_file) -> bool:
+    """
+    Decompress every entry of a JAR and check its CRC.
+
+    :param jar_file: Path to the JAR file, or a seekable file object.
+
+    :return: True if all entries are valid, False otherwise
+    """
     try:
-        with io.BytesIO(jar_data) as jar_stream, zipfile.ZipFile(jar_stream, "r") as f:
+        with zipfile.ZipFile(jar_file, "r") as f:
             return f.testzip() is None
     except Exception:
         return False
 
-def verify_sp(spsize, jam_spsize_str):
-    jam_spsize = sum([int(n) for n in jam_spsize_str.split(",")])
-    return spsize == jam_spsize
\ No newline at end of file
+def verify_jar(jar_data, mode="full", cache=None) -> bool:
+    """
+    Verify a JAR, either from its structure only or by testing all its entries.
+
+    :param jar_data: JAR contents as a bytes-like object, or path to the JAR file.
+    :param mode: "structural" to check the headers and directories of the archive without decompressing it,
+                 "full" to also decompress every entry and check its CRC.
+    :param cache: VerdictCache to look the verdict up in and record it to, by content hash.
+
+    :return: True if the JAR is valid, False otherwise
+    """
+    if mode not in VERIFY_MODES:
+        raise ValueError(f"Unknown verification mode {mode}")
+    is_path = isinstance(jar_data, (str, os.PathLike))
+
+    digest = None
+    if cache is not None:
+        if is_path:
+            digest = file_digest(jar_data)
+        else:
+            digest = new_digest()
+            digest.update(jar_data)
+            digest = digest.hexdigest()
+        verdict = cache.get(digest, mode)
+        if verdict is not None:
+            return verdict
+
+    if is_path:
+        try:
+            with open(jar_data, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as jar_map:
+                verdict = _verify_jar_buffer(jar_map, mode, jar_data)
+        except (OSError, ValueError):
+            # Missing or empty file
+            verdict = False
+    else:
+        verdict = _verify_jar_buffer(jar_data, mode, None)
+
+    if cache is not None:
+        cache.set(digest, mode, verdict)
+    return verdict
+
+def _verify_jar_buffer(buffer, mode, path):
+    with memoryview(buffer) as view:
+        try:
+            structure = verify_jar_structure(view)
+        except struct.error:
+            return False
+        if structure is False:
+            return False
+        if mode == "structural" and structure:
+            return True
+        if path is not None:
+            return verify_jar_full(path)
+        # BytesIO shares the memory of bytes objects, other buffers are read in place
+        with (io.BytesIO(buffer) if isinstance(buffer, bytes) else MemoryViewReader(view)) as jar_stream:
+            return verify_jar_full(jar_stream)
+
+class VerdictCache:
+    """
+    A class to cache JAR verdicts by content hash and verification mode, so identical JARs are only verified once.
+    """
+
+    def __init__(self, path=None):
+        """
+        Initialize the cache, loading the verdicts saved in a file if any.
+
+        :param path: Path to the JSON file the verdicts are saved in, or None to only keep them in memory.
+        """
+        self.path = path
+        self.verdicts = {}
+        self.added = {}
+        if path is not None:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.verdicts = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def get(self, digest, mode):
+        """
+        Get the verdict of a JAR.
+
+        :param digest: Content hash of the JAR.
+        :param mode: Verification mode.
+
+        :return: The verdict, or None if the JAR was not verified in this mode
+        """
+        return self.verdicts.get(f"{mode}:{digest}")
+
+    def set(self, digest, mode, verdict):
+        """
+        Record the verdict of a JAR.
+
+        :param digest: Content hash of the JAR.
+        :param mode: Verification mode.
+        :param verdict: True if the JAR is valid, False otherwise.
+        """
+        self.verdicts[f"{mode}:{digest}"] = verdict
+        self.added[f"{mode}:{digest}"] = verdict
+
+    def take_added(self) -> dict:
+        """
+        Get the verdicts recorded since the last call, e.g. to send them back from a worker process.
+        """
+        added, self.added = self.added, {}
+        return added
+
+    def update(self, verdicts):
+        """
+        Add verdicts, as returned by take_added.
+        """
+        self.verdicts.update(verdicts)
+
+    def save(self):
+        """
+        Save the verdicts into the file of the cache, if any.
+        """
+        if self.path is None:
+            return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.verdicts, f, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+def verify_app_outputs(target_directory, app_name, output_names, mode="structural", cache=None, problems=()) -> dict:
+    """
+    Verify the JAR files of an extracted app, and the size and header of its SP against the SPsize of its JAM.
+    Problems found while the app was processed make it fail as well.
+
+    :param target_directory: Output folder the app was extracted into.
+    :param app_name: Final app name.
+    :param output_names: File names of the outputs of the app.
+    :param mode: Verification mode of the JARs, "structural" or "full".
+    :param cache: VerdictCache to look the JAR verdicts up in.
+    :param problems: Messages of the problems found while the app was processed, e.g. SP segments not matching the SPsize.
+
+    :return: A dictionary with the verdict of every JAR, the SP size check if any, the problems and whether the app is "ok"
+    """
+    result = {"app_name": app_name, "mode": mode, "jars": {}, "sp": None, "problems": list(problems), "ok": not problems}
+    for output_name in output_names:
+        if output_name.lower().endswith(".jar"):
+            verdict = verify_jar(os.path.join(target_directory, output_name), mode, cache)
+            result["jars"][output_name] = verdict
+            result["ok"] = result["ok"] and verdict
+
+    jam_name, sp_name = f"{app_name}.jam", f"{app_name}.sp"
+    if jam_name in output_names and sp_name in output_names:
+        jam_props = read_jam_props(os.path.join(target_directory, jam_name)) or {}
+        jam_spsize = jam_props.get("SPsize")
+        if jam_spsize:
+            try:
+                # The SP starts with a size header of at least 16 sizes
+                header_size = 4 * max(16, len(jam_spsize.split(",")))
+                with open(os.path.join(target_directory, sp_name), 'rb') as f:
+                    header = f.read(header_size)
+                    sp_size = os.fstat(f.fileno()).st_size - header_size
+                header_ok = verify_sp_header(header, jam_spsize)
+                result["sp"] = {"size": sp_size, "SPsize": jam_spsize, "header": header_ok, "ok": header_ok and verify_sp(sp_size, jam_spsize)}
+            except ValueError:
+                result["sp"] = {"size": None, "SPsize": jam_spsize, "header": False, "ok": False}
+            result["ok"] = result["ok"] and result["sp"]["ok"]
+    return result
+
+def load_verification_results(report_path) -> dict:
+    """
+    Load the results of the verification report written by an earlier run.
+
+    :param report_path: Path to the verification report.
+
+    :return: A dictionary of the results by app name, empty if there is no valid report
+    """
+    try:
+        with open(report_path, 'r', encoding='utf-8') as f:
+            return {result["app_name"]: result for result in json.load(f)["apps"]}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+def quarantine_app(target_directory, quarantine_registry, app_name, output_names) -> tuple:
+    """
+    Move the files of an app into the quarantine folder, under a name not taken by the apps quarantined before.
+
+    :param target_directory: Output folder the app was extracted into.
+    :param quarantine_registry: NameRegistry of the quarantine folder.
+    :param app_name: Final app name.
+    :param output_names: File names of the outputs of the app.
+
+    :return: A tuple of the file names in the quarantine folder by output name, for the files moved,
+             and the messages of the moves that failed
+    """
+    suffixes = [output_name[len(app_name):] for output_name in output_names]
+    quarantine_name = quarantine_registry.reserve(app_name, suffixes)
+    quarantine_directory = quarantine_registry.directory
+    moved = {}
+    errors = []
+    for output_name, suffix in zip(output_names, suffixes):
+        try:
+            os.replace(os.path.join(target_directory, output_name), os.path.join(quarantine_directory, f"{quarantine_name}{suffix}"))
+            moved[output_name] = f"{quarantine_name}{suffix}"
+        except OSError as e:
+            errors.append(f"{output_name}: {e}")
+    return moved, errors
+
+def verify_outputs(target_directory, apps, mode="structural", jobs=1, cache=None, quarantine=False, verbose=False, problems=None, kept_apps=None) -> dict:
+    """
+    Verify the outputs of extracted apps in parallel, and write a report of the verification into the output folder.
+    The results of the apps verified by earlier runs and not written again are kept in the report.
+
+    Apps are verified on threads, the decompression, hashing and file reads of the checks running outside of the GIL.
+
+    :param target_directory: Output folder the apps were extracted into.
+    :param apps: Dictionary of the file names of the outputs by app name.
+    :param mode: Verification mode of the JARs, "structural" or "full".
+    :param jobs: Number of threads to verify apps with.
+    :param cache: VerdictCache to look the JAR verdicts up in and record them to.
+    :param quarantine: Move all the files of the apps failing verification into a quarantine folder.
+    :param problems: Dictionary of the problems found while processing the apps, by app name.
+    :param kept_apps: Names of the apps whose results of earlier runs are kept, e.g. the apps still in the manifest. All of them if None.
+
+    :return: The report, with the number of apps checked and failed by this run and the result for every app
+    """
+    problems = problems or {}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        results = list(executor.map(lambda item: verify_app_outputs(target_directory, item[0], item[1], mode, cache, problems.get(item[0], ())), apps.items()))
+
+    failed = [result for result in results if not result["ok"]]
+    quarantine_registry = None
+    for result in failed:
+        if verbose:
+            print(f"Warning: {result['app_name']} failed verification: JARs {result['jars']}, SP {result['sp']}, problems {result['problems']}")
+        if quarantine:
+            if quarantine_registry is None:
+                quarantine_directory = os.path.join(target_directory, QUARANTINE_FOLDER_NAME)
+                os.makedirs(quarantine_directory, exist_ok=True)
+                quarantine_registry = NameRegistry(quarantine_directory)
+            result["quarantine_files"], errors = quarantine_app(target_directory, quarantine_registry, result["app_name"], apps[result["app_name"]])
+            result["quarantined"] = not errors
+            if errors:
+                result["quarantine_errors"] = errors
+                print(f"Warning: {result['app_name']} could not be fully quarantined: {' '.join(errors)}")
+
+    report_path = os.path.join(target_directory, VERIFICATION_REPORT_FILE_NAME)
+    previous_results = load_verification_results(report_path)
+    for result in results:
+        previous_results.pop(result["app_name"], None)
+    kept_results = [result for app_name, result in previous_results.items() if kept_apps is None or app_name in kept_apps]
+
+    report = {"mode": mode, "checked": len(results), "failed": len(failed), "apps": kept_results + results}
+    temp_path = report_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    os.replace(temp_path, report_path)
+    return report